@@ -0,0 +1,228 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 准入控制配置
+MAX_UPSTREAM_SESSIONS = int(os.getenv("MAX_UPSTREAM_SESSIONS", "50"))  # 每个worker的上游会话总数上限
+MAX_SESSIONS_PER_USER = int(os.getenv("MAX_SESSIONS_PER_USER", "2"))  # 每个用户的并发会话上限
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "30"))  # 排队最长等待时间（秒）
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))  # 队列长度超过该值时直接拒绝
+ADMISSION_MAX_LOOP_LAG_MS = float(os.getenv("ADMISSION_MAX_LOOP_LAG_MS", "200"))  # 事件循环延迟超过该值时拒绝新会话
+LOOP_LAG_INTERVAL = 0.5  # 事件循环延迟采样间隔（秒）
+
+
+class AdmissionRejected(Exception):
+    """会话未被准入"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Waiter:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.event = asyncio.Event()
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class Ticket:
+    """已准入的会话凭证，离开时释放名额"""
+
+    def __init__(self, controller, user_id):
+        self.controller = controller
+        self.user_id = user_id
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self.user_id)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class AdmissionController:
+    """上游会话准入控制：全局/单用户名额、公平排队和过载保护"""
+
+    def __init__(
+        self,
+        max_global: int = MAX_UPSTREAM_SESSIONS,
+        max_per_user: int = MAX_SESSIONS_PER_USER,
+        max_wait: float = ADMISSION_MAX_WAIT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        max_loop_lag_ms: float = ADMISSION_MAX_LOOP_LAG_MS,
+    ):
+        self.max_global = max_global
+        self.max_per_user = max_per_user
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.max_loop_lag_ms = max_loop_lag_ms
+
+        self.active = 0
+        self.active_by_user = {}
+        self.queue = deque()
+        self.loop_lag_ms = 0.0
+        self._lag_task = None
+
+        self.admitted_total = 0
+        self.rejected_total = {}
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _has_capacity(self, user_id) -> bool:
+        return (
+            self.active < self.max_global
+            and self.active_by_user.get(user_id, 0) < self.max_per_user
+        )
+
+    def _grant(self, user_id):
+        self.active += 1
+        self.active_by_user[user_id] = self.active_by_user.get(user_id, 0) + 1
+        self.admitted_total += 1
+
+    def _reject(self, reason: str):
+        self.rejected_total[reason] = self.rejected_total.get(reason, 0) + 1
+        logger.warning(f"拒绝上游会话: {reason}")
+        raise AdmissionRejected(reason)
+
+    def _record_wait(self, waiter):
+        waited = time.monotonic() - waiter.enqueued_at
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+    def position(self, waiter) -> int:
+        """返回等待者在队列中的位置（从1开始）"""
+        for index, queued in enumerate(self.queue):
+            if queued is waiter:
+                return index + 1
+        return 0
+
+    async def acquire(self, user_id, on_position=None) -> Ticket:
+        """申请一个上游会话名额，必要时排队等待
+
+        on_position: 可选的异步回调，排队位置变化时以新位置调用
+        """
+        # 队列为空且有空位时直接准入，保证不插队
+        if not self.queue and self._has_capacity(user_id):
+            self._grant(user_id)
+            return Ticket(self, user_id)
+
+        # 过载保护：队列过长或事件循环延迟过大时直接拒绝
+        if len(self.queue) >= self.max_queue:
+            self._reject("queue_full")
+        if self.loop_lag_ms > self.max_loop_lag_ms:
+            self._reject("loop_lag")
+
+        waiter = _Waiter(user_id)
+        self.queue.append(waiter)
+        # 排在前面的等待者可能只是受单用户名额限制，有全局空位时立即分配，不必等下一次释放
+        self._dispatch()
+        deadline = waiter.enqueued_at + self.max_wait
+        last_position = None
+        try:
+            while not waiter.granted:
+                position = self.position(waiter)
+                if on_position and position != last_position:
+                    last_position = position
+                    await on_position(position)
+                    if waiter.granted:
+                        break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject("timeout")
+                waiter.event.clear()
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if waiter.granted:
+                # 已经分配了名额但等待方放弃，归还名额
+                self._release(user_id)
+            else:
+                self.queue.remove(waiter)
+                self._dispatch()
+            raise
+
+        self._record_wait(waiter)
+        return Ticket(self, user_id)
+
+    def _release(self, user_id):
+        self.active -= 1
+        remaining = self.active_by_user.get(user_id, 0) - 1
+        if remaining > 0:
+            self.active_by_user[user_id] = remaining
+        else:
+            self.active_by_user.pop(user_id, None)
+        self._dispatch()
+
+    def _dispatch(self):
+        """按先来先服务顺序分配空出的名额，并通知其余等待者位置变化"""
+        granted = []
+        for waiter in self.queue:
+            if self.active >= self.max_global:
+                break
+            if self._has_capacity(waiter.user_id):
+                self._grant(waiter.user_id)
+                waiter.granted = True
+                granted.append(waiter)
+        for waiter in granted:
+            self.queue.remove(waiter)
+        for waiter in granted:
+            waiter.event.set()
+        if granted:
+            for waiter in self.queue:
+                waiter.event.set()
+
+    async def _monitor_loop_lag(self):
+        """周期性测量事件循环调度延迟"""
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag_ms = max(0.0, (loop.time() - start - LOOP_LAG_INTERVAL) * 1000)
+            # 指数平滑，避免单次抖动触发拒绝
+            self.loop_lag_ms = self.loop_lag_ms * 0.7 + lag_ms * 0.3
+
+    def start(self):
+        """启动事件循环延迟监控"""
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._monitor_loop_lag())
+
+    async def stop(self):
+        if self._lag_task:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+
+    def metrics(self) -> dict:
+        """导出准入控制指标"""
+        return {
+            "active_sessions": self.active,
+            "active_users": len(self.active_by_user),
+            "max_sessions": self.max_global,
+            "max_sessions_per_user": self.max_per_user,
+            "queue_depth": len(self.queue),
+            "loop_lag_ms": round(self.loop_lag_ms, 2),
+            "admitted_total": self.admitted_total,
+            "rejected_total": dict(self.rejected_total),
+            "wait_time_total_seconds": round(self.wait_time_total, 3),
+            "wait_time_max_seconds": round(self.wait_time_max, 3),
+        }
+
+
+admission = AdmissionController()
@@ -0,0 +1,166 @@
+"""静态资源的构建与发布
+
+构建时为 static/ 下的每个 css/js 文件计算内容哈希，生成带哈希的文件名，并预先压缩出
+gzip 和 brotli 版本（未安装 brotli 时跳过），清单写入 manifest.json。
+
+运行时通过 /assets/ 发布：按 Accept-Encoding 选择预压缩的版本，带强ETag和
+Cache-Control: immutable。文件名随内容变化，浏览器可以一直使用缓存。模板中用
+asset_url('js/main.js') 得到带哈希的地址。
+
+用法:
+    python assets.py            # 构建（服务启动时也会在资源有变化时自动构建）
+"""
+import os
+import gzip
+import json
+import hashlib
+import logging
+
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ASSET_SOURCE_DIR = os.getenv("ASSET_SOURCE_DIR", "static")
+ASSET_BUILD_DIR = os.getenv("ASSET_BUILD_DIR", "./static_build")
+ASSET_URL_PREFIX = "/assets/"
+ASSET_EXTENSIONS = (".js", ".css")
+ASSET_MEDIA_TYPES = {".js": "application/javascript", ".css": "text/css"}
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+MANIFEST = "manifest.json"
+
+
+def _source_files(source_dir):
+    for root, _, names in os.walk(source_dir):
+        for name in sorted(names):
+            if name.endswith(ASSET_EXTENSIONS):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, source_dir).replace(os.sep, "/"), path
+
+
+def _write(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build(source_dir: str = ASSET_SOURCE_DIR, build_dir: str = ASSET_BUILD_DIR) -> dict:
+    """生成带哈希的文件和压缩版本，返回清单 {逻辑路径: 带哈希的文件名}"""
+    os.makedirs(build_dir, exist_ok=True)
+    manifest = {}
+    for logical, path in _source_files(source_dir):
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(logical.replace("/", "."))
+        hashed = f"{stem}.{digest}{ext}"
+        target = os.path.join(build_dir, hashed)
+        if not os.path.exists(target):
+            _write(target, data)
+            _write(target + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(target + ".br", brotli.compress(data, quality=11))
+        manifest[logical] = hashed
+    # 删除旧版本的文件；多个worker可能同时构建，跳过其他进程正在写的临时文件，
+    # 文件已被别的worker删掉时忽略
+    current = set(manifest.values())
+    for name in os.listdir(build_dir):
+        base = name[:-3] if name.endswith((".gz", ".br")) else name
+        if base != MANIFEST and base not in current and not name.endswith(".tmp"):
+            try:
+                os.remove(os.path.join(build_dir, name))
+            except FileNotFoundError:
+                pass
+    _write(os.path.join(build_dir, MANIFEST), json.dumps(manifest, indent=2).encode())
+    logger.info(f"已构建 {len(manifest)} 个静态资源" + ("" if brotli else "（未安装brotli，只生成gzip）"))
+    return manifest
+
+
+def _is_stale(source_dir, build_dir) -> bool:
+    manifest_path = os.path.join(build_dir, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return True
+    built = os.path.getmtime(manifest_path)
+    return any(os.path.getmtime(path) > built for _, path in _source_files(source_dir))
+
+
+class AssetFiles:
+    """发布构建好的资源：内容预先读入内存，按 Accept-Encoding 选择版本"""
+
+    def __init__(self, source_dir: str = ASSET_SOURCE_DIR, build_dir: str = ASSET_BUILD_DIR):
+        self.source_dir = source_dir
+        self.build_dir = build_dir
+        self.manifest = {}
+        self.files = {}  # 带哈希的文件名 -> {编码: 内容}
+
+    def load(self):
+        if _is_stale(self.source_dir, self.build_dir):
+            self.manifest = build(self.source_dir, self.build_dir)
+        else:
+            with open(os.path.join(self.build_dir, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        self.files = {}
+        for hashed in self.manifest.values():
+            variants = {}
+            for encoding, suffix in (("identity", ""), ("gzip", ".gz"), ("br", ".br")):
+                path = os.path.join(self.build_dir, hashed + suffix)
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        variants[encoding] = f.read()
+            self.files[hashed] = variants
+
+    def url(self, logical: str) -> str:
+        """模板中使用：返回带哈希的地址，清单中没有时退回到 /static/"""
+        hashed = self.manifest.get(logical)
+        return ASSET_URL_PREFIX + hashed if hashed else f"/static/{logical}"
+
+    def urls(self) -> dict:
+        return {logical: ASSET_URL_PREFIX + hashed for logical, hashed in self.manifest.items()}
+
+    @staticmethod
+    def _choose(accept_encoding: str, variants: dict) -> str:
+        accepted = {item.split(";")[0].strip() for item in accept_encoding.lower().split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in variants and encoding in accepted:
+                return encoding
+        return "identity"
+
+    async def __call__(self, scope, receive, send):
+        name = scope["path"].rsplit("/", 1)[-1]
+        variants = self.files.get(name)
+        if variants is None:
+            response = Response(status_code=404)
+            await response(scope, receive, send)
+            return
+
+        headers = dict((key.decode("latin-1"), value.decode("latin-1")) for key, value in scope["headers"])
+        encoding = self._choose(headers.get("accept-encoding", ""), variants)
+        digest = name.rsplit(".", 2)[-2]
+        etag = f'"{digest}-{encoding}"'
+        response_headers = {
+            "Cache-Control": IMMUTABLE_CACHE,
+            "ETag": etag,
+            "Vary": "Accept-Encoding",
+        }
+        if etag in headers.get("if-none-match", ""):
+            response = Response(status_code=304, headers=response_headers)
+        else:
+            if encoding != "identity":
+                response_headers["Content-Encoding"] = encoding
+            media_type = ASSET_MEDIA_TYPES.get(os.path.splitext(name)[1], "application/octet-stream")
+            response = Response(variants[encoding], headers=response_headers, media_type=media_type)
+        await response(scope, receive, send)
+
+
+asset_files = AssetFiles()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for logical, hashed in build().items():
+        print(f"{logical} -> {hashed}")
@@ -0,0 +1,322 @@
+"""学生语音与模型回复的音频归档
+
+每个进程把PCM追加写入自己的大段文件（seg_<pid>_<n>.pcm），并在 index.db 中记录
+(session_id, turn, kind) -> (段文件, 偏移, 长度)。写入在后台线程完成，在线会话只做
+一次非阻塞入队，队列满时丢弃该轮并计数，不会等待磁盘。读取通过 mmap 切片返回，
+支持HTTP Range请求。
+"""
+import os
+import mmap
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+AUDIO_ARCHIVE_ENABLED = os.getenv("AUDIO_ARCHIVE_ENABLED", "false").lower() in ("1", "true", "yes")
+AUDIO_ARCHIVE_DIR = os.getenv("AUDIO_ARCHIVE_DIR", "./audio_archive")
+AUDIO_SEGMENT_SIZE = int(os.getenv("AUDIO_SEGMENT_SIZE", str(256 * 1024 * 1024)))  # 单个段文件的大小上限（字节）
+AUDIO_ARCHIVE_QUEUE_SIZE = int(os.getenv("AUDIO_ARCHIVE_QUEUE_SIZE", "4096"))  # 写入队列长度
+PENDING_TURN_TTL = 300  # 未收到结束标记的轮次在写入线程中保留的最长时间（秒）
+INDEX_COMMIT_INTERVAL = 1.0  # 索引批量提交间隔（秒）
+MAX_OPEN_MAPS = 32  # 读取时缓存的段文件映射数
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS audio_index (
+    session_id TEXT NOT NULL,
+    turn INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    user_id INTEGER,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    sample_rate INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, turn, kind)
+) WITHOUT ROWID;
+"""
+
+
+class AudioArchive:
+    """追加写入的音频归档"""
+
+    def __init__(self, directory: str = AUDIO_ARCHIVE_DIR, segment_size: int = AUDIO_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.queue = queue.Queue(maxsize=AUDIO_ARCHIVE_QUEUE_SIZE)
+        self._thread = None
+        self._dropped_keys = set()
+        self._maps = OrderedDict()
+        self._maps_lock = threading.Lock()
+        self.turns_written = 0
+        self.bytes_written = 0
+        self.chunks_dropped = 0
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, "index.db")
+
+    def _connect_index(self):
+        conn = sqlite3.connect(self.index_path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ------------------------------------------------------------------
+    # 写入（在线会话调用，只入队）
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = self._connect_index()
+            conn.executescript(_INDEX_SCHEMA)
+            conn.close()
+            self._thread = threading.Thread(target=self._writer, name="audio-archive", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join(10)
+            self._thread = None
+        with self._maps_lock:
+            for mapped, _ in self._maps.values():
+                try:
+                    mapped.close()
+                except BufferError:
+                    # 仍有切片在使用，交给垃圾回收释放
+                    pass
+            self._maps.clear()
+
+    def _enqueue(self, item) -> bool:
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.chunks_dropped += 1
+            return False
+
+    def append(self, session_id, user_id, turn, kind, data, sample_rate):
+        """追加一段音频到某一轮（不等待磁盘）"""
+        if self._thread is None:
+            return
+        key = (session_id, turn, kind)
+        if key in self._dropped_keys:
+            return
+        if not self._enqueue(("append", key, user_id, sample_rate, bytes(data))):
+            # 丢了一段后整轮作废，避免归档残缺的音频
+            self._dropped_keys.add(key)
+
+    def finish(self, session_id, turn, kind):
+        """标记一轮音频结束，写入线程随后把它连续写入段文件"""
+        if self._thread is None:
+            return
+        key = (session_id, turn, kind)
+        if key in self._dropped_keys:
+            self._dropped_keys.discard(key)
+            self._enqueue(("discard", key))
+        else:
+            self._enqueue(("finish", key))
+
+    def write_turn(self, session_id, user_id, turn, kind, data, sample_rate):
+        self.append(session_id, user_id, turn, kind, data, sample_rate)
+        self.finish(session_id, turn, kind)
+
+    # ------------------------------------------------------------------
+    # 后台写入线程
+    # ------------------------------------------------------------------
+
+    def _writer(self):
+        conn = self._connect_index()
+        pending = {}
+        rows = []
+        segment_index = 0
+        segment_file = None
+        segment_name = None
+        last_commit = time.monotonic()
+
+        def open_segment():
+            nonlocal segment_index, segment_file, segment_name
+            if segment_file:
+                segment_file.close()
+            segment_index += 1
+            segment_name = f"seg_{os.getpid()}_{int(time.time())}_{segment_index:06d}.pcm"
+            segment_file = open(os.path.join(self.directory, segment_name), "ab")
+
+        def commit():
+            nonlocal rows, last_commit
+            # 先把音频写进段文件再提交索引，读取方看到索引时数据一定已经在文件里
+            if segment_file:
+                segment_file.flush()
+            if rows:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO audio_index VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                conn.commit()
+                rows = []
+            last_commit = time.monotonic()
+
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=INDEX_COMMIT_INTERVAL)
+                except queue.Empty:
+                    item = ()
+                if item is None:
+                    break
+
+                if item:
+                    op, key = item[0], item[1]
+                    if op == "append":
+                        entry = pending.setdefault(key, {"user_id": item[2], "sample_rate": item[3], "chunks": [], "since": time.monotonic()})
+                        entry["chunks"].append(item[4])
+                    elif op == "discard":
+                        pending.pop(key, None)
+                    elif op == "finish":
+                        entry = pending.pop(key, None)
+                        if entry and entry["chunks"]:
+                            data = b"".join(entry["chunks"])
+                            if segment_file is None or segment_file.tell() + len(data) > self.segment_size:
+                                open_segment()
+                            offset = segment_file.tell()
+                            segment_file.write(data)
+                            rows.append((
+                                key[0], key[1], key[2], entry["user_id"], segment_name,
+                                offset, len(data), entry["sample_rate"], time.time(),
+                            ))
+                            self.turns_written += 1
+                            self.bytes_written += len(data)
+
+                if self.queue.empty() or time.monotonic() - last_commit >= INDEX_COMMIT_INTERVAL:
+                    commit()
+                    # 清理长时间没有结束标记的轮次
+                    now = time.monotonic()
+                    for key in [k for k, e in pending.items() if now - e["since"] > PENDING_TURN_TTL]:
+                        del pending[key]
+        except Exception as e:
+            logger.error(f"音频归档写入线程出错: {str(e)}")
+            logger.exception(e)
+        finally:
+            commit()
+            if segment_file:
+                segment_file.close()
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def _query(self, sql, params):
+        if not os.path.exists(self.index_path):
+            # 归档没有启用过时没有索引库，按没有录音处理
+            return []
+        conn = self._connect_index()
+        try:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    def lookup(self, session_id, turn, kind):
+        rows = self._query(
+            "SELECT * FROM audio_index WHERE session_id = ? AND turn = ? AND kind = ?",
+            (session_id, turn, kind),
+        )
+        return rows[0] if rows else None
+
+    def list_session(self, session_id):
+        return self._query(
+            "SELECT session_id, turn, kind, user_id, length, sample_rate, created_at "
+            "FROM audio_index WHERE session_id = ? ORDER BY turn, kind",
+            (session_id,),
+        )
+
+    def _map(self, segment, needed_size):
+        """返回段文件的只读映射；段文件仍在增长时按需重新映射"""
+        with self._maps_lock:
+            cached = self._maps.get(segment)
+            if cached and cached[1] >= needed_size:
+                self._maps.move_to_end(segment)
+                return cached[0]
+            if cached:
+                # 旧映射可能仍被正在发送的响应引用，交给垃圾回收释放
+                del self._maps[segment]
+            with open(os.path.join(self.directory, segment), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            self._maps[segment] = (mapped, size)
+            while len(self._maps) > MAX_OPEN_MAPS:
+                self._maps.popitem(last=False)
+            return mapped
+
+    def view(self, entry) -> memoryview:
+        """返回某一轮音频的零拷贝切片"""
+        mapped = self._map(entry["segment"], entry["offset"] + entry["length"])
+        return memoryview(mapped)[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": self._thread is not None,
+            "queue_depth": self.queue.qsize(),
+            "turns_written": self.turns_written,
+            "bytes_written": self.bytes_written,
+            "chunks_dropped": self.chunks_dropped,
+        }
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range(header, size):
+    """解析单个 bytes=start-end 区间，返回 (start, end) 闭区间；无Range头时返回None"""
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise RangeNotSatisfiable(header)
+    start, _, end = spec.strip().partition("-")
+    try:
+        if start == "":
+            length = int(end)
+            if length <= 0:
+                raise RangeNotSatisfiable(header)
+            return max(0, size - length), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        raise RangeNotSatisfiable(header)
+    if start >= size or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+class MemoryViewResponse(Response):
+    """直接分块发送 memoryview（mmap切片），不复制成 bytes"""
+
+    def __init__(self, view: memoryview, status_code: int = 200, headers=None, media_type=None):
+        self.view = view
+        super().__init__(content=b"", status_code=status_code, headers=headers, media_type=media_type)
+        self.headers["content-length"] = str(len(view))
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        length = len(self.view)
+        for offset in range(0, length, RESPONSE_CHUNK_SIZE):
+            await send({
+                "type": "http.response.body",
+                "body": self.view[offset:offset + RESPONSE_CHUNK_SIZE],
+                "more_body": offset + RESPONSE_CHUNK_SIZE < length,
+            })
+        if length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+audio_archive = AudioArchive()
@@ -8,8 +8,9 @@ from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models import User
-from database import get_db
+from database import get_read_db
 import logging
+import os
 
 # 配置信息
 SECRET_KEY = "your-secret-key-keep-it-secret"  # 在生产环境中应该使用环境变量
@@ -25,6 +26,10 @@ pwd_context = CryptContext(
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+def get_admin_usernames() -> set:
+    """管理员用户名列表，来自环境变量 ADMIN_USERNAMES（逗号分隔）"""
+    return {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
         return pwd_context.verify(plain_password, hashed_password)
@@ -59,7 +64,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 async def get_current_user(token: str = Depends(oauth2_scheme), 
-                         db: AsyncSession = Depends(get_db)):
+                         db: AsyncSession = Depends(get_read_db)):
+    # 只读查询走读连接池：SQLite的写引擎只有一个连接，依赖项的会话要等响应结束才关闭，
+    # 慢请求会一直占着它，其他请求的写入拿不到连接
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -79,3 +86,12 @@ async def get_current_user(token: str = Depends(oauth2_scheme),
     if user is None:
         raise credentials_exception
     return user
+
+async def get_current_admin(current_user: User = Depends(get_current_user)):
+    """要求当前用户为管理员"""
+    if current_user.username not in get_admin_usernames():
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="需要管理员权限",
+        )
+    return current_user
@@ -0,0 +1,137 @@
+"""下行节奏控制基准测试：客户端缓冲、内存占用与打断延迟
+
+用法:
+    python benchmarks/downlink_pacing.py [--seconds 10] [--burst 1] [--lead-ms 300]
+
+模拟 Gemini 在 --burst 秒内生成 --seconds 秒的回复音频（每块40ms），通过 Outbound
+发给一个只记录发送时间的假客户端，分别在开启和关闭节奏控制时统计：
+
+- 客户端缓冲（已收到未播放的音频）相对目标超前量的偏差，以及播放中断（缓冲耗尽）次数
+- 客户端缓冲的峰值（音频时长与字节数），即浏览器需要为一段回复占用的内存
+- 回复进行到一半时打断：从调用 flush_audio 到客户端收到 flush 消息的延迟，
+  以及打断时客户端还会继续播放的音频时长
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import outbound
+from outbound import Outbound
+from pacing import Pacer, BYTES_PER_SECOND
+
+CHUNK_SECONDS = 0.04
+
+
+class FakeClient:
+    """记录每一帧的到达时间，按到达顺序首尾相接地播放"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.play_until = None  # 播完已收到音频的时刻
+        self.samples = []  # (时刻, 缓冲秒数)
+        self.underruns = 0
+        self.flushed_at = None
+        self.buffered_at_flush = None
+
+    def buffered(self, now):
+        return max(self.play_until - now, 0.0) if self.play_until is not None else 0.0
+
+    async def send_bytes(self, data):
+        now = time.monotonic()
+        if self.play_until is not None and self.play_until < now - 0.005:
+            self.underruns += 1
+        start = max(self.play_until or now, now)
+        self.play_until = start + len(data) / BYTES_PER_SECOND
+        self.samples.append((now, self.buffered(now)))
+
+    async def send_json(self, message):
+        if message.get("type") == "flush" and self.flushed_at is None:
+            now = time.monotonic()
+            self.flushed_at = now
+            self.buffered_at_flush = self.buffered(now)
+            self.play_until = None
+
+    async def close(self, code=1000, reason=None):
+        pass
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+
+async def run(seconds, burst, lead, paced, interrupt):
+    client = FakeClient()
+    out = Outbound(client)
+    out.pacer = Pacer(lead=lead, enabled=paced)
+    chunks = int(seconds / CHUNK_SECONDS)
+    chunk = b"\x00\x01" * int(CHUNK_SECONDS * BYTES_PER_SECOND / 2)
+    for i in range(chunks):
+        out.send_audio(chunk)
+        await asyncio.sleep(burst / chunks)
+
+    flush_latency = None
+    if interrupt:
+        # 从回复开始算起，播放到一半时学生打断
+        await asyncio.sleep(max(client.started + seconds / 2 - time.monotonic(), 0))
+        requested = time.monotonic()
+        out.flush_audio()
+        while client.flushed_at is None:
+            await asyncio.sleep(0.001)
+        flush_latency = client.flushed_at - requested
+    else:
+        while out.lanes[2]:
+            await asyncio.sleep(0.01)
+    out.abort()
+
+    # 只统计稳定阶段：第一帧到达后 lead 之后，到最后一帧发出为止
+    steady = [b for t, b in client.samples if t - client.samples[0][0] > lead]
+    deviations = [abs(b - lead) * 1000 for b in steady]
+    peak = max((b for _, b in client.samples), default=0.0)
+    return {
+        "deviation_p50": percentile(deviations, 0.5),
+        "deviation_p95": percentile(deviations, 0.95),
+        "deviation_max": max(deviations, default=0.0),
+        "underruns": client.underruns,
+        "peak_ms": peak * 1000,
+        "peak_kb": peak * BYTES_PER_SECOND / 1024,
+        "frames": len(client.samples),
+        "flush_ms": flush_latency * 1000 if flush_latency is not None else None,
+        "after_flush_ms": client.buffered_at_flush * 1000 if client.buffered_at_flush is not None else None,
+    }
+
+
+async def main_async(args):
+    # 本测试只关心节奏，不触发慢速客户端降级
+    outbound.OUTBOUND_DEGRADE_BYTES = outbound.OUTBOUND_MAX_BYTES = 1 << 40
+    lead = args.lead_ms / 1000
+    print(f"回复 {args.seconds:.0f}s 音频在 {args.burst:.1f}s 内生成，目标超前 {args.lead_ms}ms\n")
+    print(f"{'':>8}{'dev p50':>10}{'dev p95':>10}{'dev max':>10}{'underrun':>10}"
+          f"{'peak ms':>10}{'peak KB':>10}{'frames':>8}")
+    for paced in (True, False):
+        result = await run(args.seconds, args.burst, lead, paced, interrupt=False)
+        print(f"{'paced' if paced else 'unpaced':>8}{result['deviation_p50']:>10.1f}{result['deviation_p95']:>10.1f}"
+              f"{result['deviation_max']:>10.1f}{result['underruns']:>10}{result['peak_ms']:>10.0f}"
+              f"{result['peak_kb']:>10.0f}{result['frames']:>8}")
+
+    print("\n打断（播放到一半时）:")
+    for paced in (True, False):
+        result = await run(args.seconds, args.burst, lead, paced, interrupt=True)
+        print(f"{'paced' if paced else 'unpaced':>8}  flush 送达 {result['flush_ms']:.1f}ms，"
+              f"客户端已缓冲、需本地丢弃的音频 {result['after_flush_ms']:.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10, help="回复音频的时长（秒）")
+    parser.add_argument("--burst", type=float, default=1, help="模型生成这些音频用的时间（秒）")
+    parser.add_argument("--lead-ms", type=int, default=300, help="节奏控制的目标超前量（毫秒）")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
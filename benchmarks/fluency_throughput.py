@@ -0,0 +1,125 @@
+"""流利度分析基准测试
+
+用法:
+    python benchmarks/fluency_throughput.py [--sessions 200] [--workers 1] [--interval 8]
+
+1. 单进程下不同时长语句的分析耗时
+2. 进程池吞吐（每秒可分析的语句数）
+3. 模拟 --sessions 个会话，每个会话每 --interval 秒说一句5秒的话：
+   对比开启/关闭分析时事件循环的延迟，以及卡片送达延迟的P50/P95
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fluency import analyze, FluencyAnalyzer, SAMPLE_RATE
+
+REPEAT = 20
+
+
+def make_utterance(seconds, seed=0):
+    """合成一句"话"：带谐波的浮动基频，4Hz的音节包络，中间一段停顿"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    f0 = 140 + 40 * np.sin(2 * np.pi * 0.3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)) ** 2
+    envelope[(t > seconds * 0.45) & (t < seconds * 0.55)] = 0
+    signal = voice * envelope * 0.3 + rng.normal(0, 0.001, len(t))
+    return (signal * 32767).astype("<i2").tobytes()
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def bench_latency():
+    print("单进程分析耗时:")
+    for seconds in (2, 5, 10, 30):
+        pcm = make_utterance(seconds)
+        analyze(pcm)
+        times = []
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            analyze(pcm)
+            times.append((time.perf_counter() - started) * 1000)
+        print(f"  {seconds:>3}s 语句  P50 {statistics.median(times):7.2f}ms  P95 {percentile(times, 95):7.2f}ms")
+
+
+async def bench_pool(workers):
+    analyzer = FluencyAnalyzer(workers)
+    analyzer.start()
+    pcm = make_utterance(5)
+    await analyzer.analyze(pcm)
+    count = 50 * workers
+    started = time.perf_counter()
+    await asyncio.gather(*(analyzer.analyze(pcm) for _ in range(count)))
+    elapsed = time.perf_counter() - started
+    analyzer.stop()
+    print(f"进程池吞吐（{workers} 个进程，5s语句）: {count / elapsed:.1f} 句/秒")
+    return count / elapsed
+
+
+async def simulate(sessions, interval, workers, duration):
+    """返回 (事件循环延迟P95ms, 卡片延迟P50ms, 卡片延迟P95ms)"""
+    analyzer = FluencyAnalyzer(workers)
+    analyzer.start()
+    utterances = [make_utterance(5, seed) for seed in range(8)]
+    if workers:
+        await analyzer.analyze(utterances[0])
+    card_latency = []
+    lags = []
+    stop = time.monotonic() + duration
+
+    async def session(index):
+        await asyncio.sleep(interval * index / sessions)
+        while time.monotonic() < stop:
+            if workers:
+                started = time.perf_counter()
+                await analyzer.analyze(utterances[index % len(utterances)])
+                card_latency.append((time.perf_counter() - started) * 1000)
+            await asyncio.sleep(interval)
+
+    async def monitor():
+        while time.monotonic() < stop:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append((time.perf_counter() - started - 0.01) * 1000)
+
+    await asyncio.gather(monitor(), *(session(i) for i in range(sessions)))
+    analyzer.stop()
+    return percentile(lags, 95), percentile(card_latency, 50), percentile(card_latency, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--interval", type=float, default=8.0, help="每个会话两句话之间的间隔（秒）")
+    parser.add_argument("--duration", type=float, default=20.0)
+    args = parser.parse_args()
+
+    bench_latency()
+    throughput = asyncio.run(bench_pool(args.workers))
+    print(f"按每 {args.interval:.0f}s 一句估算，{args.workers} 个分析进程可支撑约 {int(throughput * args.interval)} 个会话")
+
+    print(f"\n模拟 {args.sessions} 个会话，每 {args.interval:.0f}s 一句，持续 {args.duration:.0f}s:")
+    for workers in (0, args.workers):
+        lag, p50, p95 = asyncio.run(simulate(args.sessions, args.interval, workers, args.duration))
+        label = "关闭分析" if workers == 0 else f"{workers} 个分析进程"
+        line = f"  {label:<10} 事件循环延迟P95 {lag:6.2f}ms"
+        if workers:
+            line += f"  卡片延迟 P50 {p50:6.1f}ms  P95 {p95:6.1f}ms"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""练习历史分页基准测试：键集分页 vs OFFSET 分页
+
+用法:
+    python benchmarks/history_pagination.py [--rows 2000000] [--users 50]
+
+在临时SQLite库中批量写入 user_logs，然后分别在不同深度取一页，
+对比键集分页（history.history_query）与 OFFSET 分页的耗时，并打印查询计划。
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from history import history_query, encode_cursor
+from models import Base
+
+PAGE_SIZE = 50
+REPEAT = 20
+ACTIONS = ("audio_input", "gemini_response", "login")
+
+
+def seed(path, rows, users):
+    """按时间顺序批量写入日志，user 1 占一半数据"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    start = datetime(2024, 1, 1)
+    batch = []
+    for i in range(rows):
+        user_id = 1 if i % 2 == 0 else (i % users) + 1
+        created_at = (start + timedelta(seconds=i)).isoformat(sep=" ")
+        batch.append((user_id, ACTIONS[i % 3], "Audio input received: 32000 bytes", created_at))
+        if len(batch) >= 100_000:
+            conn.executemany("INSERT INTO user_logs (user_id, action, content, created_at) VALUES (?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO user_logs (user_id, action, content, created_at) VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def timed(session, query):
+    durations = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        session.execute(query).scalars().all()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2_000_000, help="写入的日志总行数")
+    parser.add_argument("--users", type=int, default=50, help="用户数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+
+        started = time.perf_counter()
+        seed(path, args.rows, args.users)
+        print(f"写入 {args.rows} 行用时 {time.perf_counter() - started:.1f}s")
+
+        with Session(engine) as session:
+            user_rows = args.rows // 2
+
+            print(f"\n{'depth':>10}{'keyset ms':>12}{'offset ms':>12}")
+            for depth in (0, user_rows // 100, user_rows // 10, user_rows // 2, user_rows - PAGE_SIZE):
+                if depth:
+                    # 取得该深度处上一条记录作为游标（仅用于准备，不计时）
+                    anchor = session.execute(
+                        history_query(1, limit=1).offset(depth - 1)
+                    ).scalars().first()
+                    cursor = encode_cursor(anchor.created_at, anchor.id)
+                else:
+                    cursor = None
+                keyset_ms = timed(session, history_query(1, cursor, PAGE_SIZE))
+                offset_ms = timed(session, history_query(1, limit=PAGE_SIZE).offset(depth))
+                print(f"{depth:>10}{keyset_ms:>12.3f}{offset_ms:>12.3f}")
+
+            action_ms = timed(session, history_query(1, limit=PAGE_SIZE, action="gemini_response"))
+            print(f"\n按 action 过滤的首页: {action_ms:.3f} ms")
+
+            compiled = history_query(1, cursor, PAGE_SIZE).compile(engine, compile_kwargs={"literal_binds": True})
+            print("\n查询计划:")
+            for row in session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}"):
+                print("  ", row[-1])
+
+
+if __name__ == "__main__":
+    main()
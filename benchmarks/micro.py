@@ -0,0 +1,211 @@
+"""热路径微基准与回归检查
+
+用法:
+    python benchmarks/micro.py                    # 运行并与 baseline.json 对比
+    python benchmarks/micro.py --threshold 30     # 允许的退化百分比（默认 BENCH_THRESHOLD 或 25）
+    python benchmarks/micro.py --only base64      # 只运行名称包含该字符串的项
+    python benchmarks/micro.py --update           # 把本次结果写为新的基线
+
+覆盖每个音频分片和每个请求都会经过的代码：
+- realtime_input 消息的构建、serverContent 消息的解析（gemini_protocol 中 run_turn 使用的函数）
+- 常见分片大小下的 base64 编解码
+- starter.AudioLoop.listen_audio 使用的音量计算（gemini_protocol.pcm_volume）
+- 经 database.get_db 插入 UserLog（临时SQLite库）
+- create_access_token / JWT 解码、verify_password
+
+全部离线运行。每项自动选择循环次数（每轮约 TARGET_SECONDS），重复 REPEAT 轮取最小值。
+任一项比基线慢超过阈值时以非零状态退出。基线与机器相关，换机器后先用 --update 重新生成。
+"""
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import platform
+import tempfile
+import warnings
+
+_tmpdir = tempfile.TemporaryDirectory()
+# 必须在导入 database 之前设置，避免写入项目的数据库
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_tmpdir.name, 'bench.db')}"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import timedelta
+
+import jwt
+
+# 开发用的默认 SECRET_KEY 较短，PyJWT 会在每次编码/解码时警告
+warnings.filterwarnings("ignore", module="jwt")
+
+from auth import create_access_token, verify_password, get_password_hash, SECRET_KEY, ALGORITHM
+from gemini_protocol import realtime_input_message, parse_server_message, pcm_volume
+from database import init_db, get_db, engine
+from models import UserLog
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+BENCH_THRESHOLD = float(os.getenv("BENCH_THRESHOLD", "25"))  # 允许的退化百分比
+TARGET_SECONDS = 0.2
+REPEAT = 5
+
+# 常见分片大小：客户端每次发送的512帧（16kHz）、100ms上行、模型返回的约1秒音频（24kHz）
+CHUNK_SIZES = {"1k": 1024, "3k": 3200, "48k": 48000}
+
+
+def _pcm(size: int) -> bytes:
+    return bytes((i * 37) & 0xFF for i in range(size))
+
+
+def _server_content(data: bytes) -> str:
+    return json.dumps({
+        "serverContent": {
+            "modelTurn": {
+                "parts": [{"inlineData": {"mimeType": "audio/pcm;rate=24000", "data": base64.b64encode(data).decode()}}]
+            }
+        }
+    })
+
+
+class _DatabaseBench:
+    """在一个持久的事件循环里经 get_db 插入 UserLog，每次调用插入并提交一行"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(init_db())
+
+    async def _insert(self):
+        async for db in get_db():
+            db.add(UserLog(user_id=1, action="speech_input", content="hello", response="hi", processing_time=120))
+
+    def insert(self):
+        self.loop.run_until_complete(self._insert())
+
+    def close(self):
+        self.loop.run_until_complete(engine.dispose())
+        self.loop.close()
+
+
+def benchmarks():
+    """返回 [(名称, 无参函数)]；数据在这里准备好，不计入耗时"""
+    cases = []
+    for label, size in CHUNK_SIZES.items():
+        data = _pcm(size)
+        encoded = base64.b64encode(data)
+        message = _server_content(data)
+        cases.append((f"realtime_input_build_{label}", lambda data=data: realtime_input_message(data)))
+        cases.append((f"server_content_parse_{label}", lambda message=message: parse_server_message(message)))
+        cases.append((f"base64_roundtrip_{label}", lambda data=data: base64.b64decode(base64.b64encode(data))))
+        cases.append((f"base64_decode_{label}", lambda encoded=encoded: base64.b64decode(encoded)))
+
+    cases.append(("volume_512_frames", lambda data=_pcm(1024): pcm_volume(data)))
+
+    token = create_access_token({"sub": "bench"}, timedelta(minutes=30))
+    cases.append(("create_access_token", lambda: create_access_token({"sub": "bench"}, timedelta(minutes=30))))
+    cases.append(("jwt_decode", lambda: jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])))
+
+    hashed = get_password_hash("benchmark-password")
+    cases.append(("verify_password", lambda: verify_password("benchmark-password", hashed)))
+
+    cases.append(("userlog_insert", "db"))
+    return cases
+
+
+def measure(func) -> float:
+    """返回每次调用的耗时（秒），取 REPEAT 轮中最快的一轮"""
+    func()
+    # 与 timeit.autorange 相同：按 1,2,5,10,20... 增加次数，直到一轮达到 TARGET_SECONDS
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= TARGET_SECONDS:
+            break
+        number = number * 5 // 2 if str(number)[0] == "2" else number * 2
+    best = elapsed / number
+    for _ in range(REPEAT - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def _format(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:9.3f}ms"
+    return f"{seconds * 1e6:9.2f}us"
+
+
+def load_baseline(path: str = BASELINE_PATH) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get("results", {})
+
+
+def save_baseline(results: dict, path: str = BASELINE_PATH):
+    payload = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor() or platform.machine(),
+        "results": {name: round(value, 12) for name, value in sorted(results.items())},
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD, help="允许的退化百分比")
+    parser.add_argument("--only", default="", help="只运行名称包含该字符串的项")
+    parser.add_argument("--update", action="store_true", help="把本次结果写入基线")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    results = {}
+    regressions = []
+    database = None
+    try:
+        for name, func in benchmarks():
+            if args.only not in name:
+                continue
+            if func == "db":
+                database = database or _DatabaseBench()
+                func = database.insert
+            results[name] = value = measure(func)
+            base = baseline.get(name)
+            if base:
+                change = (value - base) / base * 100
+                flag = ""
+                if change > args.threshold:
+                    regressions.append(name)
+                    flag = "  退化"
+                print(f"{name:<32} {_format(value)}  基线 {_format(base)}  {change:+6.1f}%{flag}")
+            else:
+                print(f"{name:<32} {_format(value)}  （无基线）")
+    finally:
+        if database is not None:
+            database.close()
+        _tmpdir.cleanup()
+
+    if args.update:
+        merged = dict(baseline)
+        merged.update(results)
+        save_baseline(merged, args.baseline)
+        print(f"\n已写入基线: {args.baseline}")
+        return 0
+    if regressions:
+        print(f"\n{len(regressions)} 项比基线慢超过 {args.threshold:.0f}%: {', '.join(regressions)}")
+        return 1
+    print(f"\n全部在阈值 {args.threshold:.0f}% 以内")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
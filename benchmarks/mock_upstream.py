@@ -0,0 +1,115 @@
+"""模拟 Gemini BidiGenerateContent 的上游服务
+
+用法:
+    python benchmarks/mock_upstream.py --port 9001 [--think-ms 300] [--reply-seconds 2] [--speed 4]
+    GEMINI_WS_URL=ws://127.0.0.1:9001 GEMINI_API_KEY=test uvicorn main:app
+
+协议与 gemini_service.run_turn 使用的子集相同：收到 setup 后回复 setupComplete；
+每收到一段 realtime_input 音频，等待 think_ms 后以 speed 倍实时的速度分段返回
+reply_seconds 秒的 24kHz PCM（正弦波），最后发送 turnComplete。setup 中请求了语音
+转写时，同时返回固定的输入和输出转写。client_content（文本对话）返回一段文字。
+"""
+import json
+import math
+import time
+import base64
+import asyncio
+import argparse
+
+from websockets.asyncio.server import serve
+
+SAMPLE_RATE = 24000
+CHUNK_SECONDS = 0.1
+INPUT_TRANSCRIPT = "I went to the park yesterday."
+OUTPUT_TRANSCRIPT = "Great job! Tell me more about the park."
+
+
+def tone(seconds: float, frequency: float = 440.0) -> bytes:
+    samples = int(SAMPLE_RATE * seconds)
+    return b"".join(
+        int(8000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE)).to_bytes(2, "little", signed=True)
+        for i in range(samples)
+    )
+
+
+class MockUpstream:
+    def __init__(self, think_ms=300, reply_seconds=2.0, speed=4.0):
+        self.think = think_ms / 1000
+        self.reply_seconds = reply_seconds
+        self.speed = speed
+        self.chunk = tone(CHUNK_SECONDS)
+        self.turns = 0
+        self.server = None
+
+    async def _reply_audio(self, ws, transcription=False):
+        await asyncio.sleep(self.think)
+        if transcription:
+            await ws.send(json.dumps({"serverContent": {"inputTranscription": {"text": INPUT_TRANSCRIPT}}}))
+        chunks = math.ceil(self.reply_seconds / CHUNK_SECONDS)
+        data = base64.b64encode(self.chunk).decode()
+        started = time.monotonic()
+        for i in range(chunks):
+            await ws.send(json.dumps({"serverContent": {"modelTurn": {"parts": [
+                {"inlineData": {"mimeType": f"audio/pcm;rate={SAMPLE_RATE}", "data": data}}
+            ]}}}))
+            # 按 speed 倍实时生成
+            wait = started + (i + 1) * CHUNK_SECONDS / self.speed - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        if transcription:
+            await ws.send(json.dumps({"serverContent": {"outputTranscription": {"text": OUTPUT_TRANSCRIPT}}}))
+        await ws.send(json.dumps({"serverContent": {"turnComplete": True}}))
+
+    async def _reply_text(self, ws):
+        await asyncio.sleep(self.think)
+        await ws.send(json.dumps({"serverContent": {"modelTurn": {"parts": [{"text": "Good job!"}]}}}))
+        await ws.send(json.dumps({"serverContent": {"turnComplete": True}}))
+
+    async def _handle(self, ws):
+        try:
+            setup = json.loads(await ws.recv()).get("setup", {})
+            transcription = "output_audio_transcription" in setup
+            await ws.send(json.dumps({"setupComplete": {}}))
+            async for raw in ws:
+                message = json.loads(raw)
+                self.turns += 1
+                if "realtime_input" in message:
+                    await self._reply_audio(ws, transcription)
+                elif "client_content" in message:
+                    await self._reply_text(ws)
+        except Exception:
+            pass
+
+    async def start(self, host="127.0.0.1", port=0) -> int:
+        self.server = await serve(self._handle, host, port, max_size=None)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--think-ms", type=float, default=300, help="收到音频到开始回复的时间")
+    parser.add_argument("--reply-seconds", type=float, default=2.0, help="每轮回复的音频时长")
+    parser.add_argument("--speed", type=float, default=4.0, help="生成速度（实时的倍数）")
+    args = parser.parse_args()
+
+    async def run():
+        upstream = MockUpstream(args.think_ms, args.reply_seconds, args.speed)
+        port = await upstream.start("127.0.0.1", args.port)
+        print(f"模拟上游监听 ws://127.0.0.1:{port}")
+        await asyncio.Future()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
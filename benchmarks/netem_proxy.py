@@ -0,0 +1,199 @@
+"""网络损伤代理：在本机模拟学生的弱网
+
+用法:
+    python benchmarks/netem_proxy.py --listen 8082 --target 127.0.0.1:8081 --profile 4g
+    python benchmarks/netem_proxy.py --listen 9002 --target 127.0.0.1:9001 --latency-ms 40 --jitter-ms 10
+
+在 TCP 层转发（WebSocket 原样通过），两个方向分别注入：
+
+- 延迟与抖动：每段数据的到达时间为 延迟 ± 抖动；TCP 不会乱序，晚到的一段会拖住后面的
+- 带宽上限：按 MSS 大小切分，每段占用链路 len*8/带宽 秒
+- 突发卡顿：平均每隔 stall_every_s 秒链路停顿 stall_ms，期间的数据在恢复时一次性到达
+
+既可以作为命令行工具单独运行，也可以在 benchmarks/network_profiles.py 中导入使用。
+"""
+import random
+import asyncio
+import argparse
+
+MSS = 1460
+READ_SIZE = 65536
+
+# 常见的学生网络；bandwidth_kbps 为0表示不限速
+PROFILES = {
+    "lan": dict(latency_ms=0, jitter_ms=0, bandwidth_kbps=0, stall_every_s=0, stall_ms=0),
+    "wifi": dict(latency_ms=15, jitter_ms=10, bandwidth_kbps=20000, stall_every_s=0, stall_ms=0),
+    "campus_wifi": dict(latency_ms=40, jitter_ms=40, bandwidth_kbps=2000, stall_every_s=8, stall_ms=400),
+    "4g": dict(latency_ms=60, jitter_ms=30, bandwidth_kbps=4000, stall_every_s=10, stall_ms=300),
+    "3g": dict(latency_ms=150, jitter_ms=80, bandwidth_kbps=750, stall_every_s=5, stall_ms=800),
+    "bad": dict(latency_ms=300, jitter_ms=150, bandwidth_kbps=300, stall_every_s=3, stall_ms=1500),
+    # 服务器到上游（机房网络）
+    "datacenter": dict(latency_ms=30, jitter_ms=5, bandwidth_kbps=0, stall_every_s=0, stall_ms=0),
+}
+
+
+class Impairment:
+    """一个方向上的链路参数"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, bandwidth_kbps=0, stall_every_s=0, stall_ms=0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.bandwidth = bandwidth_kbps * 1000 / 8  # 字节/秒
+        self.stall_every = stall_every_s
+        self.stall = stall_ms / 1000
+
+    @classmethod
+    def profile(cls, name: str):
+        return cls(**PROFILES[name])
+
+    def delay(self, rng) -> float:
+        return max(self.latency + rng.uniform(-self.jitter, self.jitter), 0.0)
+
+
+class Stats:
+    def __init__(self):
+        self.connections = 0
+        self.bytes = {"up": 0, "down": 0}
+        self.stalls = {"up": 0, "down": 0}
+        self.stalled_seconds = {"up": 0.0, "down": 0.0}
+
+    def as_dict(self) -> dict:
+        return {
+            "connections": self.connections,
+            "bytes": dict(self.bytes),
+            "stalls": dict(self.stalls),
+            "stalled_seconds": {k: round(v, 3) for k, v in self.stalled_seconds.items()},
+        }
+
+
+async def _pipe(reader, writer, impairment, stats, direction, rng):
+    """把 reader 的数据按链路参数转发给 writer"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def receive():
+        last = 0.0
+        try:
+            while data := await reader.read(READ_SIZE):
+                for i in range(0, len(data), MSS):
+                    # 到达时间单调不减：TCP 中晚到的段会挡住后面的段
+                    last = max(last, loop.time() + impairment.delay(rng))
+                    queue.put_nowait((last, data[i:i + MSS]))
+        except (ConnectionError, OSError):
+            pass
+        queue.put_nowait(None)
+
+    async def deliver():
+        link_free = 0.0
+        next_stall = loop.time() + rng.expovariate(1 / impairment.stall_every) if impairment.stall_every else None
+        try:
+            while (item := await queue.get()) is not None:
+                deliver_at, segment = item
+                if impairment.bandwidth:
+                    link_free = max(link_free, loop.time()) + len(segment) / impairment.bandwidth
+                    deliver_at = max(deliver_at, link_free)
+                if next_stall is not None:
+                    # 链路空闲期间已经过去的卡顿没有拖住任何数据，不计数
+                    while next_stall + impairment.stall <= deliver_at:
+                        next_stall += impairment.stall + rng.expovariate(1 / impairment.stall_every)
+                    if deliver_at >= next_stall:
+                        # 链路卡住，恢复后积压的数据一起到达
+                        resume = next_stall + impairment.stall
+                        stats.stalls[direction] += 1
+                        stats.stalled_seconds[direction] += resume - deliver_at
+                        deliver_at = resume
+                        link_free = max(link_free, deliver_at)
+                        next_stall = resume + rng.expovariate(1 / impairment.stall_every)
+                wait = deliver_at - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                writer.write(segment)
+                stats.bytes[direction] += len(segment)
+                if queue.empty():
+                    await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    await asyncio.gather(receive(), deliver())
+
+
+class ImpairmentProxy:
+    """TCP 代理；up 为客户端到目标方向，down 为目标到客户端方向，修改后对新连接生效"""
+
+    def __init__(self, target_host, target_port, up=None, down=None, seed=None):
+        self.target = (target_host, target_port)
+        self.up = up or Impairment()
+        self.down = down or Impairment()
+        self.rng = random.Random(seed)
+        self.stats = Stats()
+        self.server = None
+
+    def set_profile(self, name: str):
+        self.up = Impairment.profile(name)
+        self.down = Impairment.profile(name)
+        self.stats = Stats()
+
+    async def _handle(self, client_reader, client_writer):
+        try:
+            target_reader, target_writer = await asyncio.open_connection(*self.target)
+        except OSError:
+            client_writer.close()
+            return
+        self.stats.connections += 1
+        up, down, stats = self.up, self.down, self.stats
+        await asyncio.gather(
+            _pipe(client_reader, target_writer, up, stats, "up", self.rng),
+            _pipe(target_reader, client_writer, down, stats, "down", self.rng),
+        )
+
+    async def start(self, host="127.0.0.1", port=0) -> int:
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--listen", type=int, required=True, help="本机监听端口")
+    parser.add_argument("--target", required=True, help="转发目标 host:port")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="lan")
+    parser.add_argument("--latency-ms", type=float, help="覆盖单向延迟")
+    parser.add_argument("--jitter-ms", type=float, help="覆盖抖动")
+    parser.add_argument("--bandwidth-kbps", type=float, help="覆盖带宽上限")
+    parser.add_argument("--stall-every-s", type=float, help="覆盖卡顿的平均间隔")
+    parser.add_argument("--stall-ms", type=float, help="覆盖每次卡顿的时长")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    params = dict(PROFILES[args.profile])
+    for name in params:
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+    host, port = args.target.rsplit(":", 1)
+
+    async def run():
+        proxy = ImpairmentProxy(host, int(port), Impairment(**params), Impairment(**params), seed=args.seed)
+        await proxy.start("127.0.0.1", args.listen)
+        print(f"127.0.0.1:{args.listen} -> {args.target} {params}")
+        try:
+            while True:
+                await asyncio.sleep(10)
+                print(proxy.stats.as_dict())
+        finally:
+            await proxy.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""语音链路在不同网络下的端到端延迟与卡顿
+
+用法:
+    python benchmarks/network_profiles.py [--profiles lan,4g,3g,bad] [--clients 2] [--turns 3]
+                                          [--upstream-profile datacenter]
+
+启动一个模拟上游（mock_upstream.py）和一个真实的服务进程（uvicorn main:app，上游地址
+通过 GEMINI_WS_URL 指向模拟上游），在学生与服务之间、服务与上游之间各放一个网络损伤
+代理（netem_proxy.py）。无界面客户端按浏览器的方式使用 /ws/audio?stream=1：按服务端
+下发的帧长实时上传一句话，发送 utterance_end，然后接收回复音频并按到达顺序首尾相接地
+“播放”。对每种网络统计：
+
+- 首包延迟：发送 utterance_end 到收到第一段回复音频
+- 卡顿：播放中下一段音频还没到的次数与累计时长（与网页客户端相同，不预缓冲）
+- 完成率：在超时内收齐整段回复的轮次比例
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from websockets.asyncio.client import connect
+
+from mock_upstream import MockUpstream
+from netem_proxy import ImpairmentProxy, PROFILES
+
+UPLINK_RATE = 16000
+UTTERANCE_SECONDS = 2.0
+TURN_TIMEOUT = 30.0
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] if values else float("nan")
+
+
+def _post_form(url, fields):
+    data = urllib.parse.urlencode(fields).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=10) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return {"status": e.code}
+
+
+async def login(base_url, username):
+    password = "bench-password"
+    await asyncio.to_thread(_post_form, f"{base_url}/register",
+                            {"username": username, "password": password, "email": f"{username}@bench.local"})
+    result = await asyncio.to_thread(_post_form, f"{base_url}/token", {"username": username, "password": password})
+    return result["access_token"]
+
+
+class Turn:
+    def __init__(self):
+        self.utterance_end = None
+        self.first_audio = None
+        self.play_until = None
+        self.received_seconds = 0.0
+        self.stalls = 0
+        self.stalled_seconds = 0.0
+
+
+async def run_client(ws_url, token, turns, reply_seconds):
+    """一个无界面客户端：返回每轮的 Turn"""
+    results = []
+    frame_ms = 60
+    rate = 24000
+    received = 0
+    current = None
+    done = asyncio.Event()
+
+    async with connect(f"{ws_url}/ws/audio?token={token}&stream=1", max_size=None) as ws:
+
+        async def receiver():
+            nonlocal frame_ms, rate, received
+            async for message in ws:
+                now = time.monotonic()
+                if isinstance(message, bytes):
+                    received += 1
+                    if received % 8 == 0:
+                        await ws.send(json.dumps({"type": "ack", "seq": received}))
+                    turn = current
+                    if turn is None:
+                        continue
+                    seconds = len(message) / (rate * 2)
+                    if turn.first_audio is None:
+                        turn.first_audio = now
+                        turn.play_until = now
+                    elif now > turn.play_until:
+                        # 上一段已经播完，下一段才到
+                        turn.stalls += 1
+                        turn.stalled_seconds += now - turn.play_until
+                    turn.play_until = max(turn.play_until, now) + seconds
+                    turn.received_seconds += seconds
+                    if turn.received_seconds >= reply_seconds - 1e-6:
+                        done.set()
+                    continue
+                data = json.loads(message)
+                if data.get("type") == "ping":
+                    await ws.send(json.dumps({"type": "pong", "ts": data.get("ts"), "buffered": 0}))
+                elif data.get("type") == "uplink":
+                    frame_ms = data["frame_ms"]
+                elif data.get("type") == "audio_format":
+                    rate = data["sample_rate"]
+
+        receive_task = asyncio.create_task(receiver())
+        try:
+            silence = b"\x00\x00" * int(UPLINK_RATE * UTTERANCE_SECONDS)
+            for _ in range(turns):
+                # 按当前帧长实时上传一句话
+                sent = 0
+                started = time.monotonic()
+                while sent < len(silence):
+                    size = int(UPLINK_RATE * frame_ms / 1000) * 2
+                    await ws.send(silence[sent:sent + size])
+                    sent += size
+                    wait = started + sent / (UPLINK_RATE * 2) - time.monotonic()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                current = Turn()
+                done.clear()
+                await ws.send(json.dumps({"type": "utterance_end"}))
+                current.utterance_end = time.monotonic()
+                try:
+                    await asyncio.wait_for(done.wait(), TURN_TIMEOUT)
+                    # 等本地播放完再说下一句
+                    await asyncio.sleep(max(current.play_until - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    pass
+                results.append(current)
+                current = None
+        finally:
+            receive_task.cancel()
+    return results
+
+
+def start_server(port, upstream_url, db_path):
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite+aiosqlite:///{db_path}",
+        GEMINI_WS_URL=upstream_url,
+        GEMINI_API_KEY=os.getenv("GEMINI_API_KEY", "bench-key"),
+        SECRET_KEY=os.getenv("SECRET_KEY", "network-profiles-benchmark-secret-key"),
+        LOG_LEVEL="WARNING",
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status = await asyncio.to_thread(lambda: urllib.request.urlopen(f"{base_url}/ready", timeout=2).status)
+            if status == 200:
+                return
+        except Exception:
+            pass
+        await asyncio.sleep(0.3)
+    raise RuntimeError("服务没有在规定时间内就绪")
+
+
+async def main_async(args):
+    upstream = MockUpstream(args.think_ms, args.reply_seconds, args.speed)
+    upstream_port = await upstream.start()
+    upstream_proxy = ImpairmentProxy("127.0.0.1", upstream_port, seed=args.seed)
+    upstream_proxy.set_profile(args.upstream_profile)
+    upstream_proxy_port = await upstream_proxy.start()
+
+    server_port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        server = start_server(server_port, f"ws://127.0.0.1:{upstream_proxy_port}", os.path.join(tmp, "bench.db"))
+        client_proxy = ImpairmentProxy("127.0.0.1", server_port, seed=args.seed)
+        client_proxy_port = await client_proxy.start()
+        try:
+            direct = f"http://127.0.0.1:{server_port}"
+            await wait_ready(direct)
+            tokens = [await login(direct, f"bench{i}") for i in range(args.clients)]
+
+            print(f"{args.clients} 个客户端 × {args.turns} 轮，回复 {args.reply_seconds}s，"
+                  f"上游链路 {args.upstream_profile}\n")
+            print(f"{'profile':>12}{'ttfa p50':>10}{'ttfa p95':>10}{'stalls/turn':>13}"
+                  f"{'stall ms/turn':>15}{'complete':>10}{'link stalls':>13}")
+            for name in args.profiles.split(","):
+                client_proxy.set_profile(name)
+                per_client = await asyncio.gather(*(
+                    run_client(f"ws://127.0.0.1:{client_proxy_port}", token, args.turns, args.reply_seconds)
+                    for token in tokens
+                ))
+                turns = [turn for client in per_client for turn in client]
+                answered = [t for t in turns if t.first_audio is not None]
+                complete = [t for t in turns if t.received_seconds >= args.reply_seconds - 1e-6]
+                ttfa = [(t.first_audio - t.utterance_end) * 1000 for t in answered]
+                stalls = statistics.mean(t.stalls for t in turns) if turns else 0
+                stall_ms = statistics.mean(t.stalled_seconds * 1000 for t in turns) if turns else 0
+                link = client_proxy.stats.stalls
+                print(f"{name:>12}{percentile(ttfa, 0.5):>10.0f}{percentile(ttfa, 0.95):>10.0f}{stalls:>13.2f}"
+                      f"{stall_ms:>15.0f}{len(complete):>6}/{len(turns):<3}{link['up'] + link['down']:>13}")
+        finally:
+            server.terminate()
+            server.wait(10)
+            await client_proxy.stop()
+            await upstream_proxy.stop()
+            await upstream.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", default="lan,wifi,4g,3g,bad", help=f"逗号分隔，可选 {','.join(PROFILES)}")
+    parser.add_argument("--upstream-profile", default="datacenter", choices=sorted(PROFILES))
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--reply-seconds", type=float, default=2.0, help="模拟上游每轮回复的音频时长")
+    parser.add_argument("--think-ms", type=float, default=300, help="模拟上游开始回复前的思考时间")
+    parser.add_argument("--speed", type=float, default=4.0, help="模拟上游的生成速度（实时的倍数）")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""启动耗时测量
+
+用法:
+    python benchmarks/startup_time.py [--top 15] [--runs 3]
+
+1. 在子进程中用 python -X importtime 导入 main，列出累计耗时最多的模块
+2. 多次冷启动子进程导入 main，报告导入耗时的中位数
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _env():
+    env = dict(os.environ)
+    # 只测导入：不需要真实密钥，也不写项目数据库
+    env.setdefault("GEMINI_API_KEY", "bench")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    return env
+
+
+def import_profile(top):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=_env(), capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    # importtime 按后序输出：main 之前、上一个顶层模块之后、缩进一层的行是 main 直接导入的模块
+    end = next(i for i, row in enumerate(rows) if row[2] == " main")
+    start = max((i for i in range(end) if not rows[i][2].startswith("  ")), default=-1) + 1
+    direct = [row for row in rows[start:end] if row[2].startswith("   ") and not row[2].startswith("    ")]
+    print(f"main 直接导入的模块（按累计耗时排序，前 {top} 个）:")
+    for cumulative, _, name in sorted(direct, reverse=True)[:top]:
+        print(f"  {name.strip():<32} {cumulative / 1000:8.1f}ms")
+    total = rows[end][0]
+    print(f"  {'合计':<30} {total / 1000:8.1f}ms")
+
+
+def cold_import(runs):
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    times = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, env=_env(), capture_output=True, text=True, check=True,
+        )
+        times.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    print(f"\n冷启动导入 main（{runs} 次）: 中位数 {statistics.median(times):.0f}ms，最快 {min(times):.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    import_profile(args.top)
+    cold_import(args.runs)
+
+
+if __name__ == "__main__":
+    main()
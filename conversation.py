@@ -0,0 +1,267 @@
+"""滚动对话上下文
+
+每一轮对话都会新建一次上游会话，模型本身不记得之前说过什么。这里为每个学生保留
+一份上下文：最近几轮原样保留，更早的轮次压缩成一行摘要，摘要超出预算时丢弃最旧的
+部分。新建上游会话时把上下文放进 setup 的 system_instruction 一次发出，无论练习多久，
+setup 的大小和模型延迟都保持稳定。
+
+上下文按 user_id 保存在会话注册表所在的SQLite文件（SESSION_REGISTRY_PATH）中，
+所有worker共用：断线后在 CONTEXT_TTL 内重连到任何一个worker都可以继续使用。会话开始时
+读取一次，之后每轮结束时写回。同一学生同时开多个会话时以最后写入的为准。
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from collections import deque
+
+from session_registry import SESSION_REGISTRY_PATH
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "6"))  # 原样保留的最近轮数
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))  # 上下文总预算（估算token）
+CONTEXT_SUMMARY_BUDGET = int(os.getenv("CONTEXT_SUMMARY_BUDGET", "600"))  # 摘要部分的预算
+CONTEXT_TTL = float(os.getenv("CONTEXT_TTL", "1800"))  # 断线后保留上下文的时间（秒）
+COMPACT_CHARS = 80  # 压缩后每轮保留的最大字符数
+
+TUTOR_INSTRUCTION = os.getenv(
+    "TUTOR_INSTRUCTION",
+    "你是一位耐心的英语口语老师。学生会用英语和你对话，请用简短自然的英语回复，"
+    "并在学生出现语法或发音问题时给出纠正和建议。"
+)
+
+_ROLE_NAMES = {"user": "学生", "model": "老师"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversation_contexts (
+    user_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_conversation_contexts_updated_at ON conversation_contexts (updated_at);
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符按1个计，其余按4个字符1个计"""
+    wide = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def compact_turn(role: str, text: str) -> str:
+    """把一轮对话压缩成一行：只保留第一句，并截断到 COMPACT_CHARS"""
+    text = " ".join(text.split())
+    for mark in (". ", "? ", "! ", "。", "？", "！"):
+        index = text.find(mark)
+        if 0 < index < COMPACT_CHARS:
+            text = text[:index + len(mark)].strip()
+            break
+    if len(text) > COMPACT_CHARS:
+        text = text[:COMPACT_CHARS - 1] + "…"
+    return f"{_ROLE_NAMES.get(role, role)}: {text}"
+
+
+class ConversationContext:
+    """一个学生的滚动上下文"""
+
+    def __init__(
+        self,
+        instruction: str = TUTOR_INSTRUCTION,
+        recent_turns: int = CONTEXT_RECENT_TURNS,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        summary_budget: int = CONTEXT_SUMMARY_BUDGET,
+    ):
+        self.instruction = instruction
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.recent = deque()  # (role, text, tokens)
+        self.recent_tokens = 0
+        self.summary = deque()  # (line, tokens)
+        self.summary_tokens = 0
+        self.turns_total = 0
+        self.compacted_total = 0
+        self.dropped_total = 0
+        self._setup_cache = {}
+
+    def add_turn(self, role: str, text: str):
+        text = text.strip()
+        if not text:
+            return
+        tokens = estimate_tokens(text)
+        self.recent.append((role, text, tokens))
+        self.recent_tokens += tokens
+        self.turns_total += 1
+        self._compact()
+        self._setup_cache.clear()
+
+    def _compact(self):
+        recent_budget = self.token_budget - self.summary_budget
+        while len(self.recent) > self.recent_turns or (
+            len(self.recent) > 1 and self.recent_tokens > recent_budget
+        ):
+            role, text, tokens = self.recent.popleft()
+            self.recent_tokens -= tokens
+            line = compact_turn(role, text)
+            line_tokens = estimate_tokens(line)
+            self.summary.append((line, line_tokens))
+            self.summary_tokens += line_tokens
+            self.compacted_total += 1
+        while self.summary and self.summary_tokens > self.summary_budget:
+            _, line_tokens = self.summary.popleft()
+            self.summary_tokens -= line_tokens
+            self.dropped_total += 1
+
+    def render(self) -> str:
+        """生成放进 system_instruction 的文本"""
+        sections = [self.instruction]
+        if self.summary:
+            sections.append("之前对话的摘要：\n" + "\n".join(line for line, _ in self.summary))
+        if self.recent:
+            sections.append("最近的对话：\n" + "\n".join(
+                f"{_ROLE_NAMES.get(role, role)}: {text}" for role, text, _ in self.recent
+            ))
+        return "\n\n".join(sections)
+
+    def setup_message(self, model: str, response_modality: str = None, transcription: bool = False) -> str:
+        """返回序列化好的 setup 消息；上下文没有变化时直接复用
+
+        transcription 为True时请求上游转写学生的语音和模型的语音回复，
+        语音轮次因此也能以文字记入上下文
+        """
+        cache_key = (model, response_modality, transcription)
+        cached = self._setup_cache.get(cache_key)
+        if cached is None:
+            setup = {
+                "model": f"models/{model}",
+                "system_instruction": {"parts": [{"text": self.render()}]},
+            }
+            if response_modality:
+                setup["generation_config"] = {"response_modalities": [response_modality]}
+            if transcription:
+                setup["input_audio_transcription"] = {}
+                setup["output_audio_transcription"] = {}
+            cached = json.dumps({"setup": setup}, ensure_ascii=False)
+            self._setup_cache[cache_key] = cached
+        return cached
+
+    def to_state(self) -> dict:
+        return {
+            "recent": [[role, text] for role, text, _ in self.recent],
+            "summary": [line for line, _ in self.summary],
+            "turns_total": self.turns_total,
+            "compacted_total": self.compacted_total,
+            "dropped_total": self.dropped_total,
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "ConversationContext":
+        context = cls()
+        for role, text in state.get("recent", []):
+            tokens = estimate_tokens(text)
+            context.recent.append((role, text, tokens))
+            context.recent_tokens += tokens
+        for line in state.get("summary", []):
+            tokens = estimate_tokens(line)
+            context.summary.append((line, tokens))
+            context.summary_tokens += tokens
+        context.turns_total = state.get("turns_total", len(context.recent))
+        context.compacted_total = state.get("compacted_total", 0)
+        context.dropped_total = state.get("dropped_total", 0)
+        # 预算配置可能在两次会话之间改过
+        context._compact()
+        return context
+
+    def metrics(self) -> dict:
+        return {
+            "turns_total": self.turns_total,
+            "recent_turns": len(self.recent),
+            "summary_lines": len(self.summary),
+            "tokens": self.recent_tokens + self.summary_tokens,
+            "compacted_total": self.compacted_total,
+            "dropped_total": self.dropped_total,
+        }
+
+
+class ConversationStore:
+    """按 user_id 把上下文保存在共享的SQLite文件中，阻塞调用都放到线程池中执行"""
+
+    def __init__(self, path: str = SESSION_REGISTRY_PATH, ttl: float = CONTEXT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._schema_ready = False
+        self.loads = 0
+        self.restored = 0
+        self.saves = 0
+        self.errors = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            conn.executescript(_SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    def _load(self, user_id):
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT state FROM conversation_contexts WHERE user_id = ? AND updated_at >= ?",
+                (user_id, time.time() - self.ttl),
+            ).fetchone()
+        finally:
+            conn.close()
+
+    def _save(self, user_id, state):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO conversation_contexts VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (user_id, state, now),
+            )
+            # 顺带清理过期的上下文
+            conn.execute("DELETE FROM conversation_contexts WHERE updated_at < ?", (now - self.ttl,))
+        finally:
+            conn.close()
+
+    async def load(self, user_id) -> ConversationContext:
+        """读取学生的上下文；没有、已过期或读取失败时返回新的上下文"""
+        self.loads += 1
+        try:
+            row = await asyncio.to_thread(self._load, user_id)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.error(f"读取对话上下文失败: {str(e)}")
+            return ConversationContext()
+        if row is None:
+            return ConversationContext()
+        self.restored += 1
+        return ConversationContext.from_state(json.loads(row[0]))
+
+    async def save(self, user_id, context: ConversationContext):
+        """每轮结束后写回上下文，写入失败只记录日志，不影响对话"""
+        state = json.dumps(context.to_state(), ensure_ascii=False)
+        try:
+            await asyncio.to_thread(self._save, user_id, state)
+            self.saves += 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.error(f"保存对话上下文失败: {str(e)}")
+
+    def metrics(self) -> dict:
+        return {
+            "loads": self.loads,
+            "restored": self.restored,
+            "saves": self.saves,
+            "errors": self.errors,
+        }
+
+
+conversation_store = ConversationStore()
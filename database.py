@@ -1,19 +1,155 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.engine import make_url
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
+import hashlib
+import logging
 from models import Base
 
-DATABASE_URL = "sqlite+aiosqlite:///./gemini_teacher.db"
+logger = logging.getLogger(__name__)
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# 数据库配置（可通过环境变量覆盖）
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./gemini_teacher.db")
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+# auto：表结构指纹与上次启动相同时跳过建表检查；always：每次启动都检查
+DB_SCHEMA_CHECK = os.getenv("DB_SCHEMA_CHECK", "auto").lower()
+
+
+def _apply_sqlite_pragmas(engine: AsyncEngine):
+    """每个新连接都设置WAL、synchronous=NORMAL和忙等待超时"""
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+
+def create_engines(url: str = DATABASE_URL, echo: bool = DB_ECHO, tuned: bool = True):
+    """按数据库类型创建 (写引擎, 读引擎)
+
+    - SQLite：WAL模式；写入走单连接的写引擎，避免多个连接争抢写锁；读取走独立连接池
+    - PostgreSQL（asyncpg）：调优后的连接池，并开启预编译语句缓存，读写共用同一个引擎
+    - tuned=False 时使用默认配置，仅用于基准测试对比
+    """
+    parsed = make_url(url)
+
+    if not tuned:
+        engine = create_async_engine(url, echo=echo)
+        return engine, engine
+
+    if parsed.get_backend_name() == "sqlite":
+        # aiosqlite默认使用NullPool（每次新建连接），这里显式使用连接池以复用连接
+        write_engine = create_async_engine(
+            url, echo=echo, poolclass=AsyncAdaptedQueuePool,
+            pool_size=1, max_overflow=0, pool_timeout=DB_POOL_TIMEOUT
+        )
+        read_engine = create_async_engine(
+            url, echo=echo, poolclass=AsyncAdaptedQueuePool,
+            pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT
+        )
+        _apply_sqlite_pragmas(write_engine)
+        _apply_sqlite_pragmas(read_engine)
+        return write_engine, read_engine
+
+    if parsed.get_backend_name() == "postgresql":
+        if parsed.get_driver_name() != "asyncpg":
+            logger.warning(f"PostgreSQL建议使用asyncpg驱动，当前为 {parsed.get_driver_name()}")
+        else:
+            # SQLAlchemy的asyncpg方言会预编译每条语句，并按连接缓存
+            parsed = parsed.update_query_dict(
+                {"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)}
+            )
+        engine = create_async_engine(
+            parsed,
+            echo=echo,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+            connect_args={
+                "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+                "server_settings": {"application_name": "gemini-teacher", "jit": "off"},
+            } if parsed.get_driver_name() == "asyncpg" else {},
+        )
+        return engine, engine
+
+    engine = create_async_engine(url, echo=echo, pool_pre_ping=True)
+    return engine, engine
+
+
+engine, read_engine = create_engines()
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
+ReadSessionLocal = sessionmaker(
+    read_engine, class_=AsyncSession, expire_on_commit=False
+)
+
+def _create_missing_indexes(sync_conn):
+    """create_all 不会给已存在的表补建索引，这里逐个检查"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+def schema_fingerprint(metadata=Base.metadata) -> str:
+    """根据模型定义的表、列和索引计算指纹，模型变化时指纹随之变化"""
+    parts = []
+    for table in metadata.sorted_tables:
+        parts.append(table.name)
+        parts.extend(f"{column.name}:{column.type!r}:{column.nullable}" for column in table.columns)
+        parts.extend(
+            f"{index.name}:{','.join(column.name for column in index.columns)}"
+            for index in sorted(table.indexes, key=lambda index: index.name)
+        )
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+async def _stored_fingerprint():
+    """读取上次检查时记录的指纹；表不存在时返回None"""
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(text("SELECT fingerprint FROM schema_state WHERE id = 1"))
+            return result.scalar()
+    except SQLAlchemyError:
+        return None
+
+async def init_db() -> bool:
+    """确保表和索引存在；返回是否真正执行了检查
 
-async def init_db():
+    create_all 会逐表、逐索引查询数据库，worker重启时代价不小。检查完成后把模型的指纹
+    记入 schema_state 表，之后模型没有变化就直接跳过。
+    """
+    fingerprint = schema_fingerprint()
+    if DB_SCHEMA_CHECK != "always" and await _stored_fingerprint() == fingerprint:
+        logger.info("表结构未变化，跳过建表检查")
+        return False
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_state (id INTEGER PRIMARY KEY, fingerprint VARCHAR(64) NOT NULL)"
+        ))
+        await conn.execute(text("DELETE FROM schema_state"))
+        await conn.execute(
+            text("INSERT INTO schema_state (id, fingerprint) VALUES (1, :fingerprint)"),
+            {"fingerprint": fingerprint},
+        )
+    logger.info("已完成建表检查")
+    return True
 
 async def get_db():
     async with AsyncSessionLocal() as session:
@@ -25,3 +161,11 @@ async def get_db():
             raise
         finally:
             await session.close()
+
+async def get_read_db():
+    """只读查询使用的会话（SQLite下不占用写连接）"""
+    async with ReadSessionLocal() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
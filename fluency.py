@@ -0,0 +1,246 @@
+"""本地流利度分析
+
+学生说完一句话后，在等待模型回复的同时先在本地算出几项指标，作为"流利度卡片"推送给
+客户端（目标100ms内），模型的详细纠正随后到达：
+
+- 能量包络：每10ms一帧的RMS（dB）
+- 音高轮廓：YIN算法（差分函数用FFT一次算完所有帧）
+- 语速：能量包络上的音节峰数 / 发声时长
+- 停顿：发声段之间超过 MIN_PAUSE 的静音
+
+计算全部用NumPy向量化，并放在进程池中执行，不占用事件循环。
+"""
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FLUENCY_WORKERS = int(os.getenv("FLUENCY_WORKERS", "1"))  # 分析进程数，0表示关闭
+
+SAMPLE_RATE = 16000
+FRAME = 400  # 25ms 分析窗
+HOP = 160  # 10ms 帧移
+MIN_PITCH = 70.0
+MAX_PITCH = 400.0
+YIN_THRESHOLD = 0.15
+SILENCE_DB = 35.0  # 低于最响帧这么多dB视为静音
+MIN_PAUSE = 0.2  # 计为停顿的最短静音（秒）
+MIN_SYLLABLE_GAP = 0.1  # 两个音节峰的最小间隔（秒）
+CONTOUR_POINTS = 24  # 卡片中轮廓的采样点数
+
+
+def _frames(signal: np.ndarray, length: int) -> np.ndarray:
+    """按 HOP 切分成 (帧数, length) 的视图，不复制数据"""
+    if len(signal) < length:
+        signal = np.pad(signal, (0, length - len(signal)))
+    return np.lib.stride_tricks.sliding_window_view(signal, length)[::HOP]
+
+
+def energy_envelope(signal: np.ndarray) -> np.ndarray:
+    frames = _frames(signal, FRAME)
+    rms = np.sqrt(np.mean(frames * frames, axis=1) + 1e-12)
+    return 20 * np.log10(rms + 1e-9)
+
+
+def pitch_contour(signal: np.ndarray, voiced: np.ndarray) -> np.ndarray:
+    """YIN：对所有有声帧一次性计算，返回每帧的基频（无声帧为0）"""
+    tau_min = int(SAMPLE_RATE / MAX_PITCH)
+    tau_max = int(SAMPLE_RATE / MIN_PITCH)
+    frames = _frames(signal, FRAME + tau_max)[:len(voiced)]
+    pitch = np.zeros(len(voiced))
+    index = np.flatnonzero(voiced[:len(frames)])
+    if len(index) == 0:
+        return pitch
+    x = frames[index]
+
+    # r(tau) = sum_j x[j] * x[j + tau]，j < FRAME，用FFT互相关一次算出
+    size = 1 << int(np.ceil(np.log2(2 * x.shape[1])))
+    head = np.fft.rfft(x[:, :FRAME], size)
+    whole = np.fft.rfft(x, size)
+    r = np.fft.irfft(np.conj(head) * whole, size)[:, :tau_max + 1]
+
+    # d(tau) = e(0) + e(tau) - 2r(tau)，e(tau)为窗口 [tau, tau+FRAME) 的能量
+    squares = np.cumsum(np.pad(x * x, ((0, 0), (1, 0))), axis=1)
+    taus = np.arange(tau_max + 1)
+    energy = squares[:, taus + FRAME] - squares[:, taus]
+    diff = energy[:, :1] + energy - 2 * r
+    diff[:, 0] = 0
+
+    # 累积均值归一化
+    cumulative = np.cumsum(diff[:, 1:], axis=1)
+    cmnd = np.ones_like(diff)
+    cmnd[:, 1:] = diff[:, 1:] * taus[1:] / np.maximum(cumulative, 1e-12)
+
+    below = cmnd[:, tau_min:] < YIN_THRESHOLD
+    found = below.any(axis=1)
+    first = np.argmax(below, axis=1) + tau_min
+    # 从第一个低于阈值的位置一直向后走到局部最小值（走一半会让tau偏小、音高偏高）
+    rows = np.arange(len(first))
+    moving = found.copy()
+    while moving.any():
+        step = np.minimum(first + 1, tau_max)
+        moving &= cmnd[rows, step] < cmnd[rows, first]
+        first = np.where(moving, step, first)
+
+    # 抛物线插值得到小数tau（搜索范围两端的位置不插值）
+    left = cmnd[rows, np.maximum(first - 1, 0)]
+    center = cmnd[rows, first]
+    right = cmnd[rows, np.minimum(first + 1, tau_max)]
+    curvature = left + right - 2 * center
+    inner = (first > tau_min) & (first < tau_max) & (curvature > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.where(inner, (left - right) / (2 * curvature), 0.0)
+    tau = first + offset
+    pitch[index[found]] = SAMPLE_RATE / tau[found]
+    return pitch
+
+
+def _runs(mask: np.ndarray):
+    """返回布尔序列中连续True段的 (起点, 长度)"""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+    starts, ends = edges[::2], edges[1::2]
+    return starts, ends - starts
+
+
+def _downsample(values: np.ndarray, points: int = CONTOUR_POINTS, skip_zero: bool = False) -> list:
+    """把逐帧数值压缩成 points 个点（skip_zero 时只对非零帧取平均，用于音高）"""
+    if len(values) == 0:
+        return []
+    result = []
+    for chunk in np.array_split(values, min(points, len(values))):
+        if skip_zero:
+            chunk = chunk[chunk > 0]
+        result.append(round(float(chunk.mean()), 1) if len(chunk) else 0.0)
+    return result
+
+
+def analyze(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> dict:
+    """分析一句话（16位单声道PCM），返回流利度卡片"""
+    # 奇数长度时丢掉最后一个字节，不因为半个采样放弃整张卡片
+    signal = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2).astype(np.float32) / 32768.0
+    duration = len(signal) / sample_rate
+    if len(signal) < FRAME:
+        return {"duration": round(duration, 2), "speech_seconds": 0.0}
+
+    energy = energy_envelope(signal)
+    frame_seconds = HOP / sample_rate
+    voiced = energy > max(energy.max() - SILENCE_DB, -60.0)
+
+    # 停顿：首个和最后一个发声帧之间的静音段
+    speech = np.flatnonzero(voiced)
+    if len(speech) == 0:
+        return {"duration": round(duration, 2), "speech_seconds": 0.0}
+    inner = ~voiced[speech[0]:speech[-1] + 1]
+    _, silent_lengths = _runs(inner)
+    pauses = silent_lengths[silent_lengths * frame_seconds >= MIN_PAUSE] * frame_seconds
+    speech_seconds = float(voiced.sum() * frame_seconds)
+
+    # 语速：平滑后能量包络的局部峰（近似音节核）
+    smooth = np.convolve(energy, np.ones(5) / 5, mode="same")
+    peaks = np.flatnonzero(
+        (smooth[1:-1] > smooth[:-2]) & (smooth[1:-1] >= smooth[2:]) & voiced[1:-1]
+    ) + 1
+    if len(peaks):
+        gap = int(MIN_SYLLABLE_GAP / frame_seconds)
+        keep = np.concatenate(([True], np.diff(peaks) >= gap))
+        peaks = peaks[keep]
+    syllables = len(peaks)
+
+    pitch = pitch_contour(signal, voiced)
+    voiced_pitch = pitch[pitch > 0]
+    if len(voiced_pitch):
+        median = float(np.median(voiced_pitch))
+        low, high = np.percentile(voiced_pitch, [10, 90])
+        pitch_range = float(12 * np.log2(high / low)) if low > 0 else 0.0
+    else:
+        median, pitch_range = 0.0, 0.0
+
+    rate = syllables / speech_seconds if speech_seconds else 0.0
+    hints = []
+    if len(pauses) and pauses.max() > 1.0:
+        hints.append("long_pause")
+    if rate and rate < 2.0:
+        hints.append("slow")
+    elif rate > 6.5:
+        hints.append("fast")
+    if len(voiced_pitch) > 10 and pitch_range < 2.0:
+        hints.append("monotone")
+
+    return {
+        "duration": round(duration, 2),
+        "speech_seconds": round(speech_seconds, 2),
+        "speaking_rate": round(rate, 2),  # 每秒音节数
+        "syllables": syllables,
+        "pauses": {
+            "count": int(len(pauses)),
+            "total": round(float(pauses.sum()), 2),
+            "longest": round(float(pauses.max()), 2) if len(pauses) else 0.0,
+        },
+        "pitch": {
+            "median_hz": round(median, 1),
+            "range_semitones": round(pitch_range, 1),
+            "contour": _downsample(pitch, skip_zero=True),
+        },
+        "energy": _downsample(energy),
+        "hints": hints,
+    }
+
+
+class FluencyAnalyzer:
+    """在进程池中执行 analyze"""
+
+    def __init__(self, workers: int = FLUENCY_WORKERS):
+        self.workers = workers
+        self._pool = None
+        self.analyzed_total = 0
+        self.errors_total = 0
+        self.time_total = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._pool is not None
+
+    def start(self):
+        if self._pool is None and self.workers > 0:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            # 预热：让子进程提前启动并导入NumPy，第一句话不必等待
+            self._pool.submit(analyze, bytes(FRAME * 2))
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def analyze(self, pcm: bytes):
+        if self._pool is None:
+            return None
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            result = await loop.run_in_executor(self._pool, analyze, pcm)
+        except Exception as e:
+            self.errors_total += 1
+            logger.error(f"流利度分析失败: {str(e)}")
+            return None
+        self.analyzed_total += 1
+        self.time_total += loop.time() - started
+        return result
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.workers if self.enabled else 0,
+            "analyzed_total": self.analyzed_total,
+            "errors_total": self.errors_total,
+            "avg_latency_ms": round(self.time_total / self.analyzed_total * 1000, 1) if self.analyzed_total else None,
+        }
+
+
+fluency_analyzer = FluencyAnalyzer()
@@ -0,0 +1,58 @@
+"""Gemini BidiGenerateContent 消息的构建与解析
+
+只依赖标准库：服务端（gemini_service）、命令行客户端（starter.py）和微基准
+（benchmarks/micro.py）都导入这里的函数，导入时不会带上服务端的数据库等依赖。
+"""
+import sys
+import json
+import array
+import base64
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def realtime_input_message(data: bytes) -> str:
+    """把一段PCM音频序列化成 realtime_input 消息"""
+    return json.dumps({
+        "realtime_input": {
+            "media_chunks": [{
+                "data": base64.b64encode(data).decode(),
+                "mime_type": "audio/pcm"
+            }]
+        }
+    })
+
+
+def parse_server_message(raw):
+    """解析一条上游消息，返回 (事件列表, 是否turnComplete)
+
+    事件为 ("audio", bytes)、("text", str) 或 ("transcript", role, str)，顺序与消息中一致
+    """
+    response = json.loads(raw)
+    # 参数在真正输出时才格式化，其中的base64音频会被替换成长度
+    logger.debug("解析后的响应: %s", response)
+    content = response.get("serverContent")
+    if not content:
+        return [], False
+    events = []
+    for part in content.get("modelTurn", {}).get("parts", []):
+        if "inlineData" in part:
+            events.append(("audio", base64.b64decode(part["inlineData"]["data"])))
+        elif "text" in part:
+            events.append(("text", part["text"]))
+    for field, role in (("inputTranscription", "user"), ("outputTranscription", "model")):
+        text = content.get(field, {}).get("text")
+        if text:
+            events.append(("transcript", role, text))
+    return events, bool(content.get("turnComplete"))
+
+
+def pcm_volume(data: bytes) -> float:
+    """16位小端PCM的平均幅度（用来判断学生是否在说话），末尾不足一个采样的字节忽略"""
+    samples = array.array("h", data[:len(data) // 2 * 2])
+    if not samples:
+        return 0.0
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return sum(map(abs, samples)) / len(samples)
@@ -1,36 +1,239 @@
 import os
 import json
-import base64
 import logging
 import asyncio
 from websockets.asyncio.client import connect
-from websockets.exceptions import ConnectionClosed
+from websockets.exceptions import ConnectionClosed, InvalidStatus
+from gemini_protocol import realtime_input_message, parse_server_message, pcm_volume
+from key_pool import get_key_pool, NoKeyAvailable
+from upstream_workers import get_upstream_pool
+from audio_archive import audio_archive
+from tts_cache import tts_cache
+from conversation import conversation_store, ConversationContext
+from resumption import ReplayBuffer
+from fluency import fluency_analyzer
+from log_pipeline import count
+from usage import usage_meter
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 HOST = 'generativelanguage.googleapis.com'
 MODEL = "gemini-2.0-flash-exp"
+# 上游 BidiGenerateContent 的地址；测试时可以指向 benchmarks/mock_upstream.py 或网络损伤代理
+GEMINI_WS_URL = os.getenv(
+    "GEMINI_WS_URL",
+    f"wss://{HOST}/ws/google.ai.generativelanguage.v1alpha.GenerativeService.BidiGenerateContent"
+)
+SEND_SAMPLE_RATE = 16000  # 客户端上传的PCM采样率
+RECEIVE_SAMPLE_RATE = 24000  # Gemini返回的PCM采样率
+
+RESPONSE_TIMEOUT = 5.0  # 等待Gemini响应的超时时间（秒）
+TEXT_RESPONSE_TIMEOUT = float(os.getenv("TEXT_RESPONSE_TIMEOUT", "15"))  # 文本轮次等待完整回复的超时（秒）
+NO_SPEECH_VOLUME = float(os.getenv("NO_SPEECH_VOLUME", "50"))  # 平均幅度低于该值的一句话视为没有说话，0表示不检查
+
+
+def build_uri(api_key):
+    return f"{GEMINI_WS_URL}?key={api_key}"
+
+
+def is_rate_limited(error):
+    """判断上游错误是否为配额/限流"""
+    if isinstance(error, InvalidStatus):
+        return error.response.status_code == 429
+    if isinstance(error, ConnectionClosed) and error.rcvd is not None:
+        reason = (error.rcvd.reason or "").lower()
+        return "quota" in reason or "resource_exhausted" in reason or "rate" in reason
+    return getattr(error, "rate_limited", False)
+
+
+async def startup(ws, setup_msg=None):
+    """初始化Gemini连接（setup_msg 可以是已经序列化好的字符串）"""
+    if setup_msg is None:
+        setup_msg = {"setup": {"model": f"models/{MODEL}"}}
+    if not isinstance(setup_msg, str):
+        setup_msg = json.dumps(setup_msg)
+    logger.debug("发送初始化消息，大小: %d bytes", len(setup_msg))
+    await ws.send(setup_msg)
+    raw_response = await ws.recv()
+    response = json.loads(raw_response)
+    logger.debug("收到初始化响应: %s", response)
+    return True
+
+
+async def run_turn(uri, data, on_audio, setup_msg=None, timeout=RESPONSE_TIMEOUT, on_text=None, on_transcript=None):
+    """建立上游连接，发送一段音频，并把回复音频逐段交给 on_audio（文本交给 on_text）
+
+    setup 中请求了语音转写时，学生语音和回复语音的转写以 on_transcript(role, text) 分段给出
+
+    收到 turnComplete 时返回True；连接、协议错误和超时以异常抛出
+    """
+    async with await connect(
+        uri,
+        additional_headers={"Content-Type": "application/json"}
+    ) as ws:
+        # 初始化连接
+        await startup(ws, setup_msg)
+
+        # 发送音频数据
+        await ws.send(realtime_input_message(data))
+        count("upstream_audio_sent")
+        count("upstream_audio_sent_bytes", len(data))
+
+        # 设置超时时间
+        async with asyncio.timeout(timeout):
+            # 接收响应
+            while True:
+                events, turn_complete = parse_server_message(await ws.recv())
+                count("upstream_messages")
+                for event in events:
+                    if event[0] == "audio":
+                        count("model_audio_chunks")
+                        count("model_audio_bytes", len(event[1]))
+                        await on_audio(event[1])
+                    elif event[0] == "text":
+                        logger.debug("收到文本响应: %s", event[1])
+                        if on_text is not None:
+                            await on_text(event[1])
+                    elif on_transcript is not None:
+                        await on_transcript(event[1], event[2])
+
+                if turn_complete:
+                    logger.info("Gemini响应完成")
+                    return True
+
+
+class TextSession:
+    """文本对话：整个 /ws 连接期间复用同一个上游连接
+
+    输入以 client_content 发送，模型只返回文本（response_modalities=TEXT），回复分段
+    交给 on_delta，客户端可以边收边显示。上游连接在第一轮时建立，断开后下一轮自动重连。
+    """
+
+    def __init__(self, context, ticket=None, user_id=None):
+        self.context = context
+        self.ticket = ticket  # 准入名额，关闭时释放
+        self.user_id = user_id  # 有值时每轮结束后把上下文写回共享存储
+        self.key_pool = get_key_pool()
+        self.ws = None
+        self.lease = None
+        self.turn = 0
+
+    @property
+    def key_fingerprint(self):
+        return self.lease.fingerprint if self.lease else None
+
+    async def _open(self):
+        self.lease = self.key_pool.acquire()
+        try:
+            self.ws = await connect(
+                build_uri(self.lease.key),
+                additional_headers={"Content-Type": "application/json"}
+            )
+            await startup(self.ws, self.context.setup_message(MODEL, "TEXT"))
+        except Exception as e:
+            self.lease.error(rate_limited=is_rate_limited(e))
+            await self._disconnect()
+            raise
+
+    async def _disconnect(self):
+        if self.ws is not None:
+            try:
+                await self.ws.close()
+            except Exception:
+                pass
+            self.ws = None
+        if self.lease is not None:
+            self.lease.release()
+            self.lease = None
+
+    async def close(self):
+        await self._disconnect()
+        if self.ticket is not None:
+            self.ticket.release()
+            self.ticket = None
+
+    async def run_turn(self, text, on_delta, timeout=TEXT_RESPONSE_TIMEOUT):
+        """发送一句文本，回复分段交给 on_delta，返回完整回复"""
+        self.turn += 1
+        msg = json.dumps({
+            "client_content": {
+                "turns": [{"role": "user", "parts": [{"text": text}]}],
+                "turn_complete": True
+            }
+        }, ensure_ascii=False)
+        for attempt in range(2):
+            if self.ws is None:
+                await self._open()
+            try:
+                await self.ws.send(msg)
+                break
+            except ConnectionClosed:
+                # 空闲期间上游连接被关闭，重连后再发一次
+                await self._disconnect()
+                if attempt:
+                    raise
+
+        parts = []
+        try:
+            async with asyncio.timeout(timeout):
+                while True:
+                    events, turn_complete = parse_server_message(await self.ws.recv())
+                    for event in events:
+                        if event[0] == "text":
+                            parts.append(event[1])
+                            await on_delta(event[1])
+                    if turn_complete:
+                        break
+        except Exception as e:
+            # 回复没有收完，连接状态不确定，下一轮重新建立
+            if self.lease is not None:
+                self.lease.error(rate_limited=is_rate_limited(e))
+            await self._disconnect()
+            raise
+
+        self.lease.success()
+        reply = "".join(parts)
+        self.context.add_turn("user", text)
+        self.context.add_turn("model", reply)
+        if self.user_id is not None:
+            await conversation_store.save(self.user_id, self.context)
+        return reply
+
 
 class GeminiService:
-    def __init__(self):
+    def __init__(self, session_id=None, user_id=None):
         logger.info("初始化 GeminiService...")
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key:
-            logger.error("未设置GEMINI_API_KEY环境变量")
-            raise ValueError("未设置GEMINI_API_KEY环境变量")
-            
-        self.uri = f"wss://{HOST}/ws/google.ai.generativelanguage.v1alpha.GenerativeService.BidiGenerateContent?key={self.api_key}"
+        self.session_id = session_id
+        self.user_id = user_id
+        self.turn = 0  # 当前会话中的对话轮次
+        # 之前的上下文由 load_context 从共享存储读取
+        self.context = ConversationContext()
+        self.key_pool = get_key_pool()
+        if not len(self.key_pool):
+            logger.error("未设置GEMINI_API_KEYS或GEMINI_API_KEY环境变量")
+            raise ValueError("未设置GEMINI_API_KEYS或GEMINI_API_KEY环境变量")
+
+        self.key_fingerprint = None  # 最近一次上游会话使用的密钥指纹
+        self.replay = ReplayBuffer()  # 未确认的回复音频，断线重连后补发
+        self.input_bytes = 0  # 正在处理的这一轮输入音频
+        self._fluency_task = None
+        self.muted_turn = None  # 学生打断的轮次，该轮剩余的回复音频不再发送
         self.is_speaking = False
         self.websocket = None
         self.audio_in_queue = asyncio.Queue()
         self.out_queue = asyncio.Queue(maxsize=5)
         logger.info("GeminiService 初始化完成")
 
-    async def setup_connection(self, websocket):
-        """初始化与客户端的WebSocket连接"""
+    async def load_context(self):
+        """读取学生之前的上下文，断线重连到其他worker时也能接着说"""
+        if self.user_id is not None:
+            self.context = await conversation_store.load(self.user_id)
+
+    async def setup_connection(self, outbound):
+        """初始化与客户端的连接（Outbound 发送队列）"""
         try:
-            self.websocket = websocket
+            outbound.on_audio_frame = self.replay.add
+            self.websocket = outbound
             logger.info("客户端WebSocket连接初始化成功")
             return True
         except Exception as e:
@@ -38,15 +241,46 @@ class GeminiService:
             logger.exception(e)
             return False
 
-    async def startup(self, ws):
-        """初始化Gemini连接"""
-        setup_msg = {"setup": {"model": f"models/{MODEL}"}}
-        logger.info(f"发送初始化消息: {json.dumps(setup_msg)}")
-        await ws.send(json.dumps(setup_msg))
-        raw_response = await ws.recv()
-        response = json.loads(raw_response)
-        logger.info(f"收到初始化响应: {response}")
-        return True
+    async def send_fluency_card(self, turn, data):
+        """计算并推送本轮的流利度卡片"""
+        card = await fluency_analyzer.analyze(data)
+        websocket = self.websocket
+        if card is None or websocket is None:
+            return
+        try:
+            await websocket.send_json({"type": "fluency", "turn": turn, **card})
+        except Exception as e:
+            logger.info(f"发送流利度卡片失败: {str(e)}")
+
+    def memory_usage(self) -> dict:
+        """本会话当前持有的缓冲"""
+        return {
+            "replay_bytes": self.replay.bytes,
+            "replay_chunks": len(self.replay.chunks),
+            "input_bytes": self.input_bytes,
+            "queued_items": self.audio_in_queue.qsize() + self.out_queue.qsize(),
+            "outbound_bytes": self.websocket.queued_bytes if self.websocket is not None else 0,
+            "total": self.replay.bytes + self.input_bytes
+                     + (self.websocket.queued_bytes if self.websocket is not None else 0),
+        }
+
+    def detach(self):
+        """与连接分离：发送队列中还没发出的音频转入重放缓冲区"""
+        outbound, self.websocket = self.websocket, None
+        if outbound is not None:
+            for audio_data in outbound.abort():
+                self.replay.add(audio_data)
+
+    async def attach(self, outbound, last_seq=0):
+        """把恢复的会话接到新连接（Outbound）上，先补发 last_seq 之后的音频"""
+        self.detach()
+        pending = self.replay.since(last_seq)
+        for _, audio_data in pending:
+            outbound.send_audio(audio_data, replayed=True)
+        # 补发的帧已按顺序排在新音频之前
+        outbound.on_audio_frame = self.replay.add
+        self.websocket = outbound
+        return len(pending)
 
     async def handle_audio_stream(self, websocket):
         """处理音频流"""
@@ -56,6 +290,35 @@ class GeminiService:
             logger.error(f"处理音频流时出错: {str(e)}")
             logger.exception(e)
 
+    async def send_audio_to_client(self, audio_data):
+        """把一段回复音频放进发送队列（发送时写入重放缓冲区）；客户端断开时直接写入重放缓冲区"""
+        outbound = self.websocket
+        if self.muted_turn == self.turn:
+            count("muted_audio_chunks")
+        elif outbound is not None and not outbound.closed:
+            outbound.send_audio(audio_data)
+            count("client_audio_chunks")
+        else:
+            self.replay.add(audio_data)
+        if self.session_id:
+            audio_archive.append(self.session_id, self.user_id, self.turn, "model", audio_data, RECEIVE_SAMPLE_RATE)
+
+    def stop_playback(self):
+        """学生打断：丢弃本轮还没发出的回复音频，客户端立即停止播放"""
+        self.muted_turn = self.turn
+        if self.websocket is not None:
+            dropped = self.websocket.flush_audio()
+            logger.info(f"学生打断，丢弃 {dropped} 字节未发送的回复音频")
+
+    async def send_phrase(self, name):
+        """播放缓存中的固定话术（不经过模型），合成器不可用时静默跳过"""
+        try:
+            audio = await tts_cache.phrase(name)
+        except Exception as e:
+            logger.warning(f"获取话术 {name} 失败: {str(e)}")
+            return
+        await self.send_audio_to_client(audio)
+
     async def handle_audio_data(self, data, websocket):
         """处理单个音频数据包"""
         if not isinstance(data, bytes):
@@ -64,68 +327,92 @@ class GeminiService:
 
         # 保存websocket连接
         self.websocket = websocket
+        self.turn += 1
+        if self.session_id:
+            audio_archive.write_turn(self.session_id, self.user_id, self.turn, "user", data, SEND_SAMPLE_RATE)
+        if pcm_volume(data) < NO_SPEECH_VOLUME:
+            # 几乎是静音：不发给模型，直接提示学生靠近麦克风
+            count("no_speech_inputs")
+            await self.send_phrase("no_speech")
+            if self.session_id:
+                audio_archive.finish(self.session_id, self.turn, "model")
+            return False
+        if fluency_analyzer.enabled:
+            # 本地分析与上游对话并行，流利度卡片通常先于模型回复到达
+            self._fluency_task = asyncio.create_task(self.send_fluency_card(self.turn, data))
 
+        # 为本次上游会话选择负载最低的密钥
         try:
-            async with await connect(
-                self.uri,
-                additional_headers={"Content-Type": "application/json"}
-            ) as ws:
-                # 初始化连接
-                await self.startup(ws)
-                
-                # 发送音频数据
-                msg = {
-                    "realtime_input": {
-                        "media_chunks": [{
-                            "data": base64.b64encode(data).decode(),
-                            "mime_type": "audio/pcm"
-                        }]
-                    }
-                }
-                
-                logger.info("正在发送音频数据到Gemini...")
-                await ws.send(json.dumps(msg))
-                logger.info("音频数据已发送，等待响应...")
-                
-                # 设置超时时间
-                try:
-                    async with asyncio.timeout(5.0):  # 5秒超时
-                        # 接收响应
-                        try:
-                            while True:
-                                raw_response = await ws.recv()
-                                logger.info("收到原始响应")
-                                response = json.loads(raw_response)
-                                logger.info(f"解析后的响应: {response}")
-                                
-                                if "serverContent" in response:
-                                    content = response["serverContent"]
-                                    if "modelTurn" in content:
-                                        parts = content["modelTurn"]["parts"]
-                                        for part in parts:
-                                            if "inlineData" in part:
-                                                audio_data = base64.b64decode(part["inlineData"]["data"])
-                                                logger.info(f"收到音频响应，大小: {len(audio_data)} bytes")
-                                                await self.websocket.send_bytes(audio_data)
-                                                logger.info("已发送音频响应至客户端")
-                                            elif "text" in part:
-                                                logger.info(f"收到文本响应: {part['text']}")
-                                                
-                                    if content.get("turnComplete"):
-                                        logger.info("Gemini响应完成")
-                                        return True
-                                        
-                        except Exception as e:
-                            logger.error(f"处理响应时出错: {str(e)}")
-                            return False
-                            
-                except asyncio.TimeoutError:
-                    logger.warning("等待Gemini响应超时")
-                    return False
-                    
+            lease = self.key_pool.acquire()
+        except NoKeyAvailable as e:
+            logger.error(str(e))
+            await websocket.send_json({"type": "error", "error": "服务繁忙，请稍后再试"})
+            await self.send_phrase("busy")
+            return False
+        self.key_fingerprint = lease.fingerprint
+        self.input_bytes = len(data)
+        usage_meter.add_uplink(self.user_id, len(data))
+
+        reply_bytes = 0
+        reply_text = []
+        transcripts = {"user": [], "model": []}
+
+        async def on_audio(audio_data):
+            nonlocal reply_bytes
+            reply_bytes += len(audio_data)
+            usage_meter.add_downlink(self.user_id, len(audio_data))
+            await self.send_audio_to_client(audio_data)
+
+        async def on_text(text):
+            reply_text.append(text)
+
+        async def on_transcript(role, text):
+            transcripts[role].append(text)
+
+        try:
+            setup_msg = self.context.setup_message(MODEL, transcription=True)
+            upstream_pool = get_upstream_pool()
+            if upstream_pool is not None:
+                # 上游I/O在worker进程中完成
+                await upstream_pool.run_turn(
+                    lease.key, data, on_audio, setup_msg, on_text=on_text, on_transcript=on_transcript
+                )
+            else:
+                await run_turn(
+                    build_uri(lease.key), data, on_audio, setup_msg, on_text=on_text, on_transcript=on_transcript
+                )
+            lease.success()
+            usage_meter.add_turn(self.user_id)
+            # 优先记录转写和模型的文字；上游都没有返回时才用时长占位，让模型知道这一轮发生过
+            self.context.add_turn(
+                "user",
+                "".join(transcripts["user"]) or f"（学生说了约{len(data) / (SEND_SAMPLE_RATE * 2):.1f}秒的英语）"
+            )
+            self.context.add_turn(
+                "model",
+                "".join(transcripts["model"]) or "".join(reply_text)
+                or f"（老师用语音回复了约{reply_bytes / (RECEIVE_SAMPLE_RATE * 2):.1f}秒）"
+            )
+            if self.user_id is not None:
+                await conversation_store.save(self.user_id, self.context)
+            return True
+
+        except asyncio.TimeoutError:
+            logger.warning("等待Gemini响应超时")
+            lease.error()
+            await self.send_phrase("retry")
+            return False
         except Exception as e:
             logger.error(f"处理音频数据时出错: {str(e)}")
             logger.exception(e)
+            lease.error(rate_limited=is_rate_limited(e))
+            await self.send_phrase("retry")
+            return False
+        finally:
+            lease.release()
+            self.input_bytes = 0
+            if self.session_id:
+                audio_archive.finish(self.session_id, self.turn, "model")
             
     async def handle_websocket(self, websocket):
         """处理WebSocket连接"""
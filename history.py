@@ -0,0 +1,78 @@
+"""练习历史查询
+
+按 (user_id, created_at, id) 做键集分页：每页都从上一页最后一条记录之后开始，
+直接在复合索引上定位，不使用 OFFSET，因此翻到多深都只读取一页的数据。
+"""
+import base64
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, tuple_
+
+from models import UserLog
+
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+
+
+class InvalidCursor(ValueError):
+    """分页游标无法解析"""
+
+
+def encode_cursor(created_at: datetime, log_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{log_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, log_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(log_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor("无效的分页游标") from e
+
+
+def history_query(
+    user_id: int,
+    cursor: Optional[str] = None,
+    limit: int = HISTORY_DEFAULT_LIMIT,
+    action: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """构造按时间倒序的一页历史记录查询（多取一条用于判断是否还有下一页）"""
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    query = select(UserLog).where(UserLog.user_id == user_id)
+    if action:
+        query = query.where(UserLog.action == action)
+    if since:
+        query = query.where(UserLog.created_at >= since)
+    if until:
+        query = query.where(UserLog.created_at < until)
+    if cursor:
+        created_at, log_id = decode_cursor(cursor)
+        query = query.where(tuple_(UserLog.created_at, UserLog.id) < (created_at, log_id))
+    return query.order_by(UserLog.created_at.desc(), UserLog.id.desc()).limit(limit + 1)
+
+
+def build_page(logs: list, limit: int) -> dict:
+    """把查询结果整理成一页，并生成下一页的游标"""
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    has_more = len(logs) > limit
+    logs = logs[:limit]
+    next_cursor = encode_cursor(logs[-1].created_at, logs[-1].id) if has_more else None
+    return {
+        "items": [
+            {
+                "id": log.id,
+                "action": log.action,
+                "content": log.content,
+                "response": log.response,
+                "processing_time": log.processing_time,
+                "created_at": log.created_at.isoformat() if log.created_at else None,
+            }
+            for log in logs
+        ],
+        "next_cursor": next_cursor,
+    }
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Key池配置
+KEY_BACKOFF_BASE = float(os.getenv("GEMINI_KEY_BACKOFF_BASE", "30"))  # 首次429后的退避时间（秒）
+KEY_BACKOFF_MAX = float(os.getenv("GEMINI_KEY_BACKOFF_MAX", "600"))  # 最长退避时间（秒）
+KEY_ERROR_WINDOW = int(os.getenv("GEMINI_KEY_ERROR_WINDOW", "20"))  # 统计错误率的最近请求数
+KEY_ERROR_THRESHOLD = float(os.getenv("GEMINI_KEY_ERROR_THRESHOLD", "0.5"))  # 错误率超过该值时隔离
+KEY_QUARANTINE_SECONDS = float(os.getenv("GEMINI_KEY_QUARANTINE_SECONDS", "120"))  # 隔离时长（秒）
+KEY_MIN_SAMPLES = 5  # 计算错误率所需的最少样本数
+
+
+class NoKeyAvailable(Exception):
+    """所有API密钥都处于退避或隔离状态"""
+
+
+def fingerprint(key: str) -> str:
+    """生成密钥指纹，只保存哈希前缀，不保存密钥本身"""
+    return "sha256:" + hashlib.sha256(key.encode()).hexdigest()[:12]
+
+
+def load_keys() -> list:
+    """从环境变量读取API密钥
+
+    GEMINI_API_KEYS 支持JSON数组或逗号分隔，未设置时退回到 GEMINI_API_KEY
+    """
+    raw = os.getenv("GEMINI_API_KEYS", "").strip()
+    keys = []
+    if raw:
+        if raw.startswith("["):
+            keys = json.loads(raw)
+        else:
+            keys = raw.split(",")
+    single = os.getenv("GEMINI_API_KEY")
+    if not keys and single:
+        keys = [single]
+    # 去重并保留顺序
+    seen = set()
+    result = []
+    for key in keys:
+        key = key.strip()
+        if key and key not in seen:
+            seen.add(key)
+            result.append(key)
+    return result
+
+
+class _KeyState:
+    def __init__(self, key: str):
+        self.key = key
+        self.fingerprint = fingerprint(key)
+        self.in_flight = 0
+        self.requests_total = 0
+        self.errors_total = 0
+        self.rate_limited_total = 0
+        self.recent = deque(maxlen=KEY_ERROR_WINDOW)  # True表示出错
+        self.backoff_seconds = 0.0
+        self.unavailable_until = 0.0
+        self.quarantined = False
+
+    def error_rate(self) -> float:
+        if not self.recent:
+            return 0.0
+        return sum(self.recent) / len(self.recent)
+
+    def available(self, now: float) -> bool:
+        return now >= self.unavailable_until
+
+
+class KeyLease:
+    """一次上游会话使用的密钥"""
+
+    def __init__(self, pool, state):
+        self.pool = pool
+        self.state = state
+        self.released = False
+
+    @property
+    def key(self) -> str:
+        return self.state.key
+
+    @property
+    def fingerprint(self) -> str:
+        return self.state.fingerprint
+
+    def success(self):
+        self.pool._record(self.state, error=False)
+
+    def error(self, rate_limited: bool = False):
+        self.pool._record(self.state, error=True, rate_limited=rate_limited)
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.state.in_flight -= 1
+
+
+class KeyPool:
+    """多API密钥池，按负载分配并跟踪限流和错误率"""
+
+    def __init__(self, keys: list):
+        self.states = [_KeyState(key) for key in keys]
+        logger.info(f"API密钥池已加载 {len(self.states)} 个密钥")
+
+    def __len__(self):
+        return len(self.states)
+
+    def acquire(self) -> KeyLease:
+        """选择当前进行中会话最少的可用密钥"""
+        now = time.monotonic()
+        candidates = [state for state in self.states if state.available(now)]
+        if not candidates:
+            raise NoKeyAvailable("所有API密钥都在退避或隔离中")
+        state = min(candidates, key=lambda s: (s.in_flight, s.error_rate(), s.requests_total))
+        if state.quarantined:
+            # 隔离期结束，重新试用
+            state.quarantined = False
+            state.recent.clear()
+            logger.info(f"API密钥 {state.fingerprint} 解除隔离")
+        state.in_flight += 1
+        state.requests_total += 1
+        return KeyLease(self, state)
+
+    def _record(self, state, error: bool, rate_limited: bool = False):
+        state.recent.append(error)
+        now = time.monotonic()
+        if not error:
+            state.backoff_seconds = 0.0
+            return
+
+        state.errors_total += 1
+        if rate_limited:
+            # 429：指数退避
+            state.rate_limited_total += 1
+            state.backoff_seconds = min(
+                KEY_BACKOFF_MAX, max(KEY_BACKOFF_BASE, state.backoff_seconds * 2)
+            )
+            state.unavailable_until = max(state.unavailable_until, now + state.backoff_seconds)
+            logger.warning(f"API密钥 {state.fingerprint} 被限流，退避 {state.backoff_seconds:.0f} 秒")
+        elif (
+            len(state.recent) >= KEY_MIN_SAMPLES
+            and state.error_rate() >= KEY_ERROR_THRESHOLD
+            and not state.quarantined
+        ):
+            state.quarantined = True
+            state.unavailable_until = max(state.unavailable_until, now + KEY_QUARANTINE_SECONDS)
+            logger.warning(
+                f"API密钥 {state.fingerprint} 错误率 {state.error_rate():.0%}，隔离 {KEY_QUARANTINE_SECONDS:.0f} 秒"
+            )
+
+    def metrics(self) -> list:
+        """导出每个密钥的指标（只包含指纹）"""
+        now = time.monotonic()
+        return [
+            {
+                "key": state.fingerprint,
+                "in_flight": state.in_flight,
+                "requests_total": state.requests_total,
+                "errors_total": state.errors_total,
+                "rate_limited_total": state.rate_limited_total,
+                "error_rate": round(state.error_rate(), 3),
+                "quarantined": state.quarantined,
+                "unavailable_seconds": round(max(0.0, state.unavailable_until - now), 1),
+            }
+            for state in self.states
+        ]
+
+
+_key_pool = None
+
+
+def get_key_pool() -> KeyPool:
+    """返回进程内共享的密钥池（首次调用时读取环境变量）"""
+    global _key_pool
+    if _key_pool is None:
+        _key_pool = KeyPool(load_keys())
+    return _key_pool
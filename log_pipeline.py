@@ -0,0 +1,142 @@
+"""非阻塞日志
+
+- 所有日志记录先放进有界队列，由后台线程格式化并写出；队列满时丢弃并计数，
+  事件循环不会因为写日志而阻塞
+- 日志参数中的 bytes 和超长字符串（base64音频）在入队前替换成大小说明，音频内容
+  永远不会被转成字符串
+- 每个音频分片都会经过的热路径不再逐条打INFO日志，改为累加计数器（见 /metrics），
+  需要抽样观察时用 HotPathLog 按会话限速输出
+"""
+import os
+import sys
+import time
+import queue
+import logging
+import logging.handlers
+from collections import Counter
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_HOT_RATE = float(os.getenv("LOG_HOT_RATE", "1"))  # 每个会话每秒最多输出的热路径日志条数
+LOG_HOT_BURST = int(os.getenv("LOG_HOT_BURST", "5"))
+LOG_MAX_ARG_CHARS = 256  # 超过该长度的字符串参数会被截断
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 热路径计数器，替代逐分片的INFO日志
+counters = Counter()
+
+
+def count(name: str, value: int = 1):
+    counters[name] += value
+
+
+def redact(value, depth: int = 0):
+    """把音频等大块数据替换成简短说明，只在真正输出日志时调用"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str):
+        if len(value) > LOG_MAX_ARG_CHARS:
+            return f"{value[:64]}…<{len(value)} chars>"
+        return value
+    if depth >= 8:
+        return "…"
+    if isinstance(value, dict):
+        return {key: redact(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item, depth + 1) for item in value]
+    return value
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """入队时不格式化，只脱敏参数；队列满时丢弃"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if record.args:
+            if isinstance(record.args, dict):
+                record.args = redact(record.args)
+            else:
+                record.args = tuple(redact(arg) for arg in record.args)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    """把根日志器改为经由队列输出（可重复调用）"""
+    global _handler, _listener
+    if _listener is not None:
+        return
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+    _handler = _QueueHandler(log_queue)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """停止后台线程，并写出队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class HotPathLog:
+    """按 key（通常是会话ID）限速的日志：令牌桶允许的才输出，其余只计数"""
+
+    def __init__(self, logger, rate: float = LOG_HOT_RATE, burst: int = LOG_HOT_BURST):
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # key -> [令牌数, 上次补充时间, 被省略的条数]
+
+    def log(self, key, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(self.burst), now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            count("hot_log_suppressed")
+            return
+        bucket[0] -= 1
+        if bucket[2]:
+            msg = f"{msg}（此前省略 {bucket[2]} 条）"
+            bucket[2] = 0
+        self.logger.log(level, msg, *args)
+
+    def info(self, key, msg, *args):
+        self.log(key, logging.INFO, msg, *args)
+
+    def forget(self, key):
+        self.buckets.pop(key, None)
+
+
+def metrics() -> dict:
+    return {
+        "queue_depth": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+        "counters": dict(counters),
+    }
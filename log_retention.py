@@ -0,0 +1,412 @@
+"""user_logs 的分区归档、保留期清理和压缩
+
+SQLite 下按月分区：早于热数据窗口的日志分批移入 LOG_ARCHIVE_DIR 下的
+user_logs_YYYY_MM.db，需要时再 ATTACH；超过保留期的月份先汇总进 user_daily_stats，
+再整个删除分区文件。压缩（PRAGMA optimize / incremental_vacuum）在后台小步进行，
+事件循环繁忙时暂停，避免影响在线会话。
+
+切换到增量回收模式需要对主库做一次完整 VACUUM，期间所有worker的写入都会被阻塞，
+因此不在后台自动执行，而是在停服维护时手动运行一次：
+
+    python log_retention.py enable-incremental-vacuum
+
+PostgreSQL 不做文件分区，只按保留期分批汇总并删除。
+"""
+import os
+import re
+import glob
+import fcntl
+import asyncio
+import sqlite3
+import logging
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.engine import make_url
+
+from admission import admission
+from database import DATABASE_URL, DB_BUSY_TIMEOUT_MS, AsyncSessionLocal
+from models import UserLog, UserDailyStats, MaintenanceState
+from stats import stats_aggregator, STATS_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+LOG_ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "./log_archive")
+LOG_HOT_MONTHS = int(os.getenv("LOG_HOT_MONTHS", "1"))  # 主库中保留的完整月份数（不含当月）
+LOG_RETENTION_MONTHS = max(LOG_HOT_MONTHS + 1, int(os.getenv("LOG_RETENTION_MONTHS", "6")))  # 原始日志保留月数
+LOG_MAINTENANCE_INTERVAL = float(os.getenv("LOG_MAINTENANCE_INTERVAL", "3600"))  # 维护任务间隔（秒）
+LOG_MAINTENANCE_BATCH = int(os.getenv("LOG_MAINTENANCE_BATCH", "2000"))  # 每个事务处理的行数
+LOG_MAINTENANCE_PAUSE = float(os.getenv("LOG_MAINTENANCE_PAUSE", "0.05"))  # 批次之间的停顿（秒）
+LOG_VACUUM_PAGES = int(os.getenv("LOG_VACUUM_PAGES", "500"))  # 每次增量回收的页数
+MAINTENANCE_MAX_LOOP_LAG_MS = 50  # 事件循环延迟超过该值时暂停维护
+
+STATS_WATERMARK_KEY = "stats_live_since"
+_SQLITE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+_PARTITION_RE = re.compile(r"user_logs_(\d{4})_(\d{2})\.db$")
+_COLUMNS = "id, user_id, action, content, response, created_at, api_key_used, processing_time"
+
+
+def month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1)
+
+
+def add_months(dt: datetime, months: int) -> datetime:
+    index = dt.year * 12 + dt.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _sqlite_time(dt: datetime) -> str:
+    return dt.strftime(_SQLITE_TIME_FORMAT)
+
+
+def _parse_time(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def partition_path(month: datetime) -> str:
+    return os.path.join(LOG_ARCHIVE_DIR, f"user_logs_{month.year:04d}_{month.month:02d}.db")
+
+
+def list_partitions() -> list:
+    """返回已有的分区 [(月份, 路径)]，按月份从新到旧排列"""
+    partitions = []
+    for path in glob.glob(os.path.join(LOG_ARCHIVE_DIR, "user_logs_*.db")):
+        match = _PARTITION_RE.search(path)
+        if match:
+            partitions.append((datetime(int(match.group(1)), int(match.group(2)), 1), path))
+    return sorted(partitions, reverse=True)
+
+
+def _sqlite_path():
+    url = make_url(DATABASE_URL)
+    if url.get_backend_name() != "sqlite":
+        return None
+    return url.database
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def _ensure_archive_schema(conn):
+    """按主库中 user_logs 的建表语句在分区中建表和索引"""
+    for (sql,) in conn.execute(
+        "SELECT sql FROM main.sqlite_master WHERE tbl_name = 'user_logs' AND sql IS NOT NULL"
+    ).fetchall():
+        sql = re.sub(r"^CREATE TABLE (\S+)", r"CREATE TABLE IF NOT EXISTS archive.\1", sql)
+        sql = re.sub(r"^CREATE (UNIQUE )?INDEX (\S+)", r"CREATE \1INDEX IF NOT EXISTS archive.\2", sql)
+        # 分区中没有 users 表，去掉外键约束
+        sql = re.sub(r",\s*FOREIGN KEY\s*\([^)]*\)\s*REFERENCES[^,)]*\([^)]*\)", "", sql)
+        conn.execute(sql)
+
+
+def _archive_batch(db_path, archive_path, start, end, batch):
+    """把 [start, end) 内的一批日志从主库移到分区，返回移动的行数"""
+    conn = _connect(db_path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        _ensure_archive_schema(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        ids = [
+            row[0] for row in conn.execute(
+                "SELECT id FROM main.user_logs WHERE created_at >= ? AND created_at < ? ORDER BY id LIMIT ?",
+                (_sqlite_time(start), _sqlite_time(end), batch),
+            )
+        ]
+        if ids:
+            placeholders = ",".join("?" * len(ids))
+            # WAL模式下跨库事务不保证原子，INSERT OR IGNORE 保证中断后重跑不会重复
+            conn.execute(
+                f"INSERT OR IGNORE INTO archive.user_logs ({_COLUMNS}) "
+                f"SELECT {_COLUMNS} FROM main.user_logs WHERE id IN ({placeholders})",
+                ids,
+            )
+            conn.execute(f"DELETE FROM main.user_logs WHERE id IN ({placeholders})", ids)
+        conn.execute("COMMIT")
+        return len(ids)
+    finally:
+        conn.close()
+
+
+def _oldest_log_time(db_path):
+    conn = _connect(db_path)
+    try:
+        (value,) = conn.execute("SELECT MIN(created_at) FROM user_logs").fetchone()
+        return _parse_time(value)
+    finally:
+        conn.close()
+
+
+def _read_partition_batch(path, after_id, batch):
+    conn = _connect(path)
+    try:
+        return conn.execute(
+            f"SELECT {_COLUMNS} FROM user_logs WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, batch),
+        ).fetchall()
+    finally:
+        conn.close()
+
+
+def _vacuum_file(path):
+    conn = _connect(path)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def _compact_step(db_path, pages):
+    """一次小步压缩，返回剩余的空闲页数"""
+    conn = _connect(db_path)
+    try:
+        conn.execute("PRAGMA optimize")
+        (mode,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+        if mode != 2:
+            return None
+        # sqlite3 的 execute 对该 PRAGMA 只执行一步，只回收一页；executescript 会执行完
+        conn.executescript(f"PRAGMA incremental_vacuum({pages});")
+        (free_pages,) = conn.execute("PRAGMA freelist_count").fetchone()
+        return free_pages
+    finally:
+        conn.close()
+
+
+def _enable_incremental_vacuum(db_path):
+    """切换到增量回收模式需要一次完整VACUUM，只能在服务停止时执行"""
+    conn = _connect(db_path)
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def _row_to_log(row):
+    log = SimpleNamespace(**dict(zip(_COLUMNS.split(", "), row)))
+    log.created_at = _parse_time(log.created_at)
+    return log
+
+
+def _query_partition(path, user_id, before, limit, action, since, until):
+    conn = _connect(path)
+    try:
+        sql = f"SELECT {_COLUMNS} FROM user_logs WHERE user_id = ?"
+        params = [user_id]
+        if action:
+            sql += " AND action = ?"
+            params.append(action)
+        if since:
+            sql += " AND created_at >= ?"
+            params.append(_sqlite_time(since))
+        if until:
+            sql += " AND created_at < ?"
+            params.append(_sqlite_time(until))
+        if before:
+            sql += " AND (created_at, id) < (?, ?)"
+            params.extend([_sqlite_time(before[0]), before[1]])
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit)
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+async def archive_history(user_id, before, limit, action=None, since=None, until=None) -> list:
+    """从分区中按时间倒序继续读取历史记录（主库中的记录已读完时使用）"""
+    logs = []
+    for month, path in list_partitions():
+        if len(logs) >= limit:
+            break
+        if since and add_months(month, 1) <= since:
+            break
+        if before and month > before[0]:
+            continue
+        rows = await asyncio.to_thread(
+            _query_partition, path, user_id, before, limit - len(logs), action, since, until
+        )
+        logs.extend(_row_to_log(row) for row in rows)
+    return logs
+
+
+class LogMaintenance:
+    """定期执行日志归档、保留期清理和压缩"""
+
+    def __init__(self):
+        self._task = None
+        self.stats_watermark = None
+        self.last_run = None
+        self.rows_archived_total = 0
+        self.rows_expired_total = 0
+        self.partitions_dropped_total = 0
+        self.incremental_vacuum_hinted = False
+
+    async def _throttle(self):
+        """批次之间停顿；事件循环繁忙时等待其恢复"""
+        await asyncio.sleep(LOG_MAINTENANCE_PAUSE)
+        while admission.loop_lag_ms > MAINTENANCE_MAX_LOOP_LAG_MS:
+            await asyncio.sleep(1)
+
+    async def _load_stats_watermark(self):
+        """读取统计开始增量维护的时间，此后的日志已计入汇总表"""
+        async with AsyncSessionLocal() as db:
+            state = await db.get(MaintenanceState, STATS_WATERMARK_KEY)
+            if state is None:
+                first_flush = (await db.execute(select(func.min(UserDailyStats.updated_at)))).scalar()
+                watermark = (
+                    first_flush - timedelta(seconds=STATS_FLUSH_INTERVAL) if first_flush else datetime.utcnow()
+                )
+                state = MaintenanceState(key=STATS_WATERMARK_KEY, value=watermark.isoformat())
+                db.add(state)
+                await db.commit()
+            self.stats_watermark = datetime.fromisoformat(state.value)
+
+    def _rollup(self, logs):
+        """把统计开始之前的日志计入汇总表（之后的已经实时计入）"""
+        for log in logs:
+            if log.created_at and log.created_at < self.stats_watermark:
+                stats_aggregator.record(log)
+
+    async def archive_old_months(self, db_path):
+        cutoff = add_months(month_start(datetime.utcnow()), -LOG_HOT_MONTHS)
+        oldest = await asyncio.to_thread(_oldest_log_time, db_path)
+        if oldest is None or oldest >= cutoff:
+            return
+        month = month_start(oldest)
+        while month < cutoff:
+            end = add_months(month, 1)
+            path = partition_path(month)
+            moved_month = 0
+            while True:
+                moved = await asyncio.to_thread(_archive_batch, db_path, path, month, end, LOG_MAINTENANCE_BATCH)
+                moved_month += moved
+                self.rows_archived_total += moved
+                if moved < LOG_MAINTENANCE_BATCH:
+                    break
+                await self._throttle()
+            if moved_month:
+                logger.info(f"已将 {moved_month} 条日志归档到 {path}")
+                await asyncio.to_thread(_vacuum_file, path)
+            month = end
+
+    async def drop_expired_partitions(self):
+        cutoff = add_months(month_start(datetime.utcnow()), -LOG_RETENTION_MONTHS)
+        for month, path in list_partitions():
+            if month >= cutoff:
+                continue
+            after_id = 0
+            while True:
+                rows = await asyncio.to_thread(_read_partition_batch, path, after_id, LOG_MAINTENANCE_BATCH)
+                if not rows:
+                    break
+                self._rollup([_row_to_log(row) for row in rows])
+                after_id = rows[-1][0]
+                self.rows_expired_total += len(rows)
+                await self._throttle()
+            await stats_aggregator.flush()
+            os.remove(path)
+            self.partitions_dropped_total += 1
+            logger.info(f"已删除超过保留期的日志分区 {path}")
+
+    async def expire_rows(self):
+        """非SQLite后端：按保留期分批汇总并删除原始日志"""
+        cutoff = add_months(month_start(datetime.utcnow()), -LOG_RETENTION_MONTHS)
+        while True:
+            async with AsyncSessionLocal() as db:
+                logs = (await db.execute(
+                    select(UserLog).where(UserLog.created_at < cutoff).order_by(UserLog.id).limit(LOG_MAINTENANCE_BATCH)
+                )).scalars().all()
+                if not logs:
+                    break
+                self._rollup(logs)
+                await db.execute(delete(UserLog).where(UserLog.id.in_([log.id for log in logs])))
+                await db.commit()
+            await stats_aggregator.flush()
+            self.rows_expired_total += len(logs)
+            await self._throttle()
+
+    async def compact(self, db_path):
+        mode_ready = await asyncio.to_thread(_compact_step, db_path, LOG_VACUUM_PAGES)
+        if mode_ready is None:
+            # 本worker没有会话不代表其他worker也空闲，完整VACUUM留给停服维护时手动执行
+            if not self.incremental_vacuum_hinted:
+                self.incremental_vacuum_hinted = True
+                logger.warning("主库未开启增量回收，只执行 PRAGMA optimize；"
+                               "请在停服时运行 python log_retention.py enable-incremental-vacuum")
+            return
+        while mode_ready:
+            await self._throttle()
+            mode_ready = await asyncio.to_thread(_compact_step, db_path, LOG_VACUUM_PAGES)
+
+    async def run_once(self):
+        # 多个worker同时运行时，只有拿到锁的那个执行维护
+        os.makedirs(LOG_ARCHIVE_DIR, exist_ok=True)
+        with open(os.path.join(LOG_ARCHIVE_DIR, ".maintenance.lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("其他worker正在执行日志维护，跳过本次")
+                return
+
+            if self.stats_watermark is None:
+                await self._load_stats_watermark()
+            db_path = _sqlite_path()
+            if db_path:
+                await self.archive_old_months(db_path)
+                await self.drop_expired_partitions()
+                await self.compact(db_path)
+            else:
+                await self.expire_rows()
+            self.last_run = datetime.utcnow()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"日志维护任务出错: {str(e)}")
+                logger.exception(e)
+            await asyncio.sleep(LOG_MAINTENANCE_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "partitions": len(list_partitions()),
+            "rows_archived_total": self.rows_archived_total,
+            "rows_expired_total": self.rows_expired_total,
+            "partitions_dropped_total": self.partitions_dropped_total,
+        }
+
+
+log_maintenance = LogMaintenance()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] != ["enable-incremental-vacuum"]:
+        sys.exit("用法: python log_retention.py enable-incremental-vacuum（请先停止服务）")
+    db_path = _sqlite_path()
+    if not db_path:
+        sys.exit("只有SQLite主库需要切换增量回收模式")
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"对 {db_path} 执行完整VACUUM并切换到增量回收模式")
+    _enable_incremental_vacuum(db_path)
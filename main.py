@@ -1,39 +1,66 @@
+import time
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, Request, Form, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.websockets import WebSocketDisconnect
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date
 from jose import jwt, JWTError
 import json
 import os
 import uuid
 import logging
 from dotenv import load_dotenv
+
+# 加载环境变量（需在导入读取配置的模块之前）
+load_dotenv()
+
 from typing import List, Optional
 from pydantic import BaseModel
-import time
 from sqlalchemy import select
-from database import get_db, init_db
+from database import get_db, get_read_db, init_db, AsyncSessionLocal
 from models import User, UserLog
 from auth import (
     get_current_user,
+    get_current_admin,
     create_access_token,
     authenticate_user,
     get_password_hash,
     get_user,
+    get_admin_usernames,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     SECRET_KEY,
     ALGORITHM
 )
-from gemini_service import GeminiService
+from gemini_service import GeminiService, TextSession
+from admission import admission, AdmissionRejected
+from key_pool import get_key_pool, NoKeyAvailable
+from upstream_workers import start_upstream_pool, stop_upstream_pool, get_upstream_pool
+from session_registry import get_session_registry, SessionLimitExceeded
+from history import history_query, build_page, decode_cursor, InvalidCursor, HISTORY_DEFAULT_LIMIT
+from audio_archive import audio_archive, parse_range, RangeNotSatisfiable, MemoryViewResponse, AUDIO_ARCHIVE_ENABLED
+from log_retention import log_maintenance, archive_history
+from conversation import conversation_store
+from resumption import resume_manager
+from session_monitor import session_monitor
+from fluency import fluency_analyzer
+from readiness import readiness
+from uplink import uplink_registry
+from usage import usage_meter
+from profiler import profiler, ProfilerBusy, collapsed, speedscope, PROFILE_INTERVAL_MS, PROFILE_MAX_SECONDS
+import outbound as outbound_metrics
+from outbound import Outbound
+import log_pipeline
+from log_pipeline import setup_logging, stop_logging, HotPathLog, count
+from assets import asset_files
+from tts_cache import tts_cache, cache_key, TTS_VOICE, TTS_SAMPLE_RATE
+from stats import stats_aggregator, audio_input_content, summarize, user_stats_query, all_users_stats_query, PCM_BYTES_PER_SECOND
 from fastapi.templating import Jinja2Templates
-import base64
-
-# 加载环境变量
-load_dotenv()
+import asyncio
 
 app = FastAPI()
 
@@ -46,16 +73,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 配置日志记录
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# 配置日志记录（经由队列在后台线程写出）
+setup_logging()
 logger = logging.getLogger(__name__)
+hot_log = HotPathLog(logger)
 
-# 静态文件
+# 静态文件：/static 保留原始文件，/assets 发布带哈希、预压缩、可长期缓存的版本
 app.mount("/static", StaticFiles(directory="static"), name="static")
+try:
+    asset_files.load()
+except OSError as e:
+    logger.error(f"构建静态资源失败，页面将使用 /static 下的原始文件: {str(e)}")
+app.mount("/assets", asset_files, name="assets")
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["asset_url"] = asset_files.url
+templates.env.globals["asset_urls"] = asset_files.urls
 
 # 定义请求模型
 class RegisterRequest(BaseModel):
@@ -71,9 +103,11 @@ async def read_root(request: Request):
 @app.post("/token")
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
+    read_db: AsyncSession = Depends(get_read_db),
     db: AsyncSession = Depends(get_db)
 ):
-    user = await authenticate_user(db, form_data.username, form_data.password)
+    # 查用户和校验密码（较慢）都不占用写连接，只有写登录日志时才短暂使用
+    user = await authenticate_user(read_db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -135,14 +169,35 @@ async def register(
 class ConnectionManager:
     def __init__(self):
         self.active_connections = {}
-        self.gemini_service = GeminiService()
+        self.text_sessions = {}  # client_id -> TextSession
         
-    def disconnect(self, client_id: str):
+    async def disconnect(self, client_id: str):
+        text_session = self.text_sessions.pop(client_id, None)
+        if text_session is not None:
+            await text_session.close()
         if client_id in self.active_connections:
-            del self.active_connections[client_id]
+            self.active_connections.pop(client_id).abort()
+            await get_session_registry().unregister(client_id)
+
+    async def _text_session(self, client_id: str, user_id: int):
+        """第一次文本对话时申请准入名额并创建上游会话"""
+        text_session = self.text_sessions.get(client_id)
+        if text_session is None:
+            outbound = self.active_connections[client_id]
+
+            async def notify_position(position):
+                await outbound.send_json({"type": "queue", "position": position})
+
+            ticket = await admission.acquire(user_id, on_position=notify_position)
+            text_session = TextSession(await conversation_store.load(user_id), ticket, user_id=user_id)
+            self.text_sessions[client_id] = text_session
+        return text_session
             
     async def process_message(self, message: str, client_id: str, user_id: int, db: AsyncSession):
-        """处理来自客户端的消息"""
+        """处理来自客户端的文本消息，回复以 text_delta 分段推送"""
+        outbound = self.active_connections.get(client_id)
+        if outbound is None:
+            return
         try:
             # 记录用户输入
             log = UserLog(
@@ -152,33 +207,44 @@ class ConnectionManager:
             )
             db.add(log)
             await db.commit()
-            
-            # 调用Gemini处理消息
-            response = await self.gemini_service.process_audio(message)
-            
-            if response:
-                # 发送响应给客户端
-                if client_id in self.active_connections:
-                    await self.active_connections[client_id].send_json({
-                        "text": response.text,
-                        "audio": response.audio
-                    })
-                    
-                # 记录响应日志
-                log = UserLog(
-                    user_id=user_id,
-                    action="gemini_response",
-                    content=response.text[:100] if response.text else "Audio response"
-                )
-                db.add(log)
-                await db.commit()
-                
+
+            text_session = await self._text_session(client_id, user_id)
+            turn = text_session.turn + 1
+
+            async def on_delta(text):
+                await outbound.send_json({"type": "text_delta", "turn": turn, "text": text})
+
+            started = time.monotonic()
+            response = await text_session.run_turn(message, on_delta)
+            processing_time = int((time.monotonic() - started) * 1000)
+            await outbound.send_json({
+                "type": "text_done",
+                "turn": turn,
+                "text": response,
+                "processing_time": processing_time
+            })
+
+            # 记录响应日志
+            log = UserLog(
+                user_id=user_id,
+                action="gemini_response",
+                content=response[:100] if response else "No response",
+                api_key_used=text_session.key_fingerprint,
+                processing_time=processing_time
+            )
+            db.add(log)
+            await db.commit()
+
+        except AdmissionRejected as e:
+            await outbound.send_json({"type": "error", "error": "服务繁忙，请稍后再试", "reason": e.reason})
+        except NoKeyAvailable:
+            await outbound.send_json({"type": "error", "error": "服务繁忙，请稍后再试", "reason": "no_key"})
+        except asyncio.TimeoutError:
+            logger.warning("等待Gemini文本回复超时")
+            await outbound.send_json({"type": "error", "error": "回复超时，请再试一次", "reason": "timeout"})
         except Exception as e:
             logger.error(f"处理消息时出错: {str(e)}")
-            if client_id in self.active_connections:
-                await self.active_connections[client_id].send_json({
-                    "error": str(e)
-                })
+            await outbound.send_json({"type": "error", "error": "处理消息时出错"})
 
 manager = ConnectionManager()
 
@@ -200,62 +266,49 @@ async def websocket_endpoint(
         if not user:
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
+        # 结束查询事务，避免长连接期间一直占用数据库连接
+        await db.commit()
 
         await websocket.accept()
-        client_id = str(uuid.uuid4())
-        manager.active_connections[client_id] = websocket
+        client_id = await get_session_registry().register(user.id, username, "/ws")
+        # 所有发送都经过发送队列，慢速客户端不会阻塞处理
+        outbound = Outbound(websocket)
+        manager.active_connections[client_id] = outbound
+        tracker = session_monitor.track(outbound, "/ws")
         
         try:
             while True:
                 data = await websocket.receive_json()
+                tracker.seen()
                 
+                if data.get("type") == "text":
+                    # 文本对话：不经过音频编码，回复逐段推送
+                    tracker.active()
+                    text = (data.get("text") or "").strip()
+                    if text:
+                        await manager.process_message(text, client_id, user.id, db)
+                    continue
+
                 if data.get("type") == "audio":
-                    # 处理音频数据
-                    audio_data = base64.b64decode(data["data"])
-                    
-                    # 记录用户输入日志
-                    log = UserLog(
-                        user_id=user.id,
-                        action="audio_input",
-                        content=f"Audio input received: {len(audio_data)} bytes"
-                    )
-                    db.add(log)
-                    await db.commit()
-                    
-                    try:
-                        # 发送音频到Gemini并获取响应
-                        response = await manager.gemini_service.process_audio(audio_data)
-                        
-                        if response:
-                            # 发送响应给客户端
-                            await websocket.send_json({
-                                "type": "response",
-                                "audio": base64.b64encode(response.audio).decode() if response.audio else None,
-                                "text": response.text if response.text else None
-                            })
-                            
-                            # 记录响应日志
-                            log = UserLog(
-                                user_id=user.id,
-                                action="gemini_response",
-                                content=f"Response sent: {response.text[:100] if response.text else 'Audio only'}..."
-                            )
-                            db.add(log)
-                            await db.commit()
-                            
-                    except Exception as e:
-                        logger.error(f"处理Gemini响应时出错: {str(e)}")
-                        await websocket.send_json({
-                            "error": "处理响应时出错"
-                        })
-                        
+                    # 语音对话只走 /ws/audio（准入、用量、断线恢复都在那里）
+                    await outbound.send_json({"type": "error", "error": "/ws 不支持音频，请使用 /ws/audio"})
+
         except WebSocketDisconnect:
-            manager.disconnect(client_id)
+            await manager.disconnect(client_id)
             logger.info(f"WebSocket connection closed for user: {username}")
+        except asyncio.CancelledError:
+            if tracker.reason is None:
+                raise
+            # 被心跳/空闲回收，结束这个连接
+            asyncio.current_task().uncancel()
+            await manager.disconnect(client_id)
+            await websocket.close(code=4000, reason=tracker.reason)
         except Exception as e:
             logger.error(f"WebSocket error: {str(e)}")
-            manager.disconnect(client_id)
+            await manager.disconnect(client_id)
             await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+        finally:
+            session_monitor.untrack(tracker)
             
     except JWTError:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
@@ -267,6 +320,9 @@ async def websocket_endpoint(
 async def websocket_endpoint(
     websocket: WebSocket,
     token: str = Query(None),
+    resume: Optional[str] = Query(None),
+    last_seq: int = Query(0),
+    stream: bool = Query(False),
     db: AsyncSession = Depends(get_db)
 ):
     try:
@@ -285,25 +341,132 @@ async def websocket_endpoint(
             logger.error(f"找不到用户: {username}")
             await websocket.close(code=4001, reason="User not found")
             return
+        # 结束查询事务，避免长连接期间一直占用数据库连接
+        await db.commit()
             
         await websocket.accept()
         logger.info(f"用户 {username} 的WebSocket连接已建立")
-        
-        gemini_service = GeminiService()
+
+        # 今天的配额已用完时不再占用上游名额
+        if await usage_meter.check(user.id):
+            logger.info(f"用户 {username} 今天的配额已用完")
+            await websocket.send_json(quota_message(user.id))
+            await websocket.close(code=1000, reason="Daily quota reached")
+            return
+
+        # 断线重连时优先接回保留中的会话，不再重新排队和登记
+        session = resume_manager.resume(resume, user.id) if resume else None
+        if session is not None:
+            gemini_service = session.service
+            # 之后的所有发送都经过发送队列，慢速客户端不会阻塞读取上游回复
+            outbound = Outbound(websocket)
+            replayed = await gemini_service.attach(outbound, last_seq)
+            await outbound.send_json({
+                "type": "resumed",
+                "session_id": gemini_service.session_id,
+                "resume_token": session.token,
+                "replayed": replayed,
+            })
+            logger.info(f"用户 {username} 的会话已恢复，补发 {replayed} 段音频")
+        else:
+            # 申请上游会话名额，排队时向客户端推送位置
+            async def notify_position(position):
+                await websocket.send_json({"type": "queue", "position": position})
+
+            try:
+                ticket = await admission.acquire(user.id, on_position=notify_position)
+            except AdmissionRejected as e:
+                logger.warning(f"用户 {username} 的会话未被准入: {e.reason}")
+                await websocket.send_json({"type": "error", "error": "服务繁忙，请稍后再试", "reason": e.reason})
+                await websocket.close(code=1013, reason="Server busy")
+                return
+
+            # 在跨worker的注册表中登记，保证单用户并发限制对所有worker生效
+            try:
+                session_id = await get_session_registry().register(
+                    user.id, username, "/ws/audio", max_per_user=admission.max_per_user
+                )
+            except SessionLimitExceeded as e:
+                ticket.release()
+                logger.warning(str(e))
+                await websocket.send_json({"type": "error", "error": "同时进行的对话过多", "reason": "user_limit"})
+                await websocket.close(code=1013, reason="Too many sessions")
+                return
+
+            async def close_session(ticket=ticket, session_id=session_id):
+                ticket.release()
+                await get_session_registry().unregister(session_id)
+
+            try:
+                gemini_service = GeminiService(session_id=session_id, user_id=user.id)
+                await gemini_service.load_context()
+            except Exception as e:
+                logger.error(f"创建Gemini服务失败: {str(e)}")
+                await close_session()
+                return
+            session = resume_manager.issue(user.id, gemini_service, close_session)
+            outbound = Outbound(websocket)
+            await gemini_service.setup_connection(outbound)
+            await outbound.send_json({"type": "admitted", "session_id": session_id, "resume_token": session.token})
+            logger.info(f"用户 {username} 的Gemini连接已建立")
+
+        # 采样分析时按任务名把调用链归到会话
+        asyncio.current_task().set_name(f"/ws/audio {gemini_service.session_id}")
+        generation = session.generation
         connection_active = True
+        # 客户端正常关闭（1000/1001）时直接结束会话，其余断开都保留一段时间等待重连
+        close_code = None
+        tracker = session_monitor.track(outbound, "/ws/audio", gemini_service)
+        # stream=1 的客户端边说边按帧上传，帧长由服务端根据链路情况调整
+        uplink = uplink_registry.open(outbound, stream)
+        if stream:
+            await outbound.send_json(uplink.hello())
+
+        async def process_utterance(audio_bytes):
+            nonlocal connection_active, close_code
+            # 会话进行中用完配额：不再发给模型，通知学生后正常结束会话
+            if await usage_meter.check(user.id):
+                logger.info(f"用户 {username} 在会话中用完了今天的配额")
+                # 经发送队列发出：上一轮还没发完的回复音频和用量消息先发完，再通知用完配额
+                await outbound.drain()
+                await outbound.send_json(quota_message(user.id))
+                await outbound.drain()
+                close_code = 1000
+                connection_active = False
+                return
+            count("client_audio_inputs")
+            hot_log.info(gemini_service.session_id, "收到音频数据，大小: %d bytes", len(audio_bytes))
+            db.add(UserLog(
+                user_id=user.id,
+                action="audio_input",
+                content=audio_input_content(len(audio_bytes))
+            ))
+            started = time.monotonic()
+            success = await gemini_service.handle_audio_data(audio_bytes, outbound)
+            # 记录本轮响应及所用密钥的指纹
+            db.add(UserLog(
+                user_id=user.id,
+                action="gemini_response",
+                content="Audio response" if success else "No response",
+                api_key_used=gemini_service.key_fingerprint,
+                processing_time=int((time.monotonic() - started) * 1000)
+            ))
+            await db.commit()
+            remaining = usage_meter.remaining(user.id)
+            if remaining is not None:
+                await outbound.send_json({"type": "usage", "remaining_seconds": round(remaining, 1)})
         
         try:
-            await gemini_service.setup_connection(websocket)
-            logger.info(f"用户 {username} 的Gemini连接已建立")
-            
             # 处理音频流
             while connection_active:
                 try:
                     data = await websocket.receive()
-                    logger.debug(f"收到原始数据: {data}")
+                    logger.debug("收到原始数据: %s", data)
+                    tracker.seen()
                     
                     if data.get('type') == 'websocket.disconnect':
                         logger.info(f"用户 {username} 主动断开连接")
+                        close_code = data.get('code')
                         connection_active = False
                         break
                         
@@ -311,16 +474,37 @@ async def websocket_endpoint(
                         if data.get('type') == 'websocket.receive':
                             audio_bytes = data.get('bytes')
                             if audio_bytes:
-                                logger.info(f"收到音频数据，大小: {len(audio_bytes)} bytes")
-                                await gemini_service.handle_audio_data(audio_bytes, websocket)
+                                tracker.active()
+                                if not stream:
+                                    await process_utterance(audio_bytes)
+                                    continue
+                                count("client_audio_frames")
+                                if uplink.add_frame(audio_bytes):
+                                    await process_utterance(uplink.take_utterance())
+                                else:
+                                    await uplink.maybe_probe()
+                            elif data.get('text'):
+                                message = json.loads(data['text'])
+                                if message.get('type') == 'ack':
+                                    gemini_service.replay.ack(int(message.get('seq', 0)))
+                                elif message.get('type') == 'pong':
+                                    await uplink.on_pong(message)
+                                elif message.get('type') == 'stop_playback':
+                                    gemini_service.stop_playback()
+                                elif message.get('type') == 'utterance_end':
+                                    if uplink.pending_bytes:
+                                        await process_utterance(uplink.take_utterance())
+                                else:
+                                    logger.info(f"收到控制命令: {message}")
                             else:
                                 logger.warning("收到空的音频数据")
                         else:
                             logger.info(f"收到控制命令: {data}")
-                            await gemini_service.handle_audio_data(data, websocket)
+                            await gemini_service.handle_audio_data(data, outbound)
                             
-                except WebSocketDisconnect:
+                except WebSocketDisconnect as e:
                     logger.info(f"用户 {username} 的WebSocket连接已断开")
+                    close_code = e.code
                     connection_active = False
                     break
                 except RuntimeError as e:
@@ -330,9 +514,30 @@ async def websocket_endpoint(
                         break
                     raise
                     
+        except asyncio.CancelledError:
+            if tracker.reason is None:
+                raise
+            # 被回收：断线的会话仍可在保留期内恢复，空闲或超出内存的会话直接结束
+            asyncio.current_task().uncancel()
+            if tracker.final:
+                close_code = 1000
+                try:
+                    await websocket.send_json({"type": "error", "error": "会话已结束", "reason": tracker.reason})
+                except Exception:
+                    pass
         except Exception as e:
             logger.error(f"处理用户 {username} 的音频流时出错: {str(e)}")
             logger.exception(e)
+        finally:
+            session_monitor.untrack(tracker)
+            uplink_registry.close(uplink)
+            hot_log.forget(gemini_service.session_id)
+            if session.generation == generation:
+                gemini_service.detach()
+            if close_code in (1000, 1001):
+                await resume_manager.close(session, generation)
+            else:
+                resume_manager.park(session, generation)
             
     finally:
         try:
@@ -340,12 +545,258 @@ async def websocket_endpoint(
         except:
             pass
 
+def quota_message(user_id) -> dict:
+    return {
+        "type": "quota_exceeded",
+        "error": "今天的练习时长已用完，明天再来吧",
+        "used_seconds": round(usage_meter.used(user_id), 1),
+        "limit_seconds": usage_meter.limit,
+    }
+
 # 启动事件
 @app.on_event("startup")
 async def startup_event():
-    await init_db()
+    admission.start()
+    session_monitor.start()
+    get_session_registry().start()
+    if AUDIO_ARCHIVE_ENABLED:
+        audio_archive.start()
+    tts_cache.start()
+    fluency_analyzer.start()
+    start_upstream_pool()
+    # 建表检查和等待worker启动在后台进行，完成后 /ready 才返回200
+    readiness.start(warm_up())
+
+async def warm_up():
+    with readiness.phase("database"):
+        await init_db()
+    # 以下任务需要数据表已存在
+    stats_aggregator.start(AsyncSessionLocal)
+    usage_meter.start(AsyncSessionLocal)
+    log_maintenance.start()
+    upstream_pool = get_upstream_pool()
+    with readiness.phase("upstream_pool"):
+        if upstream_pool is not None:
+            await upstream_pool.wait_ready()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await readiness.stop()
+    await session_monitor.stop()
+    await resume_manager.stop()
+    await admission.stop()
+    await get_session_registry().stop()
+    await log_maintenance.stop()
+    await asyncio.to_thread(audio_archive.stop)
+    await tts_cache.stop()
+    fluency_analyzer.stop()
+    await stats_aggregator.stop()
+    await usage_meter.stop()
+    await stop_upstream_pool()
+    stop_logging()
+
+@app.get("/metrics")
+async def metrics():
+    """导出运行指标"""
+    upstream_pool = get_upstream_pool()
+    return {
+        "admission": admission.metrics(),
+        "api_keys": get_key_pool().metrics(),
+        "upstream_workers": upstream_pool.metrics() if upstream_pool else [],
+        "log_maintenance": log_maintenance.metrics(),
+        "audio_archive": audio_archive.metrics(),
+        "tts_cache": tts_cache.metrics(),
+        "conversation": conversation_store.metrics(),
+        "resumption": resume_manager.metrics(),
+        "sessions": session_monitor.metrics(),
+        "fluency": fluency_analyzer.metrics(),
+        "logging": log_pipeline.metrics(),
+        "startup": readiness.metrics(),
+        "uplink": uplink_registry.metrics(),
+        "outbound": outbound_metrics.metrics(),
+        "usage": usage_meter.metrics(),
+        "profiler": profiler.metrics(),
+    }
+
+@app.get("/ready")
+async def ready():
+    """就绪检查：数据库和上游worker池都预热完成后才返回200，供负载均衡器使用"""
+    status_code = status.HTTP_200_OK if readiness.ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(readiness.metrics(), status_code=status_code)
 
 @app.get("/verify_token")
 async def verify_token(current_user: User = Depends(get_current_user)):
     """验证token是否有效"""
     return {"status": "valid", "username": current_user.username}
+
+@app.get("/history")
+async def get_history(
+    cursor: Optional[str] = None,
+    limit: int = Query(HISTORY_DEFAULT_LIMIT, ge=1, le=200),
+    action: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """分页返回练习历史（管理员可通过 user_id 查看其他学生）"""
+    if user_id is None:
+        user_id = current_user.id
+    elif user_id != current_user.id and current_user.username not in get_admin_usernames():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权查看其他用户的记录")
+
+    try:
+        query = history_query(user_id, cursor, limit, action, since, until)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    result = await db.execute(query)
+    logs = list(result.scalars().all())
+
+    # 主库中的记录不足一页时，继续从按月归档的分区中读取
+    if len(logs) <= limit:
+        before = (logs[-1].created_at, logs[-1].id) if logs else (decode_cursor(cursor) if cursor else None)
+        logs += await archive_history(user_id, before, limit + 1 - len(logs), action, since, until)
+    return build_page(logs, limit)
+
+@app.get("/stats")
+async def get_stats(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    user_id: Optional[int] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """按天返回练习统计：说话分钟数、轮数和平均响应时间（只读汇总表）"""
+    if user_id is None:
+        user_id = current_user.id
+    elif user_id != current_user.id and current_user.username not in get_admin_usernames():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权查看其他用户的统计")
+
+    result = await db.execute(user_stats_query(user_id, since, until))
+    return {"user_id": user_id, **summarize(result.scalars().all())}
+
+@app.get("/usage")
+async def get_usage(current_user: User = Depends(get_current_user)):
+    """今天已用的音频秒数和剩余配额"""
+    await usage_meter.refresh(current_user.id)
+    return {
+        "used_seconds": round(usage_meter.used(current_user.id), 1),
+        "limit_seconds": usage_meter.limit or None,
+        "remaining_seconds": usage_meter.remaining(current_user.id),
+    }
+
+@app.get("/admin/stats")
+async def admin_stats(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    admin: User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """教师视图：所有学生在时间范围内的练习统计"""
+    result = await db.execute(all_users_stats_query(since, until))
+    return {
+        "students": [
+            {
+                "user_id": row.user_id,
+                "active_days": row.active_days,
+                "minutes_spoken": round(row.audio_input_bytes / PCM_BYTES_PER_SECOND / 60, 2),
+                "turns": row.turns,
+                "avg_response_ms": round(row.response_time_total_ms / row.response_time_count) if row.response_time_count else None,
+            }
+            for row in result
+        ]
+    }
+
+def _check_archive_access(current_user: User, owner_id):
+    if owner_id != current_user.id and current_user.username not in get_admin_usernames():
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权访问该录音")
+
+@app.get("/archive/{session_id}")
+async def list_archived_turns(session_id: str, current_user: User = Depends(get_current_user)):
+    """列出某次会话中归档的录音"""
+    turns = await asyncio.to_thread(audio_archive.list_session, session_id)
+    if not turns:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="没有找到录音")
+    _check_archive_access(current_user, turns[0]["user_id"])
+    return {"session_id": session_id, "turns": turns}
+
+@app.get("/archive/{session_id}/{turn}/{kind}")
+async def get_archived_audio(
+    session_id: str,
+    turn: int,
+    kind: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """返回一轮录音（16位PCM），支持Range请求"""
+    entry = await asyncio.to_thread(audio_archive.lookup, session_id, turn, kind)
+    if not entry:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="没有找到录音")
+    _check_archive_access(current_user, entry["user_id"])
+
+    view = audio_archive.view(entry)
+    media_type = f"audio/L16;rate={entry['sample_rate']};channels=1"
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "private, max-age=86400"}
+    try:
+        byte_range = parse_range(request.headers.get("range"), len(view))
+    except RangeNotSatisfiable:
+        return JSONResponse(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            content={"detail": "无效的Range"},
+            headers={"Content-Range": f"bytes */{len(view)}"},
+        )
+    if byte_range is None:
+        return MemoryViewResponse(view, headers=headers, media_type=media_type)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(view)}"
+    return MemoryViewResponse(view[start:end + 1], status_code=status.HTTP_206_PARTIAL_CONTENT, headers=headers, media_type=media_type)
+
+@app.get("/admin/sessions")
+async def admin_sessions(admin: User = Depends(get_current_admin)):
+    """列出所有worker上的活动会话"""
+    sessions = await get_session_registry().list_sessions()
+    return {"count": len(sessions), "sessions": sessions}
+
+@app.post("/admin/profile")
+async def admin_profile(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(PROFILE_INTERVAL_MS, ge=1, le=1000),
+    format: str = Query("speedscope", pattern="^(speedscope|collapsed)$"),
+    mode: str = Query("wall", pattern="^(wall|cpu)$"),
+    admin: User = Depends(get_current_admin)
+):
+    """对本worker采样一段时间，返回 speedscope JSON（含 wall 和 cpu）或指定模式的 collapsed stacks"""
+    try:
+        result = await profiler.profile(seconds, interval_ms / 1000)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    logger.info(f"管理员 {admin.username} 完成了 {result['duration']}s 的采样，共 {result['samples']} 次")
+    if format == "collapsed":
+        return Response(collapsed(result[mode]), media_type="text/plain; charset=utf-8")
+    return speedscope(result, name=f"worker {os.getpid()}")
+
+@app.get("/tts")
+async def synthesize_text(
+    request: Request,
+    text: str = Query(..., min_length=1, max_length=500),
+    voice: str = TTS_VOICE,
+    current_user: User = Depends(get_current_user)
+):
+    """返回一段提示语的合成语音（16位PCM），重复的文本直接从缓存返回"""
+    etag = f'"{cache_key(text, voice)}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    try:
+        audio = await tts_cache.get(text, voice)
+    except Exception as e:
+        logger.error(f"合成语音失败: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="语音合成暂不可用")
+    return Response(
+        audio,
+        media_type=f"audio/L16;rate={TTS_SAMPLE_RATE};channels=1",
+        headers={"ETag": etag, "Cache-Control": "private, max-age=86400"},
+    )
+
+# 导入耗时（不含Python解释器启动），见 /metrics 的 startup.phases.import
+readiness.record("import", time.perf_counter() - _import_started)
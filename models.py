@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Date, DateTime, Boolean, ForeignKey, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
@@ -25,3 +25,40 @@ class UserLog(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     api_key_used = Column(String(50), nullable=True)  # 记录使用的API密钥（可以只存储一部分）
     processing_time = Column(Integer, nullable=True)  # 处理时间（毫秒）
+
+    __table_args__ = (
+        # 按用户分页查询历史记录：(user_id, created_at, id) 上的键集分页
+        Index("ix_user_logs_user_created_id", "user_id", "created_at", "id"),
+        Index("ix_user_logs_user_action_created_id", "user_id", "action", "created_at", "id"),
+    )
+
+class UserDailyStats(Base):
+    __tablename__ = "user_daily_stats"
+
+    # 每个用户每天一行，由 stats.StatsAggregator 随日志写入增量更新
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    audio_inputs = Column(Integer, default=0, nullable=False)  # 语音输入次数
+    audio_input_bytes = Column(BigInteger, default=0, nullable=False)  # 语音输入的PCM字节数
+    turns = Column(Integer, default=0, nullable=False)  # Gemini回复轮数
+    response_time_total_ms = Column(BigInteger, default=0, nullable=False)  # 回复耗时之和
+    response_time_count = Column(Integer, default=0, nullable=False)  # 记录了耗时的回复数
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class UserUsage(Base):
+    __tablename__ = "user_usage"
+
+    # 每个用户每天一行，由 usage.UsageMeter 定期把内存中的计量增量合并进来
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    uplink_seconds = Column(Float, default=0, nullable=False)  # 发给模型的音频时长
+    downlink_seconds = Column(Float, default=0, nullable=False)  # 模型回复的音频时长
+    turns = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class MaintenanceState(Base):
+    __tablename__ = "maintenance_state"
+
+    # 后台维护任务的键值状态，例如统计汇总开始增量维护的时间
+    key = Column(String(50), primary_key=True)
+    value = Column(String(100))
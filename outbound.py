@@ -0,0 +1,293 @@
+"""每个连接的发送调度
+
+以前各处直接 await websocket.send_json / send_bytes：学生的网络慢时，发送会阻塞读取
+上游回复的协程，控制消息和文字也要排在音频后面。现在每个连接有一个 Outbound：
+
+- 调用方只把消息放进队列，立即返回；由一个写任务按优先级发送：
+  控制消息 > 文字（text_delta、流利度卡片等） > 音频
+- 队列中相邻的小音频帧在发送时合并成一帧，减少帧数
+- 队列中的字节数超过 OUTBOUND_DEGRADE_BYTES 时判定为慢速客户端，音频降为 12kHz
+  （字节数减半），并在音频通道内先发送 {"type": "audio_format", "sample_rate": N}；
+  积压消化后恢复
+- 超过 OUTBOUND_MAX_BYTES，或单次发送超过 OUTBOUND_SEND_TIMEOUT 秒，断开连接
+  （/ws/audio 的会话进入断线保留，未发送的音频转入重放缓冲区）
+- 音频按播放速度放行（见 pacing.py），因节奏控制而留在队列中的音频不算积压；
+  flush_audio() 立即丢弃未发出的音频并通知客户端停止播放
+
+Outbound 提供与 WebSocket 相同的 send_json / send_bytes，可以直接替代 websocket 传给
+GeminiService、心跳等发送方。
+"""
+import os
+import asyncio
+import logging
+from collections import deque, Counter
+
+import numpy as np
+
+from log_pipeline import count
+from pacing import Pacer, duration, BYTES_PER_SECOND
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_COALESCE_BYTES = int(os.getenv("OUTBOUND_COALESCE_BYTES", "16384"))  # 合并后单帧的最大字节数
+OUTBOUND_DEGRADE_BYTES = int(os.getenv("OUTBOUND_DEGRADE_BYTES", str(256 * 1024)))  # 积压超过该值时降低音质
+OUTBOUND_MAX_BYTES = int(os.getenv("OUTBOUND_MAX_BYTES", str(2 * 1024 * 1024)))  # 积压超过该值时断开
+OUTBOUND_SEND_TIMEOUT = float(os.getenv("OUTBOUND_SEND_TIMEOUT", "10"))  # 单次发送的超时（秒）
+OUTBOUND_DRAIN_TIMEOUT = float(os.getenv("OUTBOUND_DRAIN_TIMEOUT", "30"))  # 结束会话前等待队列发完的最长时间（秒）
+AUDIO_SAMPLE_RATE = 24000  # 模型回复音频的采样率
+SLOW_CONSUMER_CLOSE_CODE = 4002
+
+CONTROL, TEXT, AUDIO = 0, 1, 2
+PRIORITY_NAMES = ("control", "text", "audio")
+# 按 type 归入文字优先级的消息，其余JSON消息都是控制消息
+TEXT_TYPES = frozenset({"text_delta", "text_done", "response", "fluency"})
+
+
+def downsample(data: bytes) -> bytes:
+    """24kHz -> 12kHz：相邻两个采样取平均"""
+    samples = np.frombuffer(data, dtype="<i2", count=len(data) // 2)
+    if len(samples) % 2:
+        samples = samples[:-1]
+    pairs = samples.reshape(-1, 2).astype(np.int32)
+    return ((pairs[:, 0] + pairs[:, 1]) // 2).astype("<i2").tobytes()
+
+
+connections = set()  # 本worker中未关闭的 Outbound
+
+
+class Outbound:
+    def __init__(self, websocket, on_audio_frame=None):
+        self.websocket = websocket
+        # 每个新音频帧真正发送前调用（GeminiService 用它写入重放缓冲区），补发的帧不调用
+        self.on_audio_frame = on_audio_frame
+        self.lanes = (deque(), deque(), deque())
+        self.queued_bytes = 0
+        self.degraded = False
+        self.sent_rate = AUDIO_SAMPLE_RATE  # 客户端当前认为的音频采样率
+        self.closed = False
+        self.close_reason = None
+        self.sent = Counter()
+        self.sent_bytes = 0
+        self.coalesced = 0
+        self.degraded_total = 0
+        self.peak_bytes = 0
+        self.flushes = 0
+        self.pacer = Pacer()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()  # 队列为空且没有正在进行的发送
+        self._idle.set()
+        self._task = asyncio.create_task(self._writer())
+        connections.add(self)
+
+    # ---- 入队（不阻塞） ----
+
+    def _put(self, priority, item, size):
+        if self.closed:
+            count("outbound_dropped")
+            return
+        self.lanes[priority].append(item)
+        self._idle.clear()
+        self.queued_bytes += size
+        self.peak_bytes = max(self.peak_bytes, self.queued_bytes)
+        self._check_backlog()
+        self._wakeup.set()
+
+    async def send_json(self, message: dict, priority: int = None):
+        if priority is None:
+            priority = TEXT if message.get("type") in TEXT_TYPES else CONTROL
+        self._put(priority, ("json", message), 0)
+
+    async def send_bytes(self, data: bytes):
+        self.send_audio(data)
+
+    def send_audio(self, data: bytes, replayed: bool = False):
+        """把一段回复音频放进音频通道；replayed 表示是重放缓冲区中补发的帧"""
+        self._put(AUDIO, ("audio", data, replayed), len(data))
+
+    # ---- 慢速客户端 ----
+
+    def _check_backlog(self):
+        # 客户端还有缓冲时是节奏控制在扣住音频，队列中的音频不算积压
+        holding = self.pacer.enabled and self.pacer.buffered() > 0
+        if not holding and self.queued_bytes > OUTBOUND_MAX_BYTES:
+            self._fail("slow_consumer")
+        elif not self.degraded and not holding and self.queued_bytes > OUTBOUND_DEGRADE_BYTES:
+            self.degraded = True
+            self.degraded_total += 1
+            count("outbound_degraded")
+            logger.info(f"客户端接收过慢（积压 {self.queued_bytes} 字节），降低音频采样率")
+        elif self.degraded and (holding or self.queued_bytes < OUTBOUND_DEGRADE_BYTES // 4):
+            self.degraded = False
+
+    def flush_audio(self) -> int:
+        """学生打断时调用：丢弃还没发出的音频，并通知客户端清空播放队列；返回丢弃的字节数"""
+        lane = self.lanes[AUDIO]
+        dropped = sum(len(item[1]) for item in lane)
+        lane.clear()
+        self.queued_bytes -= dropped
+        self.pacer.flush()
+        self.flushes += 1
+        count("outbound_flushes")
+        self._put(CONTROL, ("json", {"type": "flush"}), 0)
+        return dropped
+
+    def _fail(self, reason):
+        if self.closed:
+            return
+        logger.warning(f"断开客户端连接: {reason}（积压 {self.queued_bytes} 字节）")
+        count(f"outbound_{reason}")
+        self.closed = True
+        self.close_reason = reason
+        self._wakeup.set()
+        asyncio.get_running_loop().create_task(self._close_websocket(reason))
+
+    async def _close_websocket(self, reason):
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason=reason)
+        except Exception:
+            pass
+
+    # ---- 写任务 ----
+
+    def _next(self):
+        """返回 (优先级, 消息)；没有可发送的消息时返回 (None, 需要等待的秒数或None)"""
+        for priority, lane in enumerate(self.lanes):
+            if lane:
+                if priority == AUDIO:
+                    wait = self.pacer.delay(duration(lane[0][1]))
+                    if wait > 0:
+                        return None, wait
+                return priority, lane.popleft()
+        return None, None
+
+    def _coalesce(self, data):
+        """把音频通道中紧随其后的新音频帧合并进来"""
+        lane = self.lanes[AUDIO]
+        parts = [data]
+        size = len(data)
+        limit = OUTBOUND_COALESCE_BYTES
+        if self.pacer.enabled:
+            # 合并后客户端的缓冲仍不超过节奏控制允许的超前量
+            limit = min(limit, max(int(self.pacer.room() * BYTES_PER_SECOND), len(data)))
+        while lane and lane[0][0] == "audio" and not lane[0][2] and size + len(lane[0][1]) <= limit:
+            _, more, _ = lane.popleft()
+            self.queued_bytes -= len(more)
+            parts.append(more)
+            size += len(more)
+        if len(parts) > 1:
+            self.coalesced += len(parts) - 1
+            return b"".join(parts)
+        return data
+
+    async def drain(self, timeout: float = OUTBOUND_DRAIN_TIMEOUT) -> bool:
+        """等待已入队的消息全部发出（音频仍按节奏放行），返回是否发完"""
+        try:
+            async with asyncio.timeout(timeout):
+                await self._idle.wait()
+        except TimeoutError:
+            return False
+        return not self.closed
+
+    async def _send(self, coroutine):
+        async with asyncio.timeout(OUTBOUND_SEND_TIMEOUT):
+            await coroutine
+
+    async def _writer(self):
+        try:
+            while True:
+                priority, item = self._next()
+                if priority is None:
+                    if self.closed:
+                        return
+                    if item is None:
+                        self._idle.set()
+                    self._wakeup.clear()
+                    try:
+                        # item 为等待节奏控制放行的时间；期间有新消息入队也会被唤醒
+                        async with asyncio.timeout(item):
+                            await self._wakeup.wait()
+                    except TimeoutError:
+                        pass
+                    continue
+                if self.closed:
+                    # 连接已判定失败，只保留音频（由 abort 取走），其余丢弃
+                    if item[0] == "audio":
+                        self.lanes[AUDIO].appendleft(item)
+                    return
+                if item[0] == "json":
+                    await self._send(self.websocket.send_json(item[1]))
+                else:
+                    _, data, replayed = item
+                    self.queued_bytes -= len(data)
+                    if not replayed:
+                        data = self._coalesce(data)
+                        if self.on_audio_frame is not None:
+                            self.on_audio_frame(data)
+                    rate = AUDIO_SAMPLE_RATE // 2 if self.degraded else AUDIO_SAMPLE_RATE
+                    if rate != self.sent_rate:
+                        await self._send(self.websocket.send_json({"type": "audio_format", "sample_rate": rate}))
+                        self.sent_rate = rate
+                    seconds = duration(data)
+                    if rate != AUDIO_SAMPLE_RATE:
+                        data = downsample(data)
+                    await self._send(self.websocket.send_bytes(data))
+                    self.pacer.sent(seconds)
+                    self.sent_bytes += len(data)
+                    self._check_backlog()
+                self.sent[PRIORITY_NAMES[priority]] += 1
+        except asyncio.CancelledError:
+            raise
+        except TimeoutError:
+            self._fail("send_timeout")
+        except Exception as e:
+            logger.info(f"发送失败，客户端可能已断开: {str(e)}")
+            self.closed = True
+            self.close_reason = "send_error"
+        finally:
+            self._idle.set()
+
+    def abort(self) -> list:
+        """停止写任务，返回尚未发送的新音频（调用方写入重放缓冲区）"""
+        self.closed = True
+        connections.discard(self)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        unsent = [item[1] for item in self.lanes[AUDIO] if item[0] == "audio" and not item[2]]
+        for lane in self.lanes:
+            lane.clear()
+        self.queued_bytes = 0
+        return unsent
+
+    async def close(self, code: int = 1000):
+        self.abort()
+        await self.websocket.close(code=code)
+
+    def metrics(self) -> dict:
+        return {
+            "queued_bytes": self.queued_bytes,
+            "queued": {name: len(lane) for name, lane in zip(PRIORITY_NAMES, self.lanes)},
+            "peak_bytes": self.peak_bytes,
+            "degraded": self.degraded,
+            "sent": dict(self.sent),
+            "sent_bytes": self.sent_bytes,
+            "coalesced": self.coalesced,
+            "client_buffered_ms": round(self.pacer.buffered() * 1000),
+            "flushes": self.flushes,
+            "close_reason": self.close_reason,
+        }
+
+
+def metrics() -> dict:
+    active = list(connections)
+    return {
+        "connections": len(active),
+        "queued_bytes": sum(o.queued_bytes for o in active),
+        "max_queued_bytes": max((o.queued_bytes for o in active), default=0),
+        "degraded": sum(1 for o in active if o.degraded),
+        "client_buffered_ms": {
+            "avg": round(sum(o.pacer.buffered() for o in active) / len(active) * 1000) if active else 0,
+            "max": round(max((o.pacer.buffered() for o in active), default=0) * 1000),
+        },
+        "flushes": sum(o.flushes for o in active),
+    }
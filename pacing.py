@@ -0,0 +1,58 @@
+"""回复音频的下行节奏控制
+
+Gemini 生成语音通常比实时快，以前每个 inlineData 一到就转发，浏览器要缓冲整段回复：
+低端设备上占内存，学生想打断时也停不下来（音频已经都在客户端了）。
+
+Pacer 记录客户端已收到、但还没播完的音频时长。只有当客户端的缓冲少于
+DOWNLINK_LEAD_MS 时才放行下一帧，所以客户端最多只比播放进度超前这么多；其余音频
+留在服务端的发送队列中，打断时可以立即丢弃。
+"""
+import os
+import time
+
+DOWNLINK_PACING = os.getenv("DOWNLINK_PACING", "true").lower() in ("1", "true", "yes")
+DOWNLINK_LEAD_MS = int(os.getenv("DOWNLINK_LEAD_MS", "300"))  # 客户端最多超前播放进度的时长
+BYTES_PER_SECOND = 24000 * 2  # 24kHz 16位单声道
+
+
+def duration(data) -> float:
+    return len(data) / BYTES_PER_SECOND
+
+
+class Pacer:
+    def __init__(self, lead: float = DOWNLINK_LEAD_MS / 1000, enabled: bool = DOWNLINK_PACING, clock=time.monotonic):
+        self.lead = lead
+        self.enabled = enabled
+        self.clock = clock
+        self.play_until = 0.0  # 客户端播完已发送音频的时刻（按本机时钟估算）
+        self.sent_seconds = 0.0
+        self.flushed_seconds = 0.0
+
+    def buffered(self) -> float:
+        """客户端当前缓冲的音频时长（秒）"""
+        return max(self.play_until - self.clock(), 0.0)
+
+    def delay(self, seconds: float = 0.0) -> float:
+        """还需要等待多久才能发送一帧时长为 seconds 的音频，0表示可以立即发送
+
+        发出后客户端的缓冲不超过 lead；单帧比 lead 还长时等客户端播完再发。
+        """
+        if not self.enabled:
+            return 0.0
+        return max(self.buffered() - max(self.lead - seconds, 0.0), 0.0)
+
+    def room(self) -> float:
+        """现在最多还能发送多长的音频"""
+        if not self.enabled:
+            return float("inf")
+        return max(self.lead - self.buffered(), 0.0)
+
+    def sent(self, seconds: float):
+        """记录发出了一帧：接在客户端已缓冲的音频之后播放"""
+        self.play_until = max(self.play_until, self.clock()) + seconds
+        self.sent_seconds += seconds
+
+    def flush(self):
+        """客户端清空了播放队列"""
+        self.flushed_seconds += self.buffered()
+        self.play_until = 0.0
@@ -0,0 +1,189 @@
+"""按需的采样分析器
+
+worker 变慢时，管理员通过 /admin/profile 对当前进程采样一段时间（最长
+PROFILE_MAX_SECONDS 秒），结果以 collapsed stacks（flamegraph.pl、speedscope 都能读）
+或 speedscope JSON 返回。采样在独立线程中进行，每隔 PROFILE_INTERVAL_MS 毫秒记录：
+
+- wall：所有 asyncio 任务的协程调用链，包括正在 await 的任务，看每个会话的时间花在
+  等哪里。/ws/audio 的处理任务以会话id命名，调用链的根就是会话；GeminiService 的方法、
+  auth、数据库调用按 "函数 (文件:行)" 出现在调用链中
+- cpu：各线程当前正在执行的调用栈，跳过阻塞在 select、锁和队列上的线程
+
+不采样时没有任何钩子或后台线程，对请求没有额外开销。只分析收到请求的这个worker。
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter
+
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))  # 默认采样间隔（毫秒）
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))  # 单次采样的最长时间（秒）
+
+# 线程停在这些位置时视为空闲，不计入 cpu
+_IDLE_FUNCTIONS = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _label(code) -> str:
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _frames(frame) -> list:
+    """线程的调用栈，根在前"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _task_name(task) -> str:
+    name = task.get_name()
+    # 未命名的任务（Task-123）按入口协程归类，避免每个任务单独成根
+    return "task" if name.startswith("Task-") else name
+
+
+def _task_stack(task, running_frames=None) -> tuple:
+    """沿 cr_await 走完协程链，根在前；正在运行的任务接上事件循环线程中的同步调用"""
+    coro = task.get_coro()
+    entry = getattr(coro, "cr_frame", None)
+    if running_frames is not None and entry is not None:
+        for i, frame in enumerate(running_frames):
+            if frame is entry:
+                return (_task_name(task),) + tuple(_label(f.f_code) for f in running_frames[i:])
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        stack.append(_label(frame.f_code))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return (_task_name(task),) + tuple(stack)
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_FUNCTIONS
+
+
+class Profiler:
+    def __init__(self):
+        self.running = False
+        self.runs = 0
+        self.last = None  # 上一次采样的概要
+
+    async def profile(self, seconds: float, interval: float) -> dict:
+        if self.running:
+            raise ProfilerBusy("已有采样正在进行")
+        self.running = True
+        try:
+            result = await asyncio.to_thread(
+                self._sample, asyncio.get_running_loop(), threading.get_ident(), asyncio.current_task(), seconds, interval
+            )
+        finally:
+            self.running = False
+        self.runs += 1
+        self.last = {key: result[key] for key in ("duration", "interval", "samples", "overhead")}
+        return result
+
+    def _sample(self, loop, loop_thread, caller, seconds, interval):
+        wall, cpu = Counter(), Counter()
+        me = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        samples = 0
+        busy = 0.0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while True:
+            tick = time.perf_counter()
+            if tick >= deadline:
+                break
+            threads = sys._current_frames()
+            running = asyncio.current_task(loop)
+            loop_frames = _frames(threads[loop_thread]) if loop_thread in threads else []
+            try:
+                tasks = list(asyncio.all_tasks(loop))
+            except RuntimeError:
+                # 任务集合在遍历时被事件循环修改，跳过这一次
+                tasks = []
+            for task in tasks:
+                if task is not caller:
+                    wall[_task_stack(task, loop_frames if task is running else None)] += 1
+            for ident, frame in threads.items():
+                if ident == me or _is_idle(frame):
+                    continue
+                if ident == loop_thread and running is not None:
+                    # 事件循环线程上的CPU时间记在正在运行的任务名下
+                    cpu[_task_stack(running, loop_frames)] += 1
+                else:
+                    cpu[(names.get(ident, f"thread-{ident}"),) + tuple(_label(f.f_code) for f in _frames(frame))] += 1
+            samples += 1
+            elapsed = time.perf_counter() - tick
+            busy += elapsed
+            time.sleep(max(interval - elapsed, 0))
+        duration = time.perf_counter() - started
+        return {
+            "wall": wall,
+            "cpu": cpu,
+            "samples": samples,
+            "interval": interval,
+            "duration": round(duration, 3),
+            # 采样线程自身占用的时间比例
+            "overhead": round(busy / duration, 4) if duration else 0.0,
+        }
+
+    def metrics(self) -> dict:
+        return {"running": self.running, "runs": self.runs, "last": self.last}
+
+
+def collapsed(stacks: Counter) -> str:
+    """每行 "根;...;叶 样本数"，flamegraph.pl 和 speedscope 都可以直接读取"""
+    return "".join(f"{';'.join(stack)} {n}\n" for stack, n in stacks.most_common())
+
+
+def speedscope(result: dict, name: str = "gemini-teacher") -> dict:
+    """speedscope 文件格式，wall 和 cpu 各一个 profile"""
+    frames, index = [], {}
+    profiles = []
+    for mode in ("wall", "cpu"):
+        samples, weights = [], []
+        for stack, n in result[mode].most_common():
+            ids = []
+            for label in stack:
+                if label not in index:
+                    index[label] = len(frames)
+                    frames.append({"name": label})
+                ids.append(index[label])
+            samples.append(ids)
+            weights.append(round(n * result["interval"], 6))
+        profiles.append({
+            "type": "sampled",
+            "name": f"{name} {mode}",
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 6),
+            "samples": samples,
+            "weights": weights,
+        })
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": profiles,
+        "name": name,
+        "exporter": "gemini-teacher profiler",
+    }
+
+
+profiler = Profiler()
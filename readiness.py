@@ -0,0 +1,84 @@
+"""启动耗时与就绪状态
+
+导入 main.py 时只做轻量的工作，建表检查和等待上游worker启动放到后台的预热任务中，
+服务可以先开始监听。负载均衡器通过 /ready 判断：数据库和上游worker池都准备好之后
+才返回200，学生不会被分配到还没预热好的worker。
+
+各阶段耗时（包括 main.py 的导入耗时）记录在 /metrics 的 startup 中。
+"""
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+READY_CHECKS = ("database", "upstream_pool")
+
+
+class Readiness:
+    def __init__(self, checks=READY_CHECKS):
+        self.checks = {name: False for name in checks}
+        self.phases = {}  # 阶段 -> 耗时（秒）
+        self.error = None
+        self.ready_at = None
+        self._started = time.monotonic()
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return all(self.checks.values())
+
+    def record(self, phase: str, seconds: float):
+        self.phases[phase] = round(seconds, 4)
+        logger.info(f"启动阶段 {phase} 耗时 {seconds * 1000:.0f}ms")
+
+    @contextmanager
+    def phase(self, name: str):
+        """计时一个启动阶段；阶段正常结束且属于就绪检查时标记为完成"""
+        started = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - started)
+        self.mark(name)
+
+    def mark(self, name: str):
+        if name in self.checks and not self.checks[name]:
+            self.checks[name] = True
+            if self.ready:
+                self.ready_at = time.monotonic()
+                logger.info(f"服务已就绪，启动后 {self.ready_at - self._started:.2f}s")
+
+    def start(self, warm_up):
+        """在后台执行预热协程"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(warm_up))
+
+    async def _run(self, warm_up):
+        try:
+            await warm_up
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"预热失败，/ready 将保持未就绪: {str(e)}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "ready": self.ready,
+            "checks": dict(self.checks),
+            "phases": dict(self.phases),
+            "ready_after": round(self.ready_at - self._started, 3) if self.ready_at else None,
+            "error": self.error,
+        }
+
+
+readiness = Readiness()
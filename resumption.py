@@ -0,0 +1,140 @@
+"""断线后的会话恢复
+
+/ws/audio 建立会话时下发一个恢复令牌。客户端异常断开后，会话（GeminiService、准入名额、
+注册表登记以及正在进行的上游对话）会保留 RESUME_GRACE 秒。期间模型继续返回的音频
+写入重放缓冲区。客户端带着令牌和最后收到的序号重连时，直接接回原会话，并从该序号之后
+补发音频。
+
+音频帧的序号是隐式的：服务端发出的第N个二进制帧序号为N，客户端按收到的帧计数，
+并通过 {"type": "ack", "seq": N} 确认，已确认的帧从缓冲区中删除。
+
+恢复只在同一个worker进程内有效；重连到其他worker时按新会话处理。
+"""
+import os
+import time
+import asyncio
+import secrets
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+RESUME_GRACE = float(os.getenv("RESUME_GRACE", "30"))  # 断线后保留会话的时间（秒）
+RESUME_BUFFER_BYTES = int(os.getenv("RESUME_BUFFER_BYTES", str(2 * 1024 * 1024)))  # 每个会话未确认音频的上限
+
+
+class ReplayBuffer:
+    """按序号保存已发送但未确认的音频帧"""
+
+    def __init__(self, max_bytes: int = RESUME_BUFFER_BYTES):
+        self.max_bytes = max_bytes
+        self.chunks = deque()  # (seq, data)
+        self.bytes = 0
+        self.last_seq = 0
+        self.dropped = 0
+
+    def add(self, data) -> int:
+        self.last_seq += 1
+        self.chunks.append((self.last_seq, data))
+        self.bytes += len(data)
+        # 超出上限时丢弃最旧的帧，重连后只能补发缓冲区中剩下的部分
+        while self.bytes > self.max_bytes and len(self.chunks) > 1:
+            _, old = self.chunks.popleft()
+            self.bytes -= len(old)
+            self.dropped += 1
+        return self.last_seq
+
+    def ack(self, seq: int):
+        while self.chunks and self.chunks[0][0] <= seq:
+            _, old = self.chunks.popleft()
+            self.bytes -= len(old)
+
+    def since(self, seq: int) -> list:
+        return [(s, data) for s, data in self.chunks if s > seq]
+
+
+class ResumableSession:
+    def __init__(self, token, user_id, service, on_close):
+        self.token = token
+        self.user_id = user_id
+        self.service = service
+        self.on_close = on_close  # 会话最终结束时调用的协程函数（释放名额、注销登记）
+        self.generation = 0  # 每次被接回时加一，旧连接的处理函数据此放弃清理
+        self.timer = None
+        self.parked_at = None
+
+
+class ResumeManager:
+    """管理可恢复的会话"""
+
+    def __init__(self, grace: float = RESUME_GRACE):
+        self.grace = grace
+        self.sessions = {}
+        self.resumed_total = 0
+        self.expired_total = 0
+
+    def issue(self, user_id, service, on_close) -> ResumableSession:
+        token = secrets.token_urlsafe(24)
+        session = ResumableSession(token, user_id, service, on_close)
+        self.sessions[token] = session
+        return session
+
+    def resume(self, token, user_id):
+        """接回会话；令牌无效、已过期或不属于该用户时返回None"""
+        session = self.sessions.get(token)
+        if session is None or session.user_id != user_id:
+            return None
+        if session.timer is not None:
+            session.timer.cancel()
+            session.timer = None
+        if session.parked_at is not None:
+            logger.info(f"会话 {session.token[:8]} 断线 {time.monotonic() - session.parked_at:.1f}s 后恢复")
+        session.parked_at = None
+        session.generation += 1
+        self.resumed_total += 1
+        return session
+
+    def park(self, session: ResumableSession, generation: int):
+        """连接断开后保留会话；会话已被新连接接回时什么也不做"""
+        if session.generation != generation or self.sessions.get(session.token) is not session:
+            return
+        session.parked_at = time.monotonic()
+        session.timer = asyncio.get_running_loop().call_later(
+            self.grace, lambda: asyncio.create_task(self._expire(session))
+        )
+
+    async def _expire(self, session: ResumableSession):
+        if session.parked_at is None:
+            return
+        self.expired_total += 1
+        await self.close(session)
+
+    async def close(self, session: ResumableSession, generation: int = None):
+        """结束会话并释放资源（传入generation时，会话已被接回则跳过）"""
+        if generation is not None and session.generation != generation:
+            return
+        if self.sessions.pop(session.token, None) is None:
+            return
+        if session.timer is not None:
+            session.timer.cancel()
+            session.timer = None
+        try:
+            await session.on_close()
+        except Exception as e:
+            logger.error(f"关闭会话时出错: {str(e)}")
+
+    async def stop(self):
+        for session in list(self.sessions.values()):
+            await self.close(session)
+
+    def metrics(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "parked": sum(1 for s in self.sessions.values() if s.parked_at is not None),
+            "buffered_bytes": sum(s.service.replay.bytes for s in self.sessions.values()),
+            "resumed_total": self.resumed_total,
+            "expired_total": self.expired_total,
+        }
+
+
+resume_manager = ResumeManager()
@@ -0,0 +1,109 @@
+"""多worker启动入口
+
+用法:
+    python serve.py --workers 4 --host 0.0.0.0 --port 8081
+
+支持 SO_REUSEPORT 的系统上，每个worker各自绑定同一端口，由内核分发连接；
+否则退回到 uvicorn 自带的多进程模式（共享同一个监听socket）。
+父进程负责监督，worker意外退出时自动重启。
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import logging
+import multiprocessing
+
+import uvicorn
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("serve")
+
+RESTART_BACKOFF = 1.0  # worker异常退出后重启前的等待时间（秒）
+
+
+def _bind_reuseport(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app: str, host: str, port: int, log_level: str):
+    """worker进程：自己绑定SO_REUSEPORT socket并运行uvicorn"""
+    sock = _bind_reuseport(host, port)
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def _supervise(args):
+    ctx = multiprocessing.get_context("spawn")
+    workers = {}
+    stopping = False
+
+    def spawn(index):
+        process = ctx.Process(
+            target=_run_worker,
+            args=(args.app, args.host, args.port, args.log_level),
+            name=f"gemini-teacher-{index}",
+        )
+        process.start()
+        workers[index] = process
+        logger.info(f"worker {index} 已启动，pid={process.pid}")
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        logger.info("正在停止所有worker...")
+        for process in workers.values():
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for index in range(args.workers):
+        spawn(index)
+
+    while not stopping:
+        time.sleep(0.5)
+        for index, process in list(workers.items()):
+            if not process.is_alive() and not stopping:
+                logger.warning(f"worker {index} (pid={process.pid}) 已退出，退出码 {process.exitcode}，准备重启")
+                time.sleep(RESTART_BACKOFF)
+                spawn(index)
+
+    for process in workers.values():
+        process.join(10)
+        if process.is_alive():
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以多个worker进程启动 Gemini 英语学习助手")
+    parser.add_argument("--app", default="main:app")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8081")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if hasattr(socket, "SO_REUSEPORT"):
+        logger.info(f"使用 SO_REUSEPORT 启动 {args.workers} 个worker，监听 {args.host}:{args.port}")
+        _supervise(args)
+    else:
+        logger.info(f"当前系统不支持 SO_REUSEPORT，使用 uvicorn 多进程模式启动 {args.workers} 个worker")
+        uvicorn.run(args.app, host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
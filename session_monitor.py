@@ -0,0 +1,168 @@
+"""连接心跳、空闲回收和会话内存统计
+
+以前只有 receive() 抛出异常时才会发现客户端已经断开，在此之前会话的 GeminiService、
+缓冲区和上游连接一直占用着。这里定期向每个连接发送应用层 ping：
+
+- 超过 HEARTBEAT_TIMEOUT 没有收到客户端的任何消息，视为断线，取消该连接的处理任务
+  （/ws/audio 的会话随后进入断线保留状态，超时后释放）
+- 超过 SESSION_IDLE_TIMEOUT 没有语音输入，视为空闲，直接结束会话
+- 所有会话缓冲的字节数超过 SESSION_MEMORY_LIMIT 时，结束占用最多的会话
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+
+from resumption import resume_manager
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "15"))  # 发送ping的间隔（秒）
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "45"))  # 多久收不到消息视为断线（秒）
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "600"))  # 多久没有语音输入视为空闲（秒）
+SESSION_MEMORY_LIMIT = int(os.getenv("SESSION_MEMORY_LIMIT", str(256 * 1024 * 1024)))  # 本worker所有会话缓冲的上限
+REAPER_INTERVAL = 5.0  # 检查间隔（秒）
+
+# 这些原因被回收的会话直接结束，不再等待客户端重连
+FINAL_REASONS = ("idle", "memory")
+
+
+class Tracker:
+    """一个WebSocket连接的活动状态"""
+
+    def __init__(self, websocket, endpoint, service=None):
+        self.websocket = websocket
+        self.endpoint = endpoint
+        self.service = service
+        self.task = asyncio.current_task()
+        now = time.monotonic()
+        self.last_seen = now  # 最近一次收到客户端的任何消息
+        self.last_active = now  # 最近一次收到语音/对话输入
+        self.last_ping = now
+        self.reason = None  # 被回收的原因
+
+    def seen(self):
+        self.last_seen = time.monotonic()
+
+    def active(self):
+        self.last_seen = self.last_active = time.monotonic()
+
+    @property
+    def final(self) -> bool:
+        return self.reason in FINAL_REASONS
+
+
+def memory_usage(service) -> int:
+    return service.memory_usage()["total"] if service is not None else 0
+
+
+class SessionMonitor:
+    def __init__(self):
+        self.trackers = set()
+        self.reaped = Counter()
+        self.pings_sent = 0
+        self._task = None
+
+    def track(self, websocket, endpoint, service=None) -> Tracker:
+        tracker = Tracker(websocket, endpoint, service)
+        self.trackers.add(tracker)
+        return tracker
+
+    def untrack(self, tracker: Tracker):
+        self.trackers.discard(tracker)
+
+    def reap(self, tracker: Tracker, reason: str):
+        if tracker.reason is not None:
+            return
+        logger.warning(f"回收 {tracker.endpoint} 连接: {reason}")
+        tracker.reason = reason
+        self.reaped[reason] += 1
+        tracker.task.cancel()
+
+    async def _ping(self, tracker: Tracker):
+        try:
+            await tracker.websocket.send_json({"type": "ping", "ts": time.time()})
+        except Exception:
+            pass
+
+    def check(self):
+        now = time.monotonic()
+        for tracker in list(self.trackers):
+            if tracker.reason is not None:
+                continue
+            if now - tracker.last_seen > HEARTBEAT_TIMEOUT:
+                self.reap(tracker, "heartbeat_timeout")
+            elif now - tracker.last_active > SESSION_IDLE_TIMEOUT:
+                self.reap(tracker, "idle")
+            elif now - tracker.last_ping >= HEARTBEAT_INTERVAL:
+                tracker.last_ping = now
+                self.pings_sent += 1
+                asyncio.create_task(self._ping(tracker))
+
+    def _sessions(self):
+        """所有持有缓冲的会话：(占用字节, 连接的tracker或None, 可恢复会话或None)"""
+        attached = {}
+        for tracker in self.trackers:
+            if tracker.service is not None and tracker.reason is None:
+                attached[id(tracker.service)] = tracker
+        result = []
+        for session in resume_manager.sessions.values():
+            result.append((memory_usage(session.service), attached.pop(id(session.service), None), session))
+        for tracker in attached.values():
+            result.append((memory_usage(tracker.service), tracker, None))
+        return result
+
+    async def enforce_memory_limit(self):
+        """总缓冲超过上限时，依次结束占用最多的会话"""
+        sessions = self._sessions()
+        total = sum(size for size, _, _ in sessions)
+        sessions.sort(key=lambda item: item[0], reverse=True)
+        for size, tracker, session in sessions:
+            if total <= SESSION_MEMORY_LIMIT or size == 0:
+                break
+            total -= size
+            if tracker is not None:
+                self.reap(tracker, "memory")
+            else:
+                # 断线保留中的会话没有处理任务，直接关闭
+                logger.warning(f"释放断线保留的会话: memory（{size} bytes）")
+                self.reaped["memory"] += 1
+                await resume_manager.close(session)
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(REAPER_INTERVAL)
+            try:
+                self.check()
+                await self.enforce_memory_limit()
+            except Exception as e:
+                logger.error(f"会话回收检查出错: {str(e)}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        sessions = self._sessions()
+        largest = max(sessions, key=lambda item: item[0], default=None)
+        return {
+            "connections": len(self.trackers),
+            "buffered_bytes": sum(size for size, _, _ in sessions),
+            "buffered_bytes_max": largest[0] if largest else 0,
+            "memory_limit": SESSION_MEMORY_LIMIT,
+            "pings_sent": self.pings_sent,
+            "reaped_total": dict(self.reaped),
+        }
+
+
+session_monitor = SessionMonitor()
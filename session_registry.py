@@ -0,0 +1,152 @@
+"""跨进程共享的会话注册表
+
+多个uvicorn worker共用一个本地SQLite文件（WAL模式），用于管理员查看全部会话，
+以及跨worker的单用户并发限制。worker崩溃后，其会话因心跳过期被清理。
+"""
+import os
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+SESSION_REGISTRY_PATH = os.getenv("SESSION_REGISTRY_PATH", "./sessions.db")
+REGISTRY_HEARTBEAT_INTERVAL = float(os.getenv("REGISTRY_HEARTBEAT_INTERVAL", "10"))  # 心跳间隔（秒）
+REGISTRY_STALE_AFTER = REGISTRY_HEARTBEAT_INTERVAL * 3  # 超过该时间没有心跳的会话视为失效
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    endpoint TEXT,
+    worker_pid INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_sessions_user_id ON sessions (user_id);
+CREATE INDEX IF NOT EXISTS ix_sessions_worker_pid ON sessions (worker_pid);
+"""
+
+
+class SessionLimitExceeded(Exception):
+    """用户在所有worker上的会话数已达上限"""
+
+
+class SessionRegistry:
+    """基于SQLite的会话注册表，阻塞调用都放到线程池中执行"""
+
+    def __init__(self, path: str = SESSION_REGISTRY_PATH):
+        self.path = path
+        self.pid = os.getpid()
+        self._heartbeat_task = None
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _register(self, session_id, user_id, username, endpoint, max_per_user):
+        now = time.time()
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE 取得写锁，保证计数与插入是原子的
+            conn.execute("BEGIN IMMEDIATE")
+            if max_per_user is not None:
+                (count,) = conn.execute(
+                    "SELECT COUNT(*) FROM sessions WHERE user_id = ? AND heartbeat_at >= ?",
+                    (user_id, now - REGISTRY_STALE_AFTER),
+                ).fetchone()
+                if count >= max_per_user:
+                    conn.execute("ROLLBACK")
+                    raise SessionLimitExceeded(f"用户 {username} 的会话数已达上限 {max_per_user}")
+            conn.execute(
+                "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, user_id, username, endpoint, self.pid, now, now),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    async def register(self, user_id, username, endpoint, max_per_user=None) -> str:
+        """登记一个会话并返回会话ID；超过单用户上限时抛出 SessionLimitExceeded"""
+        session_id = str(uuid.uuid4())
+        await asyncio.to_thread(
+            self._register, session_id, user_id, username, endpoint, max_per_user
+        )
+        return session_id
+
+    def _execute(self, sql, params=()):
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    async def unregister(self, session_id):
+        await asyncio.to_thread(self._execute, "DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    async def count_for_user(self, user_id) -> int:
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT COUNT(*) FROM sessions WHERE user_id = ? AND heartbeat_at >= ?",
+            (user_id, time.time() - REGISTRY_STALE_AFTER),
+        )
+        return rows[0][0]
+
+    async def list_sessions(self) -> list:
+        rows = await asyncio.to_thread(
+            self._execute,
+            "SELECT session_id, user_id, username, endpoint, worker_pid, started_at, heartbeat_at "
+            "FROM sessions ORDER BY started_at",
+        )
+        columns = ("session_id", "user_id", "username", "endpoint", "worker_pid", "started_at", "heartbeat_at")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _heartbeat(self):
+        now = time.time()
+        self._execute("UPDATE sessions SET heartbeat_at = ? WHERE worker_pid = ?", (now, self.pid))
+        self._execute("DELETE FROM sessions WHERE heartbeat_at < ?", (now - REGISTRY_STALE_AFTER,))
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._heartbeat)
+            except sqlite3.Error as e:
+                logger.error(f"会话注册表心跳失败: {str(e)}")
+            await asyncio.sleep(REGISTRY_HEARTBEAT_INTERVAL)
+
+    def start(self):
+        """启动心跳（同时清理已失效worker留下的会话）"""
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+        # 正常退出时移除本worker的会话
+        await asyncio.to_thread(self._execute, "DELETE FROM sessions WHERE worker_pid = ?", (self.pid,))
+
+
+_registry = None
+
+
+def get_session_registry() -> SessionRegistry:
+    """返回当前worker进程的注册表实例"""
+    global _registry
+    if _registry is None or _registry.pid != os.getpid():
+        _registry = SessionRegistry()
+    return _registry
@@ -14,7 +14,6 @@
 # limitations under the License.
 
 import asyncio
-import base64
 import json
 import io
 import os
@@ -25,6 +24,7 @@ from websockets.asyncio.client import connect
 from websockets.asyncio.connection import Connection
 from rich.console import Console
 from rich.markdown import Markdown
+from gemini_protocol import pcm_volume, realtime_input_message
 
 if sys.version_info < (3, 11, 0):
     import taskgroup, exceptiongroup
@@ -124,13 +124,8 @@ class AudioLoop:
 
         while True:
             data = await asyncio.to_thread(stream.read, CHUNK_SIZE)
-            # 计算音量 - 使用简单的字节平均值
-            # 每个采样是2字节（16位），所以每次取2个字节转换为整数
-            audio_data = []
-            for i in range(0, len(data), 2):
-                sample = int.from_bytes(data[i:i+2], byteorder='little', signed=True)
-                audio_data.append(abs(sample))
-            volume = sum(audio_data) / len(audio_data)
+            # 计算音量 - 16位采样的平均幅度
+            volume = pcm_volume(data)
             if volume > 200:  # 阈值可以根据需要调整
                 if self.running_step == 0:
                     console.print("🎤 :",style="yellow",end="")
@@ -141,15 +136,7 @@ class AudioLoop:
     async def send_audio(self):
         while True:
             chunk = await self.audio_out_queue.get()
-            msg = {
-                "realtime_input": {
-                    "media_chunks": [
-                        {"data": base64.b64encode(chunk).decode(), "mime_type": "audio/pcm"}
-                    ]
-                }
-            }
-            msg = json.dumps(msg)
-            await self.ws.send(msg)
+            await self.ws.send(realtime_input_message(chunk))
 
     async def receive_audio(self):
         console = Console()
@@ -1,54 +1,51 @@
 class AudioProcessor extends AudioWorkletProcessor {
     constructor() {
         super();
-        this.bufferSize = 1024;
-        this.buffer = new Float32Array(this.bufferSize);
+        // 帧长由服务端根据链路情况下发，主线程通过 config 消息设置
+        this.frameSamples = Math.round(sampleRate * 0.06);
+        this.buffer = new Float32Array(this.frameSamples);
         this.bufferIndex = 0;
-        this.lastProcessTime = 0;
+        this.volumeSum = 0;
+        this.port.onmessage = (event) => {
+            if (event.data.type === 'config' && event.data.frameSamples > 0) {
+                this.flush();
+                this.frameSamples = event.data.frameSamples;
+                this.buffer = new Float32Array(this.frameSamples);
+            }
+        };
         console.log('音频处理器初始化完成');
     }
-    
+
+    flush() {
+        if (this.bufferIndex === 0) {
+            return;
+        }
+        const frame = this.buffer.slice(0, this.bufferIndex);
+        this.port.postMessage({
+            type: 'audio',
+            buffer: frame.buffer,
+            volume: this.volumeSum / this.bufferIndex
+        }, [frame.buffer]);
+        this.bufferIndex = 0;
+        this.volumeSum = 0;
+    }
+
     process(inputs, outputs, parameters) {
         const input = inputs[0];
         if (!input || !input[0]) {
-            console.log('没有输入数据');
             return true;
         }
-        
-        const currentTime = (currentFrame / sampleRate) * 1000;
-        
-        if (currentTime - this.lastProcessTime < 100) {
-            return true;
-        }
-        
-        this.lastProcessTime = currentTime;
-        
+
         const samples = input[0];
-        
-        const volume = samples.reduce((sum, sample) => sum + Math.abs(sample), 0) / samples.length;
-        
         for (let i = 0; i < samples.length; i++) {
             this.buffer[this.bufferIndex++] = samples[i];
-            
-            if (this.bufferIndex >= this.bufferSize) {
-                console.log('音频数据统计:', {
-                    时间戳: currentTime,
-                    平均音量: volume,
-                    样本数: this.bufferSize,
-                    高于阈值: volume > 0.01
-                });
-                
-                this.port.postMessage({
-                    type: 'audio',
-                    buffer: this.buffer.slice().buffer,
-                    volume: volume
-                }, [this.buffer.slice().buffer]);
-                
-                this.buffer = new Float32Array(this.bufferSize);
-                this.bufferIndex = 0;
+            this.volumeSum += Math.abs(samples[i]);
+
+            if (this.bufferIndex >= this.frameSamples) {
+                this.flush();
             }
         }
-        
+
         return true;
     }
 }
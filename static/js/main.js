@@ -5,12 +5,15 @@ class VoiceChat {
             isGeminiSpeaking: false,
             audioContext: null,
             audioWorklet: null,
-            audioQueue: [], // 存储音频数据
             silenceTimer: null, // 用于检测停顿
             lastAudioTime: 0, // 上次接收到音频的时间
             websocket: null, // WebSocket连接
             hasSoundDetected: false, // 是否检测到声音
-            reconnectAttempts: 0 // 重连次数
+            reconnectAttempts: 0, // 重连次数
+            resumeToken: null, // 会话恢复令牌
+            receivedSeq: 0, // 已收到的音频帧数（即最后一帧的序号）
+            frameMs: 60, // 上行帧长（毫秒），由服务端根据链路情况调整
+            downlinkRate: 24000 // 回复音频的采样率，接收过慢时服务端会降到12kHz
         };
         
         this.config = {
@@ -128,8 +131,12 @@ class VoiceChat {
 
     async startListening() {
         if (this.state.isGeminiSpeaking) {
-            console.log('请等待Gemini回复完成');
-            return;
+            // 打断：本地立即停止，服务端丢弃还没发出的部分
+            console.log('打断Gemini的回复');
+            this.stopPlayback();
+            if (this.state.websocket?.readyState === WebSocket.OPEN) {
+                this.state.websocket.send(JSON.stringify({ type: 'stop_playback' }));
+            }
         }
 
         try {
@@ -151,14 +158,14 @@ class VoiceChat {
             
             // 创建音频处理节点
             console.log('加载音频处理器...');
-            await this.state.audioContext.audioWorklet.addModule('/static/js/audio-processor.js');
+            await this.state.audioContext.audioWorklet.addModule((window.assetUrls || {})['js/audio-processor.js'] || '/static/js/audio-processor.js');
             this.state.audioWorklet = new AudioWorkletNode(this.state.audioContext, 'audio-processor');
+            this.configureFrameSize();
             console.log('音频处理器加载成功');
             
             // 处理音频数据
             this.state.audioWorklet.port.onmessage = (event) => {
                 if (event.data.type === 'audio') {
-                    console.log('收到音频处理器数据，大小:', event.data.buffer.byteLength, '音量:', event.data.volume);
                     this.handleAudioData(event.data.buffer, event.data.volume);
                 }
             };
@@ -197,7 +204,8 @@ class VoiceChat {
                 this.state.audioContext = null;
             }
             
-            // 发送停止命令
+            // 结束正在说的一句，再发送停止命令
+            await this.handleSilence();
             if (this.state.websocket?.readyState === WebSocket.OPEN) {
                 this.state.websocket.send(JSON.stringify({ type: 'stop' }));
             }
@@ -210,50 +218,42 @@ class VoiceChat {
         }
     }
 
+    // 按当前帧长设置音频处理器的分帧大小
+    configureFrameSize() {
+        if (!this.state.audioWorklet || !this.state.audioContext) return;
+        const frameSamples = Math.round(this.state.audioContext.sampleRate * this.state.frameMs / 1000);
+        this.state.audioWorklet.port.postMessage({ type: 'config', frameSamples });
+    }
+
     handleAudioData(buffer, volume) {
         if (this.state.isGeminiSpeaking) return;
         
-        console.log('处理音频数据，音量:', volume);
-        
         if (volume > 0.01) {  // 使用与 cankao.py 相同的阈值
-            console.log('检测到声音，添加到队列，音量:', volume);
             this.state.hasSoundDetected = true;
             this.state.lastAudioTime = Date.now();
-            
-            // 确保 buffer 是 ArrayBuffer
-            if (buffer instanceof ArrayBuffer) {
-                this.state.audioQueue.push(buffer);
-            } else {
-                console.error('收到非 ArrayBuffer 类型的数据:', typeof buffer);
-                return;
-            }
+            // 边说边上传，服务端在收到 utterance_end 后把整句交给模型
+            this.sendAudioFrame(buffer);
             
             if (this.state.silenceTimer) {
                 clearTimeout(this.state.silenceTimer);
             }
             this.state.silenceTimer = setTimeout(() => this.handleSilence(), 3000); // 3秒静音
-        } else {
-            console.log('音量低于阈值:', volume);
         }
     }
 
     async handleSilence() {
-        if (this.state.audioQueue.length > 0 && this.state.hasSoundDetected) {
-            console.log('检测到停顿，发送累积的音频数据，队列长度:', this.state.audioQueue.length);
-            // 将累积的音频发送给服务器
-            const audioData = this.concatenateAudioBuffers(this.state.audioQueue);
-            console.log('累积的音频数据大小:', audioData.byteLength);
-            await this.sendAudioToServer(audioData);
+        if (this.state.hasSoundDetected) {
+            console.log('检测到停顿，结束本句');
+            if (this.state.websocket?.readyState === WebSocket.OPEN) {
+                this.state.websocket.send(JSON.stringify({ type: 'utterance_end' }));
+            }
             
             // 重置状态
-            this.state.audioQueue = [];
             this.state.hasSoundDetected = false;
             if (this.state.silenceTimer) {
                 clearTimeout(this.state.silenceTimer);
                 this.state.silenceTimer = null;
             }
-        } else {
-            console.log('没有有效的音频数据需要发送，队列长度:', this.state.audioQueue.length);
         }
     }
 
@@ -311,7 +311,11 @@ class VoiceChat {
                 throw new Error('No authentication token found');
             }
 
-            const wsUrl = `${config.endpoints.ws}/ws/audio?token=${tokenData.token}`;
+            let wsUrl = `${config.endpoints.ws}/ws/audio?token=${tokenData.token}&stream=1`;
+            if (this.state.resumeToken) {
+                // 断线重连时带上恢复令牌，服务端从最后收到的帧之后补发
+                wsUrl += `&resume=${this.state.resumeToken}&last_seq=${this.state.receivedSeq}`;
+            }
             console.log('正在连接WebSocket...', wsUrl);
             
             // 关闭现有连接
@@ -354,11 +358,59 @@ class VoiceChat {
                 try {
                     if (event.data instanceof Blob) {
                         // 处理音频响应
+                        this.state.receivedSeq++;
+                        if (this.state.receivedSeq % 8 === 0) {
+                            this.state.websocket.send(JSON.stringify({ type: 'ack', seq: this.state.receivedSeq }));
+                        }
+                        // 在等待读取之前记下采样率，之后到达的 audio_format 只影响后面的帧
+                        const sampleRate = this.state.downlinkRate;
                         const audioData = await event.data.arrayBuffer();
-                        await this.handleGeminiResponse(audioData);
+                        await this.handleGeminiResponse(audioData, sampleRate);
                     } else {
                         // 处理文本响应
                         const response = JSON.parse(event.data);
+                        if (response.type === 'queue') {
+                            // 服务繁忙时显示排队位置
+                            const statusText = document.getElementById('statusText');
+                            if (statusText) {
+                                statusText.textContent = `排队中，前方还有 ${response.position - 1} 人...`;
+                            }
+                        } else if (response.type === 'admitted') {
+                            this.state.resumeToken = response.resume_token;
+                            this.state.receivedSeq = 0;
+                            this.updateUI('ready');
+                        } else if (response.type === 'resumed') {
+                            console.log(`会话已恢复，补发 ${response.replayed} 段音频`);
+                            this.updateUI('ready');
+                        } else if (response.type === 'fluency') {
+                            this.showFluencyCard(response);
+                        } else if (response.type === 'ping') {
+                            // 附带发送队列长度，服务端据此判断上行是否跟得上
+                            this.state.websocket.send(JSON.stringify({
+                                type: 'pong',
+                                ts: response.ts,
+                                buffered: this.state.websocket.bufferedAmount
+                            }));
+                        } else if (response.type === 'flush') {
+                            this.stopPlayback();
+                        } else if (response.type === 'audio_format') {
+                            // 与音频帧按顺序到达，之后的帧使用新的采样率
+                            this.state.downlinkRate = response.sample_rate;
+                        } else if (response.type === 'uplink') {
+                            this.state.frameMs = response.frame_ms;
+                            this.configureFrameSize();
+                        } else if (response.type === 'usage') {
+                            console.log(`今天还可以练习 ${Math.round(response.remaining_seconds)} 秒`);
+                        } else if (response.type === 'quota_exceeded') {
+                            // 服务端随后以1000关闭连接，不会自动重连
+                            await this.stopListening();
+                            const statusText = document.getElementById('statusText');
+                            if (statusText) {
+                                statusText.textContent = response.error;
+                            }
+                        } else if (response.type === 'error') {
+                            console.error('服务器错误:', response.error);
+                        }
                         if (response.text) {
                             console.log('Gemini:', response.text);
                         }
@@ -435,112 +487,97 @@ class VoiceChat {
         return Math.sqrt(sum / samples.length);
     }
 
-    concatenateAudioBuffers(buffers) {
-        try {
-            console.log('开始合并音频缓冲区，队列长度:', buffers.length);
-            
-            // 首先计算总长度
-            let totalLength = 0;
-            for (const buffer of buffers) {
-                // 确保每个buffer都是ArrayBuffer
-                const view = new Float32Array(buffer);
-                totalLength += view.length;
-                console.log('缓冲区大小:', view.length);
-            }
-            
-            console.log('合并后的总长度:', totalLength);
-            const result = new Float32Array(totalLength);
-            let offset = 0;
-            
-            // 合并所有缓冲区
-            for (const buffer of buffers) {
-                const view = new Float32Array(buffer);
-                result.set(view, offset);
-                offset += view.length;
-                console.log('当前偏移量:', offset);
-            }
-            
-            console.log('音频数据合并完成，最终大小:', result.length);
-            return result.buffer;
-        } catch (error) {
-            console.error('合并音频缓冲区时出错:', error);
-            console.error('错误详情:', {
-                缓冲区数量: buffers.length,
-                缓冲区类型: buffers.map(b => Object.prototype.toString.call(b)),
-                第一个缓冲区示例: buffers[0] ? new Float32Array(buffers[0]).slice(0, 5) : null
-            });
-            throw error;
+    // 把一帧 Float32 音频转成16位PCM并立即发送
+    sendAudioFrame(buffer) {
+        const websocket = this.state.websocket;
+        if (!websocket || websocket.readyState !== WebSocket.OPEN) return;
+        const samples = new Float32Array(buffer);
+        const pcmData = new Int16Array(samples.length);
+        for (let i = 0; i < samples.length; i++) {
+            const s = Math.max(-1, Math.min(1, samples[i]));
+            pcmData[i] = s < 0 ? s * 0x8000 : s * 0x7FFF;
         }
+        websocket.send(pcmData.buffer);
     }
 
-    async sendAudioToServer(audioData) {
-        if (!this.state.websocket || this.state.websocket.readyState !== WebSocket.OPEN) {
-            console.error('WebSocket未连接');
-            return;
-        }
-        
-        try {
-            // 创建 Float32Array 视图来获取正确的长度
-            const audioView = new Float32Array(audioData);
-            console.log('原始音频��据大小:', audioView.length);
-            
-            // 将 Float32Array 转换为 16位 PCM
-            const pcmData = new Int16Array(audioView.length);
-            for (let i = 0; i < audioView.length; i++) {
-                const s = Math.max(-1, Math.min(1, audioView[i]));
-                pcmData[i] = s < 0 ? s * 0x8000 : s * 0x7FFF;
-            }
-            
-            if (pcmData.length > 0) {
-                console.log('发送音频数据，PCM大小:', pcmData.length, '字节');
-                // 发送前检查数据
-                const maxValue = Math.max(...Array.from(pcmData).map(Math.abs));
-                console.log('PCM数据最大值:', maxValue);
-                
-                this.state.websocket.send(pcmData.buffer);
-            } else {
-                console.log('音频数据为空，不发送');
-            }
-        } catch (error) {
-            console.error('发送音频数据时出错:', error);
-            console.error('错误详情:', {
-                数据类型: audioData.constructor.name,
-                是否为ArrayBuffer: audioData instanceof ArrayBuffer,
-                原始大小: audioData.byteLength
-            });
-        }
+    // 显示本地计算的流利度卡片（模型的详细纠正随后到达）
+    showFluencyCard(card) {
+        const container = document.getElementById('messageContainer');
+        if (!container || !card.speech_seconds) return;
+        const hintText = {
+            long_pause: '停顿较长',
+            slow: '语速偏慢',
+            fast: '语速偏快',
+            monotone: '语调较平'
+        };
+        const hints = (card.hints || []).map(h => hintText[h] || h).join('，');
+        const div = document.createElement('div');
+        div.className = 'fluency-card text-sm text-gray-600 bg-gray-50 rounded-md p-2';
+        div.textContent = `语速 ${card.speaking_rate} 音节/秒 · 停顿 ${card.pauses.count} 次` +
+            ` · 音高范围 ${card.pitch.range_semitones} 半音` + (hints ? ` · ${hints}` : '');
+        container.appendChild(div);
+        container.scrollTop = container.scrollHeight;
     }
 
-    async handleGeminiResponse(audioData) {
+    async handleGeminiResponse(audioData, sampleRate = 24000) {
         if (!audioData) {
             console.error('收到空的音频响应');
             return;
         }
         
         try {
+            // 服务端按播放速度发送，各帧在同一个上下文中首尾相接地排队播放
+            if (!this.state.playbackContext) {
+                this.state.playbackContext = new (window.AudioContext || window.webkitAudioContext)();
+                this.state.playbackTime = 0;
+                this.state.playbackSources = new Set();
+            }
+            const audioContext = this.state.playbackContext;
             this.state.isGeminiSpeaking = true;
-            console.log('开始播放Gemini响应');
-            
-            const audioContext = new (window.AudioContext || window.webkitAudioContext)();
-            const audioBuffer = await audioContext.decodeAudioData(audioData);
+
+            // 回复是16位单声道PCM
+            const pcm = new Int16Array(audioData);
+            const audioBuffer = audioContext.createBuffer(1, pcm.length, sampleRate);
+            const channel = audioBuffer.getChannelData(0);
+            for (let i = 0; i < pcm.length; i++) {
+                channel[i] = pcm[i] / 0x8000;
+            }
             
             const source = audioContext.createBufferSource();
             source.buffer = audioBuffer;
             source.connect(audioContext.destination);
+            this.state.playbackSources.add(source);
             
             source.onended = () => {
-                console.log('Gemini响应播放完成');
-                this.state.isGeminiSpeaking = false;
-                audioContext.close();
+                this.state.playbackSources.delete(source);
+                if (this.state.playbackSources.size === 0) {
+                    console.log('Gemini响应播放完成');
+                    this.state.isGeminiSpeaking = false;
+                }
             };
             
-            await source.start();
+            const startAt = Math.max(audioContext.currentTime, this.state.playbackTime);
+            source.start(startAt);
+            this.state.playbackTime = startAt + audioBuffer.duration;
             
         } catch (error) {
             console.error('播放音频响应失败:', error);
             this.state.isGeminiSpeaking = false;
         }
     }
+
+    // 立即停止播放并清空已排队的回复音频
+    stopPlayback() {
+        for (const source of this.state.playbackSources || []) {
+            source.onended = null;
+            source.stop();
+        }
+        if (this.state.playbackSources) {
+            this.state.playbackSources.clear();
+        }
+        this.state.playbackTime = 0;
+        this.state.isGeminiSpeaking = false;
+    }
 }
 
 // 初始化
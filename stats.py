@@ -0,0 +1,181 @@
+"""学生练习统计的增量维护
+
+UserLog 提交成功后，会话事件把新日志累加到内存中的当日增量里；后台任务定期把增量
+以 upsert 的方式合并进 user_daily_stats。统计接口只读汇总表，不扫描 user_logs。
+"""
+import os
+import re
+import asyncio
+import logging
+from datetime import datetime, date
+
+from sqlalchemy import event, select, func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import sqlite, postgresql
+
+from models import UserLog, UserDailyStats
+
+logger = logging.getLogger(__name__)
+
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "5"))  # 增量写入汇总表的间隔（秒）
+PCM_BYTES_PER_SECOND = 16000 * 2  # 16kHz、16位单声道
+
+# audio_input 日志的内容格式，统计时从中解析音频字节数
+AUDIO_INPUT_CONTENT = "Audio input received: {} bytes"
+_AUDIO_INPUT_RE = re.compile(r"Audio input received: (\d+) bytes")
+
+_COUNTERS = ("audio_inputs", "audio_input_bytes", "turns", "response_time_total_ms", "response_time_count")
+
+
+def audio_input_content(size: int) -> str:
+    return AUDIO_INPUT_CONTENT.format(size)
+
+
+class StatsAggregator:
+    """按 (user_id, day) 累加日志增量，并定期合并进汇总表"""
+
+    def __init__(self):
+        self.pending = {}
+        self._flush_task = None
+        self.session_factory = None
+
+    def record(self, log: UserLog):
+        if log.user_id is None or log.action not in ("audio_input", "gemini_response"):
+            return
+        day = (log.created_at or datetime.utcnow()).date()
+        delta = self.pending.setdefault((log.user_id, day), dict.fromkeys(_COUNTERS, 0))
+        if log.action == "audio_input":
+            delta["audio_inputs"] += 1
+            match = _AUDIO_INPUT_RE.match(log.content or "")
+            if match:
+                delta["audio_input_bytes"] += int(match.group(1))
+        else:
+            delta["turns"] += 1
+            if log.processing_time is not None:
+                delta["response_time_total_ms"] += log.processing_time
+                delta["response_time_count"] += 1
+
+    def _upsert(self, dialect_name, rows):
+        insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+        statement = insert(UserDailyStats).values(rows)
+        table = UserDailyStats.__table__
+        return statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day],
+            set_={
+                **{name: table.c[name] + statement.excluded[name] for name in _COUNTERS},
+                "updated_at": statement.excluded.updated_at,
+            },
+        )
+
+    async def flush(self):
+        """把累计的增量合并进汇总表"""
+        if not self.pending or self.session_factory is None:
+            return
+        pending, self.pending = self.pending, {}
+        now = datetime.utcnow()
+        rows = [
+            {"user_id": user_id, "day": day, "updated_at": now, **delta}
+            for (user_id, day), delta in pending.items()
+        ]
+        try:
+            async with self.session_factory() as db:
+                await db.execute(self._upsert(db.bind.dialect.name, rows))
+                await db.commit()
+        except Exception as e:
+            logger.error(f"写入练习统计失败: {str(e)}")
+            # 放回待写入的增量，下次重试
+            for key, delta in pending.items():
+                current = self.pending.setdefault(key, dict.fromkeys(_COUNTERS, 0))
+                for name in _COUNTERS:
+                    current[name] += delta[name]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            await self.flush()
+
+    def start(self, session_factory):
+        self.session_factory = session_factory
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+
+stats_aggregator = StatsAggregator()
+
+
+# 只在事务提交后计入统计，回滚的日志不计
+@event.listens_for(Session, "after_flush")
+def _collect_new_logs(session, flush_context):
+    logs = [obj for obj in session.new if isinstance(obj, UserLog)]
+    if logs:
+        session.info.setdefault("pending_user_logs", []).extend(logs)
+
+
+@event.listens_for(Session, "after_commit")
+def _record_committed_logs(session):
+    for log in session.info.pop("pending_user_logs", []):
+        stats_aggregator.record(log)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back_logs(session):
+    session.info.pop("pending_user_logs", None)
+
+
+def summarize(rows) -> dict:
+    """把若干天的汇总行整理成接口返回的统计"""
+    days = []
+    totals = dict.fromkeys(_COUNTERS, 0)
+    for row in rows:
+        for name in _COUNTERS:
+            totals[name] += getattr(row, name)
+        days.append({
+            "day": row.day.isoformat(),
+            "minutes_spoken": round(row.audio_input_bytes / PCM_BYTES_PER_SECOND / 60, 2),
+            "turns": row.turns,
+            "avg_response_ms": round(row.response_time_total_ms / row.response_time_count) if row.response_time_count else None,
+        })
+    return {
+        "days": days,
+        "total": {
+            "minutes_spoken": round(totals["audio_input_bytes"] / PCM_BYTES_PER_SECOND / 60, 2),
+            "turns": totals["turns"],
+            "avg_response_ms": round(totals["response_time_total_ms"] / totals["response_time_count"]) if totals["response_time_count"] else None,
+        },
+    }
+
+
+def user_stats_query(user_id: int, since: date = None, until: date = None):
+    query = select(UserDailyStats).where(UserDailyStats.user_id == user_id)
+    if since:
+        query = query.where(UserDailyStats.day >= since)
+    if until:
+        query = query.where(UserDailyStats.day <= until)
+    return query.order_by(UserDailyStats.day)
+
+
+def all_users_stats_query(since: date = None, until: date = None):
+    """按学生汇总的统计（教师视图）"""
+    query = select(
+        UserDailyStats.user_id,
+        func.sum(UserDailyStats.audio_input_bytes).label("audio_input_bytes"),
+        func.sum(UserDailyStats.turns).label("turns"),
+        func.sum(UserDailyStats.response_time_total_ms).label("response_time_total_ms"),
+        func.sum(UserDailyStats.response_time_count).label("response_time_count"),
+        func.count().label("active_days"),
+    )
+    if since:
+        query = query.where(UserDailyStats.day >= since)
+    if until:
+        query = query.where(UserDailyStats.day <= until)
+    return query.group_by(UserDailyStats.user_id).order_by(UserDailyStats.user_id)
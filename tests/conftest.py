@@ -0,0 +1,15 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# 模拟上游等压测工具也用于测试
+sys.path.append(os.path.join(ROOT, "benchmarks"))
+
+# 在导入 database 之前指定临时数据库，测试不碰开发用的 gemini_teacher.db
+_tmp = tempfile.mkdtemp(prefix="gemini-teacher-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(_tmp, 'test.db')}")
+os.environ.setdefault("DB_POOL_TIMEOUT", "1")
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("SECRET_KEY", "test-secret-key-for-the-test-suite")
@@ -0,0 +1,43 @@
+import asyncio
+
+from admission import AdmissionController
+
+
+def test_queued_user_does_not_block_others_when_slots_are_free():
+    async def scenario():
+        controller = AdmissionController(max_global=10, max_per_user=1, max_wait=5)
+        held = await controller.acquire(1)
+        # 用户1的第二个会话只受单用户名额限制，排在队首
+        blocked = asyncio.create_task(controller.acquire(1))
+        await asyncio.sleep(0)
+        assert len(controller.queue) == 1
+
+        ticket = await asyncio.wait_for(controller.acquire(2), 0.5)
+        assert controller.active == 2
+        assert len(controller.queue) == 1
+
+        held.release()
+        second = await asyncio.wait_for(blocked, 0.5)
+        ticket.release()
+        second.release()
+        assert controller.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_fifo_order_is_kept_when_global_slots_are_full():
+    async def scenario():
+        controller = AdmissionController(max_global=1, max_per_user=1, max_wait=5)
+        held = await controller.acquire(1)
+        first = asyncio.create_task(controller.acquire(2))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(controller.acquire(3))
+        await asyncio.sleep(0)
+
+        held.release()
+        ticket = await asyncio.wait_for(first, 0.5)
+        assert not second.done()
+        ticket.release()
+        (await asyncio.wait_for(second, 0.5)).release()
+
+    asyncio.run(scenario())
@@ -0,0 +1,31 @@
+import os
+
+import assets
+
+
+def test_cleanup_tolerates_files_removed_by_another_worker(tmp_path, monkeypatch):
+    source, build = tmp_path / "static", tmp_path / "build"
+    (source / "js").mkdir(parents=True)
+    (source / "js" / "main.js").write_text("console.log(1)")
+    assets.build(str(source), str(build))
+    (source / "js" / "main.js").write_text("console.log(2)")
+
+    # 另一个worker的临时文件不能被删除
+    in_progress = build / "js.main.deadbeef.js.999.tmp"
+    in_progress.write_text("partial")
+
+    real_remove = os.remove
+
+    def racing_remove(path):
+        # 模拟另一个worker抢先删掉了同一个旧文件
+        real_remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(assets.os, "remove", racing_remove)
+    manifest = assets.build(str(source), str(build))
+
+    names = set(os.listdir(build))
+    assert manifest["js/main.js"] in names
+    assert in_progress.name in names
+    assert not any(name.startswith("js.main.") and manifest["js/main.js"] not in name and not name.endswith(".tmp")
+                   for name in names)
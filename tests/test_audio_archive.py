@@ -0,0 +1,40 @@
+import time
+import asyncio
+
+import httpx
+
+import database
+import main
+from audio_archive import AudioArchive
+
+
+def test_disabled_archive_returns_404(tmp_path, monkeypatch):
+    monkeypatch.setattr(main.audio_archive, "directory", str(tmp_path / "missing"))
+
+    async def scenario():
+        await database.init_db()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.post("/register", data={"username": "archive_student", "password": "password123", "email": "archive_student@test.local"})
+            login = await client.post("/token", data={"username": "archive_student", "password": "password123"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            assert (await client.get("/archive/s1", headers=headers)).status_code == 404
+            assert (await client.get("/archive/s1/1/user", headers=headers)).status_code == 404
+
+    asyncio.run(scenario())
+
+
+def test_indexed_turn_is_readable_from_the_segment(tmp_path):
+    archive = AudioArchive(directory=str(tmp_path))
+    archive.start()
+    try:
+        data = bytes(range(256)) * 40
+        archive.write_turn("s1", 7, 1, "user", data, 16000)
+        deadline = time.monotonic() + 5
+        while (entry := archive.lookup("s1", 1, "user")) is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # 索引一出现，段文件中就必须已经有完整的数据
+        assert entry is not None
+        assert bytes(archive.view(entry)) == data
+    finally:
+        archive.stop()
@@ -0,0 +1,77 @@
+import json
+import asyncio
+
+import gemini_service
+from conversation import ConversationContext, ConversationStore
+from mock_upstream import MockUpstream, INPUT_TRANSCRIPT, OUTPUT_TRANSCRIPT, tone
+
+
+def test_context_is_shared_through_the_registry_file(tmp_path):
+    path = str(tmp_path / "sessions.db")
+
+    async def scenario():
+        # 两个 store 相当于两个worker进程
+        first, second = ConversationStore(path), ConversationStore(path)
+        context = await first.load(42)
+        context.add_turn("user", "I goed to the park yesterday.")
+        context.add_turn("model", "Nice! We say 'I went to the park'.")
+        await first.save(42, context)
+
+        restored = await second.load(42)
+        assert [(role, text) for role, text, _ in restored.recent] == [
+            ("user", "I goed to the park yesterday."),
+            ("model", "Nice! We say 'I went to the park'."),
+        ]
+        assert restored.render() == context.render()
+        assert (await second.load(7)).turns_total == 0
+
+    asyncio.run(scenario())
+
+
+def test_expired_context_is_not_restored(tmp_path):
+    async def scenario():
+        store = ConversationStore(str(tmp_path / "sessions.db"), ttl=0)
+        context = ConversationContext()
+        context.add_turn("user", "Hello")
+        await store.save(1, context)
+        assert (await store.load(1)).turns_total == 0
+
+    asyncio.run(scenario())
+
+
+def test_setup_requests_transcription_for_audio_turns():
+    context = ConversationContext()
+    setup = json.loads(context.setup_message("m", transcription=True))["setup"]
+    assert "input_audio_transcription" in setup and "output_audio_transcription" in setup
+    assert "input_audio_transcription" not in json.loads(context.setup_message("m", "TEXT"))["setup"]
+
+
+class ClosedClient:
+    """已断开的客户端：回复音频直接进入重放缓冲区"""
+
+    closed = True
+
+    async def send_json(self, data):
+        pass
+
+
+def test_audio_turn_context_uses_transcripts(tmp_path, monkeypatch):
+    async def scenario():
+        upstream = MockUpstream(think_ms=0, reply_seconds=0.2, speed=100)
+        port = await upstream.start()
+        monkeypatch.setattr(gemini_service, "GEMINI_WS_URL", f"ws://127.0.0.1:{port}")
+        monkeypatch.setattr(gemini_service, "conversation_store", ConversationStore(str(tmp_path / "sessions.db")))
+        monkeypatch.setattr(gemini_service, "get_upstream_pool", lambda: None)
+        try:
+            service = gemini_service.GeminiService(user_id=5)
+            await service.load_context()
+            assert await service.handle_audio_data(tone(0.1), ClosedClient())
+            assert [(role, text) for role, text, _ in service.context.recent] == [
+                ("user", INPUT_TRANSCRIPT), ("model", OUTPUT_TRANSCRIPT),
+            ]
+            restored = await gemini_service.conversation_store.load(5)
+            assert restored.render() == service.context.render()
+        finally:
+            await upstream.stop()
+
+    asyncio.run(scenario())
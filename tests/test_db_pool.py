@@ -0,0 +1,39 @@
+import asyncio
+
+import httpx
+
+import database
+import main
+
+
+async def _token(client, username):
+    await client.post("/register", data={"username": username, "password": "password123", "email": f"{username}@test.local"})
+    response = await client.post("/token", data={"username": username, "password": "password123"})
+    assert response.status_code == 200
+    return response.json()["access_token"]
+
+
+def test_slow_authenticated_request_does_not_starve_writes(monkeypatch):
+    """SQLite的写引擎只有一个连接：认证查询不能把它占到慢请求结束"""
+    monkeypatch.setenv("ADMIN_USERNAMES", "pool_admin")
+
+    async def scenario():
+        await database.init_db()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            token = await _token(client, "pool_admin")
+            await _token(client, "pool_student")
+
+            # 比写连接池的等待超时（测试中为1秒）更长的认证请求
+            slow = asyncio.create_task(client.post(
+                "/admin/profile?seconds=2&format=collapsed",
+                headers={"Authorization": f"Bearer {token}"},
+            ))
+            await asyncio.sleep(0.3)
+            login = await client.post("/token", data={"username": "pool_student", "password": "password123"})
+            assert login.status_code == 200
+            usage = await client.get("/usage", headers={"Authorization": f"Bearer {login.json()['access_token']}"})
+            assert usage.status_code == 200
+            assert (await slow).status_code == 200
+
+    asyncio.run(scenario())
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from fluency import analyze, SAMPLE_RATE
+
+
+def _sine(frequency, seconds=1.0):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (8000 * np.sin(2 * np.pi * frequency * t)).astype("<i2").tobytes()
+
+
+@pytest.mark.parametrize("frequency", [110, 200, 300])
+def test_pitch_of_a_pure_sine(frequency):
+    card = analyze(_sine(frequency))
+    assert card["pitch"]["median_hz"] == pytest.approx(frequency, rel=0.02)
+
+
+def test_odd_length_input_still_gets_a_card():
+    card = analyze(_sine(200) + b"\x01")
+    assert card["pitch"]["median_hz"] == pytest.approx(200, rel=0.02)
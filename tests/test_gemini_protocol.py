@@ -0,0 +1,34 @@
+import json
+import base64
+
+from gemini_protocol import realtime_input_message, parse_server_message, pcm_volume
+
+
+def test_realtime_input_message_carries_the_pcm():
+    chunk = json.loads(realtime_input_message(b"\x01\x02\x03\x04"))["realtime_input"]["media_chunks"][0]
+    assert chunk["mime_type"] == "audio/pcm"
+    assert base64.b64decode(chunk["data"]) == b"\x01\x02\x03\x04"
+
+
+def test_parse_server_message_keeps_part_order():
+    raw = json.dumps({"serverContent": {
+        "modelTurn": {"parts": [
+            {"inlineData": {"mimeType": "audio/pcm;rate=24000", "data": base64.b64encode(b"\x00\x01").decode()}},
+            {"text": "Hi"},
+        ]},
+        "inputTranscription": {"text": "hello"},
+        "outputTranscription": {"text": "Hi there"},
+        "turnComplete": True,
+    }})
+    events, turn_complete = parse_server_message(raw)
+    assert events == [
+        ("audio", b"\x00\x01"), ("text", "Hi"), ("transcript", "user", "hello"), ("transcript", "model", "Hi there"),
+    ]
+    assert turn_complete
+    assert parse_server_message(json.dumps({"setupComplete": {}})) == ([], False)
+
+
+def test_pcm_volume_is_mean_absolute_amplitude():
+    samples = [100, -300, 0, 200]
+    data = b"".join(s.to_bytes(2, "little", signed=True) for s in samples)
+    assert pcm_volume(data) == 150
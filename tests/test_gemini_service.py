@@ -0,0 +1,34 @@
+import asyncio
+
+import gemini_service
+
+
+class ClosedClient:
+    closed = True
+
+    async def send_json(self, data):
+        pass
+
+
+def test_silent_utterance_gets_the_no_speech_phrase(monkeypatch):
+    phrases = []
+
+    async def phrase(name):
+        phrases.append(name)
+        return b"\x00\x00"
+
+    async def run_turn(*args, **kwargs):
+        raise AssertionError("静音不应发给模型")
+
+    monkeypatch.setattr(gemini_service.tts_cache, "phrase", phrase)
+    monkeypatch.setattr(gemini_service, "run_turn", run_turn)
+    monkeypatch.setattr(gemini_service, "get_upstream_pool", lambda: None)
+
+    async def scenario():
+        service = gemini_service.GeminiService()
+        quiet = (20).to_bytes(2, "little", signed=True) * 1600
+        assert await service.handle_audio_data(quiet, ClosedClient()) is False
+        assert phrases == ["no_speech"]
+        assert service.replay.bytes == 2
+
+    asyncio.run(scenario())
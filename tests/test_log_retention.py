@@ -0,0 +1,40 @@
+import sqlite3
+import asyncio
+
+import log_retention
+from log_retention import LogMaintenance
+
+
+def test_compact_never_runs_a_full_vacuum_on_the_live_database(tmp_path, monkeypatch):
+    path = str(tmp_path / "main.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x)")
+    conn.commit()
+    conn.close()
+
+    def forbidden(_):
+        raise AssertionError("后台维护不应执行完整VACUUM")
+
+    monkeypatch.setattr(log_retention, "_enable_incremental_vacuum", forbidden)
+    maintenance = LogMaintenance()
+    asyncio.run(maintenance.compact(path))
+    asyncio.run(maintenance.compact(path))
+    assert maintenance.incremental_vacuum_hinted
+
+
+def test_compact_reclaims_pages_in_incremental_mode(tmp_path):
+    path = str(tmp_path / "main.db")
+    log_retention._enable_incremental_vacuum(path)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x)")
+    conn.executemany("INSERT INTO t VALUES (?)", [("x" * 1000,)] * 2000)
+    conn.commit()
+    conn.execute("DELETE FROM t")
+    conn.commit()
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+    conn.close()
+
+    asyncio.run(LogMaintenance().compact(path))
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    conn.close()
@@ -0,0 +1,61 @@
+import asyncio
+
+from netem_proxy import _pipe, Impairment, Stats
+
+
+class FixedRng:
+    """没有抖动，卡顿每隔固定的 0.1 秒开始一次"""
+
+    def uniform(self, a, b):
+        return 0.0
+
+    def expovariate(self, rate):
+        return 0.1
+
+
+class Sink:
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        self.data.append(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _run(schedule):
+    """按 [(发送前等待的秒数, 数据)] 送入一个方向，返回统计"""
+    impairment = Impairment(stall_every_s=0.1, stall_ms=50)
+    stats = Stats()
+
+    async def scenario():
+        reader = asyncio.StreamReader()
+        sink = Sink()
+        pipe = asyncio.create_task(_pipe(reader, sink, impairment, stats, "down", FixedRng()))
+        for wait, data in schedule:
+            await asyncio.sleep(wait)
+            reader.feed_data(data)
+        reader.feed_eof()
+        await pipe
+        assert b"".join(sink.data) == b"".join(data for _, data in schedule)
+
+    asyncio.run(scenario())
+    return stats
+
+
+def test_stalls_that_pass_while_idle_are_not_counted():
+    # 卡顿窗口为 [0.10, 0.15]、[0.25, 0.30]……，第二段在两个窗口之间到达
+    stats = _run([(0, b"a"), (0.2, b"b")])
+    assert stats.stalls["down"] == 0
+    assert stats.stalled_seconds["down"] == 0
+
+
+def test_stall_that_holds_data_is_counted_with_the_actual_delay():
+    # 第二段落在 [0.10, 0.15] 的卡顿窗口内，被推迟到窗口结束
+    stats = _run([(0, b"a"), (0.12, b"b")])
+    assert stats.stalls["down"] == 1
+    assert 0 < stats.stalled_seconds["down"] <= 0.05
@@ -0,0 +1,48 @@
+import asyncio
+
+from outbound import Outbound
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, message):
+        await asyncio.sleep(0.01)
+        self.sent.append(message["type"])
+
+    async def send_bytes(self, data):
+        await asyncio.sleep(0.01)
+        self.sent.append("audio")
+
+
+def test_drain_delivers_queued_audio_before_a_final_message():
+    async def scenario():
+        socket = RecordingSocket()
+        outbound = Outbound(socket)
+        outbound.pacer.enabled = False
+        outbound.send_audio(bytes(4800))
+        await outbound.send_json({"type": "usage", "remaining_seconds": 0})
+        # 结束会话前：先发完队列，再发控制消息，再等它发出
+        assert await outbound.drain(1)
+        await outbound.send_json({"type": "quota_exceeded"})
+        assert await outbound.drain(1)
+        assert socket.sent == ["usage", "audio", "quota_exceeded"]
+        outbound.abort()
+
+    asyncio.run(scenario())
+
+
+def test_drain_times_out_on_a_stuck_client():
+    class StuckSocket(RecordingSocket):
+        async def send_json(self, message):
+            await asyncio.sleep(10)
+
+    async def scenario():
+        outbound = Outbound(StuckSocket())
+        await outbound.send_json({"type": "quota_exceeded"})
+        assert not await outbound.drain(0.05)
+        outbound.abort()
+        assert await outbound.drain(0.05) is False
+
+    asyncio.run(scenario())
@@ -0,0 +1,94 @@
+import pytest
+
+from pacing import Pacer, duration, BYTES_PER_SECOND
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def test_client_never_runs_more_than_lead_ahead():
+    clock = FakeClock()
+    pacer = Pacer(lead=0.3, enabled=True, clock=clock)
+    frame = 0.1
+    for _ in range(3):
+        assert pacer.delay(frame) == 0.0
+        pacer.sent(frame)
+    assert pacer.buffered() == pytest.approx(0.3)
+    assert pacer.room() == pytest.approx(0.0)
+    # 第四帧要等客户端播掉一帧
+    assert pacer.delay(frame) == pytest.approx(0.1)
+
+    clock.advance(0.04)
+    assert pacer.delay(frame) == pytest.approx(0.06)
+    assert pacer.room() == pytest.approx(0.04)
+    clock.advance(0.06)
+    assert pacer.delay(frame) == pytest.approx(0.0)
+    pacer.sent(frame)
+    assert pacer.buffered() == pytest.approx(0.3)
+    assert pacer.sent_seconds == pytest.approx(0.4)
+
+
+def test_frame_longer_than_lead_waits_for_an_empty_buffer():
+    clock = FakeClock()
+    pacer = Pacer(lead=0.3, enabled=True, clock=clock)
+    assert pacer.delay(0.5) == 0.0
+    pacer.sent(0.5)
+    # 缓冲超过 lead 也要等客户端全部播完才发下一帧长帧
+    assert pacer.delay(0.5) == pytest.approx(0.5)
+    clock.advance(0.3)
+    assert pacer.delay(0.5) == pytest.approx(0.2)
+    clock.advance(0.2)
+    assert pacer.buffered() == 0.0
+    assert pacer.delay(0.5) == 0.0
+
+
+def test_sent_after_an_idle_gap_starts_from_now():
+    clock = FakeClock()
+    pacer = Pacer(lead=0.3, enabled=True, clock=clock)
+    pacer.sent(0.2)
+    clock.advance(5)
+    pacer.sent(0.1)
+    assert pacer.play_until == pytest.approx(clock.now + 0.1)
+
+
+def test_flush_counts_the_audio_the_client_dropped():
+    clock = FakeClock()
+    pacer = Pacer(lead=0.3, enabled=True, clock=clock)
+    pacer.sent(0.2)
+    pacer.sent(0.1)
+    clock.advance(0.05)
+    pacer.flush()
+    assert pacer.flushed_seconds == pytest.approx(0.25)
+    assert pacer.play_until == 0.0
+    assert pacer.buffered() == 0.0
+    assert pacer.room() == pytest.approx(0.3)
+    # 清空后马上发送的帧从现在开始播放
+    pacer.sent(0.1)
+    assert pacer.buffered() == pytest.approx(0.1)
+    pacer.flush()
+    assert pacer.flushed_seconds == pytest.approx(0.35)
+
+
+def test_disabled_pacer_never_holds_audio_back():
+    clock = FakeClock()
+    pacer = Pacer(lead=0.3, enabled=False, clock=clock)
+    for _ in range(10):
+        pacer.sent(0.5)
+    assert pacer.delay(0.5) == 0.0
+    assert pacer.room() == float("inf")
+    # 仍然记录发送量，方便对比开关前后的缓冲
+    assert pacer.sent_seconds == pytest.approx(5.0)
+    assert pacer.buffered() == pytest.approx(5.0)
+
+
+def test_duration_is_24khz_pcm():
+    assert duration(bytes(BYTES_PER_SECOND)) == 1.0
+    assert duration(b"") == 0.0
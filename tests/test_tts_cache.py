@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from tts_cache import TTSCache, Synthesizer
+
+
+class SlowSynthesizer(Synthesizer):
+    """第一次合成卡住（等着被取消），之后立即返回"""
+
+    name = "slow"
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.calls = 0
+
+    async def synthesize(self, text, voice, audio_format, sample_rate):
+        self.calls += 1
+        if self.calls == 1:
+            self.started.set()
+            await asyncio.sleep(10)
+        return b"\x01\x00"
+
+
+def test_waiter_loads_itself_when_the_loading_request_is_cancelled(tmp_path):
+    async def scenario():
+        synthesizer = SlowSynthesizer()
+        cache = TTSCache(synthesizer, directory=str(tmp_path))
+        loader = asyncio.create_task(cache.get("请再说一遍。"))
+        await synthesizer.started.wait()
+        waiter = asyncio.create_task(cache.get("请再说一遍。"))
+        await asyncio.sleep(0)
+
+        loader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await loader
+        # 等待同一句话的请求没有被取消，应自己加载并拿到音频
+        assert await asyncio.wait_for(waiter, 1) == b"\x01\x00"
+        assert synthesizer.calls == 2
+        assert cache._inflight == {}
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_still_raises(tmp_path):
+    async def scenario():
+        synthesizer = SlowSynthesizer()
+        cache = TTSCache(synthesizer, directory=str(tmp_path))
+        loader = asyncio.create_task(cache.get("请再说一遍。"))
+        await synthesizer.started.wait()
+        waiter = asyncio.create_task(cache.get("请再说一遍。"))
+        await asyncio.sleep(0)
+
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        loader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await loader
+
+    asyncio.run(scenario())
@@ -0,0 +1,75 @@
+import socket
+import asyncio
+
+import pytest
+
+import upstream_workers
+from upstream_workers import UpstreamWorkerPool, UpstreamWorkerError
+
+
+@pytest.fixture
+def silent_upstream(monkeypatch):
+    """接受连接但从不完成握手的上游，让轮次一直停在worker中"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    monkeypatch.setenv("GEMINI_WS_URL", f"ws://127.0.0.1:{server.getsockname()[1]}")
+    yield
+    server.close()
+
+
+async def _noop(_):
+    pass
+
+
+def test_turn_fails_when_its_worker_dies(silent_upstream):
+    async def scenario():
+        pool = UpstreamWorkerPool(workers=1)
+        pool.start()
+        try:
+            await pool.wait_ready()
+            turn = asyncio.create_task(pool.run_turn("key", b"\0" * 3200, _noop))
+            await asyncio.sleep(0.3)
+            assert not turn.done()
+            pool.workers[0].process.kill()
+            with pytest.raises(UpstreamWorkerError):
+                await asyncio.wait_for(turn, 5)
+            assert pool.turns == {}
+            assert pool.metrics()[0]["alive"] is False
+            with pytest.raises(UpstreamWorkerError):
+                await pool.run_turn("key", b"\0" * 3200, _noop)
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_wait_ready_fails_when_a_worker_exits_during_startup():
+    async def scenario():
+        pool = UpstreamWorkerPool(workers=1)
+        pool.start()
+        try:
+            pool.workers[0].process.kill()
+            with pytest.raises(UpstreamWorkerError):
+                await asyncio.wait_for(pool.wait_ready(), 5)
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
+
+
+def test_turn_times_out_when_worker_stops_responding(silent_upstream, monkeypatch):
+    monkeypatch.setattr(upstream_workers, "TURN_EVENT_TIMEOUT", 0.5)
+
+    async def scenario():
+        pool = UpstreamWorkerPool(workers=1)
+        pool.start()
+        try:
+            await pool.wait_ready()
+            with pytest.raises(asyncio.TimeoutError):
+                await pool.run_turn("key", b"\0" * 3200, _noop)
+            assert pool.workers[0].in_flight == 0
+        finally:
+            await pool.stop()
+
+    asyncio.run(scenario())
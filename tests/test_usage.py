@@ -0,0 +1,101 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.sql import Select
+
+from usage import UsageMeter, UPLINK_BYTES_PER_SECOND, _today
+
+
+class FakeUsageTable:
+    """只有一行用量的"数据库"：读和写都可以在返回前卡住"""
+
+    def __init__(self, uplink_seconds):
+        self.row = SimpleNamespace(uplink_seconds=uplink_seconds, downlink_seconds=0.0, turns=1)
+        self.read_gate = None
+        self.write_gate = None
+        self.reading = asyncio.Event()
+        self.writing = asyncio.Event()
+
+    def session(self):
+        return FakeSession(self)
+
+
+class FakeSession:
+    bind = SimpleNamespace(dialect=SimpleNamespace(name="sqlite"))
+
+    def __init__(self, table):
+        self.table = table
+        self.rows = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        table = self.table
+        if isinstance(statement, Select):
+            row = SimpleNamespace(**vars(table.row))
+            table.reading.set()
+            if table.read_gate is not None:
+                await table.read_gate.wait()
+            return SimpleNamespace(scalar_one_or_none=lambda: row)
+        self.rows = statement.compile().params
+        table.writing.set()
+        if table.write_gate is not None:
+            await table.write_gate.wait()
+
+    async def commit(self):
+        self.table.row.uplink_seconds += self.rows["uplink_seconds_m0"]
+
+
+def _meter(table):
+    meter = UsageMeter(limit=100)
+    meter.session_factory = table.session
+    return meter
+
+
+def test_load_during_flush_does_not_drop_the_inflight_usage():
+    async def scenario():
+        table = FakeUsageTable(uplink_seconds=10.0)
+        meter = _meter(table)
+        await meter._load((1, _today()))
+        meter.add_uplink(1, 5 * UPLINK_BYTES_PER_SECOND)
+        assert meter.used(1) == pytest.approx(15.0)
+
+        table.write_gate = asyncio.Event()
+        flush = asyncio.create_task(meter.flush())
+        await table.writing.wait()
+        # 写入还没提交时读到的是旧行
+        await meter._load((1, _today()))
+        assert meter.used(1) == pytest.approx(15.0)
+
+        table.write_gate.set()
+        await flush
+        assert meter.used(1) == pytest.approx(15.0)
+        await meter._load((1, _today()))
+        assert meter.used(1) == pytest.approx(15.0)
+
+    asyncio.run(scenario())
+
+
+def test_load_started_before_a_flush_is_discarded():
+    async def scenario():
+        table = FakeUsageTable(uplink_seconds=10.0)
+        meter = _meter(table)
+        await meter._load((1, _today()))
+        meter.add_uplink(1, 5 * UPLINK_BYTES_PER_SECOND)
+
+        table.read_gate = asyncio.Event()
+        table.reading.clear()
+        load = asyncio.create_task(meter._load((1, _today())))
+        await table.reading.wait()
+        # 读到旧行之后、写回缓存之前，另一次写入完成
+        await meter.flush()
+        table.read_gate.set()
+        await load
+        assert meter.used(1) == pytest.approx(15.0)
+
+    asyncio.run(scenario())
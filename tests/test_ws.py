@@ -0,0 +1,20 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import database
+import main
+
+
+def test_audio_on_text_socket_is_rejected_explicitly():
+    asyncio.run(database.init_db())
+    client = TestClient(main.app)
+    client.post("/register", data={"username": "ws_student", "password": "password123", "email": "ws_student@test.local"})
+    token = client.post("/token", data={"username": "ws_student", "password": "password123"}).json()["access_token"]
+
+    with client.websocket_connect(f"/ws?token={token}") as ws:
+        ws.send_json({"type": "audio", "data": "AAAA"})
+        reply = ws.receive_json()
+    assert reply["type"] == "error"
+    assert "/ws/audio" in reply["error"]
+    assert not hasattr(main.manager, "gemini_service")
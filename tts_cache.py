@@ -0,0 +1,344 @@
+"""合成语音缓存
+
+导师的很多话是重复的：练习提示、"请再说一遍"、常见的语法讲解。这里按
+(规范化文本, 音色, 格式, 采样率) 的哈希缓存合成好的音频：先查内存LRU，再查磁盘，
+都没有时才调用合成器。磁盘层按总大小淘汰最久未使用的文件。
+
+合成器是可替换的：默认使用 google-cloud-texttospeech，离线时可以用 TTS_SYNTHESIZER
+指定 silence 或自定义的 "模块:类"。
+"""
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+import importlib
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "./tts_cache")
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))  # 内存层容量（字节）
+TTS_CACHE_DISK_BYTES = int(os.getenv("TTS_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))  # 磁盘层容量（字节）
+TTS_SYNTHESIZER = os.getenv("TTS_SYNTHESIZER", "google")  # google、silence 或 "模块:类"
+TTS_VOICE = os.getenv("TTS_VOICE", "cmn-CN-Standard-A")
+TTS_FORMAT = "pcm"  # 与Gemini回复相同的16位单声道PCM，客户端可以直接播放
+TTS_SAMPLE_RATE = 24000
+
+# 固定话术：启动时预先合成，之后直接从缓存发送，不经过模型和TTS
+CANNED_PHRASES = {
+    "retry": "请再说一遍。",
+    "busy": "现在使用的人比较多，请稍等一下再试。",
+    "no_speech": "我没有听清楚，请靠近麦克风再说一次。",
+}
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+class SynthesisError(Exception):
+    """合成器不可用或合成失败"""
+
+
+def normalize_text(text: str) -> str:
+    """统一全角/半角和空白，让写法略有差异的同一句话命中同一条缓存"""
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def cache_key(text: str, voice: str, audio_format: str = TTS_FORMAT, sample_rate: int = TTS_SAMPLE_RATE) -> str:
+    raw = "\x00".join((normalize_text(text), voice, audio_format, str(sample_rate)))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class Synthesizer:
+    """合成器接口：返回指定格式的音频字节"""
+
+    name = "base"
+
+    async def synthesize(self, text: str, voice: str, audio_format: str, sample_rate: int) -> bytes:
+        raise NotImplementedError
+
+
+class SilenceSynthesizer(Synthesizer):
+    """离线替身：按文本长度生成静音，用于开发和压测"""
+
+    name = "silence"
+
+    async def synthesize(self, text, voice, audio_format, sample_rate):
+        seconds = max(0.5, len(text) * 0.15)
+        return bytes(int(seconds * sample_rate) * 2)
+
+
+class GoogleCloudSynthesizer(Synthesizer):
+    """google-cloud-texttospeech，同步客户端放在线程中调用"""
+
+    name = "google"
+
+    def __init__(self):
+        self._client = None
+
+    def _synthesize_sync(self, text, voice, audio_format, sample_rate):
+        try:
+            from google.cloud import texttospeech
+        except ImportError as e:
+            raise SynthesisError("未安装 google-cloud-texttospeech") from e
+        if audio_format != "pcm":
+            raise SynthesisError(f"不支持的音频格式: {audio_format}")
+        if self._client is None:
+            self._client = texttospeech.TextToSpeechClient()
+        response = self._client.synthesize_speech(
+            input=texttospeech.SynthesisInput(text=text),
+            voice=texttospeech.VoiceSelectionParams(
+                language_code="-".join(voice.split("-")[:2]), name=voice
+            ),
+            audio_config=texttospeech.AudioConfig(
+                audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+                sample_rate_hertz=sample_rate,
+            ),
+        )
+        audio = response.audio_content
+        # LINEAR16 带有WAV头，去掉后得到裸PCM
+        if audio[:4] == b"RIFF":
+            audio = audio[44:]
+        return audio
+
+    async def synthesize(self, text, voice, audio_format, sample_rate):
+        try:
+            return await asyncio.to_thread(self._synthesize_sync, text, voice, audio_format, sample_rate)
+        except SynthesisError:
+            raise
+        except Exception as e:
+            raise SynthesisError(str(e)) from e
+
+
+def load_synthesizer(spec: str = TTS_SYNTHESIZER) -> Synthesizer:
+    if spec == "google":
+        return GoogleCloudSynthesizer()
+    if spec == "silence":
+        return SilenceSynthesizer()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class TTSCache:
+    """内存LRU + 磁盘两级缓存"""
+
+    def __init__(
+        self,
+        synthesizer: Synthesizer = None,
+        directory: str = TTS_CACHE_DIR,
+        memory_bytes: int = TTS_CACHE_MEMORY_BYTES,
+        disk_bytes: int = TTS_CACHE_DISK_BYTES,
+    ):
+        self.synthesizer = synthesizer
+        self.directory = directory
+        self.memory_limit = memory_bytes
+        self.disk_limit = disk_bytes
+        self._memory = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self._inflight = {}
+        self._disk_ready = False
+        self._warm_task = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.synthesis_errors = 0
+
+    def set_synthesizer(self, synthesizer: Synthesizer):
+        self.synthesizer = synthesizer
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".pcm")
+
+    # ------------------------------------------------------------------
+    # 内存层
+    # ------------------------------------------------------------------
+
+    def _memory_get(self, key):
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory.move_to_end(key)
+        return audio
+
+    def _memory_put(self, key, audio):
+        if len(audio) > self.memory_limit:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self.memory_bytes -= len(previous)
+        self._memory[key] = audio
+        self.memory_bytes += len(audio)
+        while self.memory_bytes > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    # ------------------------------------------------------------------
+    # 磁盘层（在线程中执行）
+    # ------------------------------------------------------------------
+
+    def _scan_disk(self):
+        os.makedirs(self.directory, exist_ok=True)
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+        self.disk_bytes = total
+        self._disk_ready = True
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+        except FileNotFoundError:
+            return None
+        # 用修改时间记录最近使用时间，淘汰时按它排序
+        os.utime(path)
+        return audio
+
+    def _disk_put(self, key, audio):
+        if not self._disk_ready:
+            self._scan_disk()
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(audio)
+        os.replace(tmp, path)
+        self.disk_bytes += len(audio)
+        if self.disk_bytes > self.disk_limit:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """删除最久未使用的文件，直到降到容量的90%"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        target = self.disk_limit * 0.9
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self.disk_bytes = total
+
+    # ------------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------------
+
+    async def get(self, text: str, voice: str = TTS_VOICE, audio_format: str = TTS_FORMAT,
+                  sample_rate: int = TTS_SAMPLE_RATE) -> bytes:
+        """返回合成好的音频；同一句话同时只合成一次"""
+        key = cache_key(text, voice, audio_format, sample_rate)
+        audio = self._memory_get(key)
+        if audio is not None:
+            self.memory_hits += 1
+            return audio
+
+        while (inflight := self._inflight.get(key)) is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # 被取消的是负责合成的那个请求而不是自己时，接着由自己来加载
+                if not inflight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            audio = self._memory_get(key)
+            if audio is not None:
+                self.memory_hits += 1
+                return audio
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            audio = await self._load(key, text, voice, audio_format, sample_rate)
+            future.set_result(audio)
+            return audio
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免"exception was never retrieved"警告
+            future.exception()
+            raise
+        finally:
+            # 合成的请求被取消（CancelledError不是Exception）时也要结束 future，
+            # 否则等待同一句话的请求会一直挂住；它们看到 future 被取消后自己重新加载
+            if not future.done():
+                future.cancel()
+            del self._inflight[key]
+
+    async def _load(self, key, text, voice, audio_format, sample_rate):
+        audio = await asyncio.to_thread(self._disk_get, key)
+        if audio is not None:
+            self.disk_hits += 1
+            self._memory_put(key, audio)
+            return audio
+
+        self.misses += 1
+        if self.synthesizer is None:
+            self.synthesizer = load_synthesizer()
+        started = time.monotonic()
+        try:
+            audio = await self.synthesizer.synthesize(normalize_text(text), voice, audio_format, sample_rate)
+        except Exception:
+            self.synthesis_errors += 1
+            raise
+        logger.info(f"合成语音 {key[:12]} 用时 {time.monotonic() - started:.2f}s，大小 {len(audio)} bytes")
+        self._memory_put(key, audio)
+        try:
+            await asyncio.to_thread(self._disk_put, key, audio)
+        except OSError as e:
+            logger.warning(f"写入语音缓存失败: {str(e)}")
+        return audio
+
+    async def phrase(self, name: str) -> bytes:
+        """返回固定话术的音频"""
+        return await self.get(CANNED_PHRASES[name])
+
+    async def warm(self):
+        """预先合成所有固定话术（合成器不可用时只记录警告）"""
+        await asyncio.to_thread(self._scan_disk)
+        for name, text in CANNED_PHRASES.items():
+            try:
+                await self.get(text)
+            except Exception as e:
+                logger.warning(f"预合成话术 {name} 失败: {str(e)}")
+
+    def start(self):
+        if self._warm_task is None:
+            self._warm_task = asyncio.create_task(self.warm())
+
+    async def stop(self):
+        if self._warm_task:
+            self._warm_task.cancel()
+            try:
+                await self._warm_task
+            except asyncio.CancelledError:
+                pass
+            self._warm_task = None
+
+    def metrics(self) -> dict:
+        return {
+            "synthesizer": self.synthesizer.name if self.synthesizer else None,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self.memory_bytes,
+            "disk_bytes": self.disk_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "synthesis_errors": self.synthesis_errors,
+        }
+
+
+tts_cache = TTSCache()
@@ -0,0 +1,164 @@
+"""上行音频分帧的自适应调整
+
+以前客户端录完一整句才一次性上传，帧大小在各处写死（starter.py 512帧、cankao.py 2048帧、
+audio-processor.js 1024个采样），没有一个值能同时适合校园Wi-Fi和4G。
+
+客户端以 stream=1 连接 /ws/audio 时，边说边按帧上传，一句话结束时发送
+{"type": "utterance_end"}。服务端在已有的控制通道上测量链路：
+
+- 往返时间：ping 中带服务端时间戳，客户端在 pong 中原样返回（心跳的 ping 同样计入）
+- 发送队列：客户端在 pong 中附带 WebSocket.bufferedAmount，队列增长说明上行跟不上
+
+链路良好时逐步减小帧长（延迟低），往返时间变长或发送队列增长时加倍帧长（减少每帧的
+开销），范围在 UPLINK_MIN_FRAME_MS ~ UPLINK_MAX_FRAME_MS 之间。新的帧长通过
+{"type": "uplink", "frame_ms": N} 通知客户端。
+"""
+import os
+import time
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+UPLINK_MIN_FRAME_MS = int(os.getenv("UPLINK_MIN_FRAME_MS", "20"))
+UPLINK_MAX_FRAME_MS = int(os.getenv("UPLINK_MAX_FRAME_MS", "200"))
+UPLINK_INITIAL_FRAME_MS = int(os.getenv("UPLINK_INITIAL_FRAME_MS", "60"))
+UPLINK_PROBE_INTERVAL = float(os.getenv("UPLINK_PROBE_INTERVAL", "2"))  # 上传音频期间测量往返时间的间隔（秒）
+UPLINK_RTT_LOW = float(os.getenv("UPLINK_RTT_LOW", "0.08"))  # 低于该往返时间（秒）视为链路良好
+UPLINK_RTT_HIGH = float(os.getenv("UPLINK_RTT_HIGH", "0.25"))  # 高于该往返时间（秒）视为链路较差
+UPLINK_MAX_UTTERANCE_SECONDS = float(os.getenv("UPLINK_MAX_UTTERANCE_SECONDS", "60"))  # 单句上限，超过时直接提交
+FRAME_STEP_MS = 20  # 链路良好时每次减小的帧长
+GOOD_SAMPLES_TO_SHRINK = 3  # 连续几次测量良好才减小帧长
+BYTES_PER_MS = 32  # 16kHz 16位单声道
+
+
+class UplinkController:
+    """一个连接的上行状态：测量链路、选择帧长、拼接一句话的音频帧"""
+
+    def __init__(self, websocket, streaming: bool, frame_ms: int = UPLINK_INITIAL_FRAME_MS):
+        self.websocket = websocket
+        self.streaming = streaming
+        self.frame_ms = min(max(frame_ms, UPLINK_MIN_FRAME_MS), UPLINK_MAX_FRAME_MS)
+        self.srtt = None  # 平滑后的往返时间（秒），与TCP相同按1/8加权
+        self.rttvar = 0.0
+        self.last_buffered = 0
+        self.good_samples = 0
+        self.last_probe = time.monotonic()
+        self.frames = []
+        self.pending_bytes = 0
+        self.frames_total = 0
+        self.bytes_total = 0
+        self.adjustments = 0
+
+    # ---- 一句话的拼接 ----
+
+    def add_frame(self, data: bytes) -> bool:
+        """缓存一帧；返回这句话是否已达到上限、应当立即提交"""
+        self.frames.append(data)
+        self.pending_bytes += len(data)
+        self.frames_total += 1
+        self.bytes_total += len(data)
+        return self.pending_bytes >= UPLINK_MAX_UTTERANCE_SECONDS * 1000 * BYTES_PER_MS
+
+    def take_utterance(self) -> bytes:
+        data = b"".join(self.frames)
+        self.frames = []
+        self.pending_bytes = 0
+        return data
+
+    # ---- 链路测量 ----
+
+    async def maybe_probe(self):
+        """上传音频期间定期发送带时间戳的 ping（心跳间隔太长，不够及时）"""
+        now = time.monotonic()
+        if now - self.last_probe < UPLINK_PROBE_INTERVAL:
+            return
+        self.last_probe = now
+        await self.websocket.send_json({"type": "ping", "ts": time.time()})
+
+    async def on_pong(self, message: dict):
+        """根据 pong 更新测量值，帧长变化时通知客户端"""
+        try:
+            rtt = time.time() - float(message["ts"])
+        except (KeyError, TypeError, ValueError):
+            return
+        if not 0 <= rtt < 30:
+            return
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar += (abs(self.srtt - rtt) - self.rttvar) / 4
+            self.srtt += (rtt - self.srtt) / 8
+        try:
+            buffered = max(int(message.get("buffered", 0)), 0)
+        except (TypeError, ValueError):
+            buffered = 0
+        growth = buffered - self.last_buffered
+        self.last_buffered = buffered
+
+        frame_ms = self._choose(buffered, growth)
+        if frame_ms != self.frame_ms:
+            logger.debug("上行帧长 %dms -> %dms（rtt %.0fms, 发送队列 %d 字节）",
+                         self.frame_ms, frame_ms, self.srtt * 1000, buffered)
+            self.frame_ms = frame_ms
+            self.adjustments += 1
+            if self.streaming:
+                await self.websocket.send_json({"type": "uplink", "frame_ms": frame_ms})
+
+    def _choose(self, buffered: int, growth: int) -> int:
+        # 发送队列积压超过一帧且仍在增长，或往返时间过长：加倍帧长
+        congested = (growth > 0 and buffered >= self.frame_ms * BYTES_PER_MS) or self.srtt > UPLINK_RTT_HIGH
+        if congested:
+            self.good_samples = 0
+            return min(self.frame_ms * 2, UPLINK_MAX_FRAME_MS)
+        if self.srtt < UPLINK_RTT_LOW and buffered == 0:
+            self.good_samples += 1
+            if self.good_samples >= GOOD_SAMPLES_TO_SHRINK:
+                self.good_samples = 0
+                return max(self.frame_ms - FRAME_STEP_MS, UPLINK_MIN_FRAME_MS)
+        else:
+            self.good_samples = 0
+        return self.frame_ms
+
+    def hello(self) -> dict:
+        """连接建立时告诉客户端的初始帧长"""
+        return {"type": "uplink", "frame_ms": self.frame_ms}
+
+
+class UplinkRegistry:
+    """汇总本worker所有连接的上行状态，供 /metrics 使用"""
+
+    def __init__(self):
+        self.controllers = set()
+        self.closed_frames = 0
+        self.closed_bytes = 0
+        self.closed_adjustments = 0
+
+    def open(self, websocket, streaming: bool) -> UplinkController:
+        controller = UplinkController(websocket, streaming)
+        self.controllers.add(controller)
+        return controller
+
+    def close(self, controller: UplinkController):
+        if controller in self.controllers:
+            self.controllers.discard(controller)
+            self.closed_frames += controller.frames_total
+            self.closed_bytes += controller.bytes_total
+            self.closed_adjustments += controller.adjustments
+
+    def metrics(self) -> dict:
+        controllers = list(self.controllers)
+        measured = [c.srtt for c in controllers if c.srtt is not None]
+        return {
+            "sessions": len(controllers),
+            "streaming": sum(1 for c in controllers if c.streaming),
+            "frame_ms": dict(sorted(Counter(c.frame_ms for c in controllers).items())),
+            "avg_rtt_ms": round(sum(measured) / len(measured) * 1000, 1) if measured else None,
+            "pending_bytes": sum(c.pending_bytes for c in controllers),
+            "frames_total": self.closed_frames + sum(c.frames_total for c in controllers),
+            "bytes_total": self.closed_bytes + sum(c.bytes_total for c in controllers),
+            "adjustments_total": self.closed_adjustments + sum(c.adjustments for c in controllers),
+        }
+
+
+uplink_registry = UplinkRegistry()
@@ -0,0 +1,386 @@
+"""上游Gemini会话的worker进程池
+
+开启后（GEMINI_UPSTREAM_WORKERS > 0），上游WebSocket、TLS、base64和JSON处理都在
+worker进程中完成。音频通过共享内存环形缓冲区在API进程和worker之间传递，
+管道中只传递很小的控制消息。依赖 loop.add_reader，仅支持类Unix系统。
+"""
+import os
+import struct
+import asyncio
+import logging
+import itertools
+import multiprocessing
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_WORKERS = int(os.getenv("GEMINI_UPSTREAM_WORKERS", "0"))  # worker进程数，0表示不启用
+RING_SIZE = int(os.getenv("GEMINI_UPSTREAM_RING_SIZE", str(4 * 1024 * 1024)))  # 每个方向的环形缓冲区大小（字节）
+RING_POLL_INTERVAL = 0.002  # 环形缓冲区满时的重试间隔（秒）
+TURN_EVENT_TIMEOUT = float(os.getenv("GEMINI_UPSTREAM_TURN_TIMEOUT", "30"))  # 等待worker下一条消息的超时（秒）
+READY_TIMEOUT = float(os.getenv("GEMINI_UPSTREAM_READY_TIMEOUT", "60"))  # 等待所有worker启动的超时（秒）
+
+
+class UpstreamWorkerError(Exception):
+    """worker进程中的上游会话出错"""
+
+    def __init__(self, message: str, rate_limited: bool = False):
+        super().__init__(message)
+        self.rate_limited = rate_limited
+
+
+class ShmRing:
+    """单生产者/单消费者的共享内存字节环
+
+    头部保存两个单调递增的64位位置（写入位置、读取位置），数据区按容量取模。
+    每次读取的长度由管道中的控制消息给出。
+    """
+
+    HEADER = 16
+
+    def __init__(self, name=None, size=RING_SIZE, create=False):
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size + self.HEADER)
+        self.capacity = size
+        self.buf = self.shm.buf
+        if create:
+            struct.pack_into("<QQ", self.buf, 0, 0, 0)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _positions(self):
+        return struct.unpack_from("<QQ", self.buf, 0)
+
+    def free(self) -> int:
+        write_pos, read_pos = self._positions()
+        return self.capacity - (write_pos - read_pos)
+
+    def used(self) -> int:
+        return self.capacity - self.free()
+
+    def write(self, data) -> bool:
+        """写入数据，空间不足时返回False"""
+        data = memoryview(data)
+        size = len(data)
+        write_pos, read_pos = self._positions()
+        if size > self.capacity - (write_pos - read_pos):
+            return False
+        start = write_pos % self.capacity
+        first = min(size, self.capacity - start)
+        offset = self.HEADER + start
+        self.buf[offset:offset + first] = data[:first]
+        if first < size:
+            self.buf[self.HEADER:self.HEADER + size - first] = data[first:]
+        struct.pack_into("<Q", self.buf, 0, write_pos + size)
+        return True
+
+    def read(self, size: int) -> bytes:
+        """读取 size 字节（调用方保证数据已写入）"""
+        read_pos = self._positions()[1]
+        start = read_pos % self.capacity
+        first = min(size, self.capacity - start)
+        offset = self.HEADER + start
+        data = bytes(self.buf[offset:offset + first])
+        if first < size:
+            data += bytes(self.buf[self.HEADER:self.HEADER + size - first])
+        struct.pack_into("<Q", self.buf, 8, read_pos + size)
+        return data
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+async def write_chunked(ring, conn, kind, turn_id, data):
+    """把数据分段写入环形缓冲区，每段写入后立即发送控制消息
+
+    写入和发送之间没有await，因此缓冲区中的字节顺序与控制消息顺序一致。
+    """
+    view = memoryview(data)
+    piece_size = max(1, ring.capacity // 4)
+    for offset in range(0, len(view), piece_size):
+        piece = view[offset:offset + piece_size]
+        while not ring.write(piece):
+            await asyncio.sleep(RING_POLL_INTERVAL)
+        conn.send((kind, turn_id, len(piece)))
+
+
+# ---------------------------------------------------------------------------
+# worker进程
+# ---------------------------------------------------------------------------
+
+def _worker_main(conn, in_name, out_name):
+    """worker进程入口"""
+    from log_pipeline import setup_logging, stop_logging
+    setup_logging()
+    in_ring = ShmRing(in_name)
+    out_ring = ShmRing(out_name)
+    try:
+        asyncio.run(_worker_loop(conn, in_ring, out_ring))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        in_ring.close()
+        out_ring.close()
+        stop_logging()
+
+
+async def _worker_loop(conn, in_ring, out_ring):
+    from gemini_service import run_turn, build_uri, is_rate_limited
+
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+    buffers = {}
+    tasks = set()
+
+    async def serve_turn(turn_id, key, setup_msg):
+        data = b"".join(buffers.pop(turn_id, []))
+
+        async def on_audio(audio_data):
+            await write_chunked(out_ring, conn, "audio", turn_id, audio_data)
+
+        async def on_text(text):
+            conn.send(("text", turn_id, text))
+
+        async def on_transcript(role, text):
+            conn.send(("transcript", turn_id, role, text))
+
+        try:
+            ok = await run_turn(build_uri(key), data, on_audio, setup_msg, on_text=on_text, on_transcript=on_transcript)
+            conn.send(("done", turn_id, ok))
+        except asyncio.TimeoutError:
+            conn.send(("timeout", turn_id))
+        except Exception as e:
+            logger.error(f"worker {os.getpid()} 处理上游会话时出错: {str(e)}")
+            conn.send(("error", turn_id, str(e), is_rate_limited(e)))
+
+    def on_message():
+        try:
+            while conn.poll():
+                message = conn.recv()
+                kind = message[0]
+                if kind == "chunk":
+                    _, turn_id, size = message
+                    buffers.setdefault(turn_id, []).append(in_ring.read(size))
+                elif kind == "turn":
+                    _, turn_id, key, setup_msg = message
+                    task = asyncio.create_task(serve_turn(turn_id, key, setup_msg))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                elif kind == "stop":
+                    stopped.set()
+        except EOFError:
+            stopped.set()
+
+    loop.add_reader(conn.fileno(), on_message)
+    conn.send(("ready", os.getpid()))
+    logger.info(f"上游worker进程 {os.getpid()} 已启动")
+    await stopped.wait()
+    loop.remove_reader(conn.fileno())
+    for task in tasks:
+        task.cancel()
+
+
+# ---------------------------------------------------------------------------
+# API进程侧
+# ---------------------------------------------------------------------------
+
+class _WorkerHandle:
+    def __init__(self, ctx, index):
+        self.index = index
+        self.in_ring = ShmRing(size=RING_SIZE, create=True)
+        self.out_ring = ShmRing(size=RING_SIZE, create=True)
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.in_ring.name, self.out_ring.name),
+            name=f"gemini-upstream-{index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.ready = False  # 子进程完成导入并开始接收消息后为True
+        self.dead = False  # 管道已断开，子进程已退出
+        self.turn_ids = set()  # 分配在该worker上、尚未结束的轮次
+        self.in_flight = 0
+        self.turns_total = 0
+
+
+class UpstreamWorkerPool:
+    """管理上游worker进程，并把每一轮对话分配给负载最低的worker"""
+
+    def __init__(self, workers: int = UPSTREAM_WORKERS):
+        self.size = workers
+        self.workers = []
+        self.turns = {}
+        self._turn_ids = itertools.count(1)
+        self._ready = None
+        self.startup_error = None
+
+    def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        for index in range(self.size):
+            worker = _WorkerHandle(ctx, index)
+            loop.add_reader(worker.conn.fileno(), self._on_message, worker)
+            self.workers.append(worker)
+        logger.info(f"已启动 {self.size} 个上游worker进程")
+
+    async def stop(self):
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            loop.remove_reader(worker.conn.fileno())
+            try:
+                worker.conn.send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            await asyncio.to_thread(worker.process.join, 5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+            worker.in_ring.close(unlink=True)
+            worker.out_ring.close(unlink=True)
+        self.workers = []
+        for queue in self.turns.values():
+            queue.put_nowait(("error", "上游worker已停止", False))
+
+    def _on_message(self, worker):
+        """读取worker发来的控制消息，并把音频/结果分发给对应的轮次"""
+        try:
+            while worker.conn.poll():
+                message = worker.conn.recv()
+                kind, turn_id = message[0], message[1]
+                if kind == "ready":
+                    worker.ready = True
+                    if all(w.ready for w in self.workers):
+                        self._ready.set()
+                    continue
+                if kind == "audio":
+                    # 无论该轮是否还在等待，都必须读走数据以释放缓冲区
+                    data = worker.out_ring.read(message[2])
+                    event = ("audio", data)
+                elif kind == "text":
+                    event = ("text", message[2])
+                elif kind == "transcript":
+                    event = ("transcript", message[2], message[3])
+                elif kind == "done":
+                    event = ("done", message[2])
+                elif kind == "timeout":
+                    event = ("timeout",)
+                else:
+                    event = ("error", message[2], message[3])
+                queue = self.turns.get(turn_id)
+                if queue is not None:
+                    queue.put_nowait(event)
+        except EOFError:
+            logger.error(f"上游worker {worker.index} 已退出")
+            asyncio.get_running_loop().remove_reader(worker.conn.fileno())
+            worker.dead = True
+            # 该worker上还在进行的轮次不会再收到消息，直接以错误结束
+            for turn_id in worker.turn_ids:
+                queue = self.turns.get(turn_id)
+                if queue is not None:
+                    queue.put_nowait(("error", "上游worker已退出", False))
+            if not worker.ready:
+                self.startup_error = f"上游worker {worker.index} 在启动过程中退出"
+                self._ready.set()
+
+    async def wait_ready(self):
+        """等待所有worker完成启动（spawn方式启动需要重新导入模块，约需数百毫秒）
+
+        有worker在启动过程中退出或超过 READY_TIMEOUT 时抛出 UpstreamWorkerError
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise UpstreamWorkerError("等待上游worker启动超时")
+        if self.startup_error:
+            raise UpstreamWorkerError(self.startup_error)
+
+    async def run_turn(self, key, data, on_audio, setup_msg=None, on_text=None, on_transcript=None):
+        """在worker中完成一轮上游对话，语义与 gemini_service.run_turn 相同"""
+        worker = min(
+            (w for w in self.workers if not w.dead and w.process.is_alive()),
+            key=lambda w: w.in_flight,
+            default=None,
+        )
+        if worker is None:
+            raise UpstreamWorkerError("没有可用的上游worker")
+
+        turn_id = next(self._turn_ids)
+        queue = asyncio.Queue()
+        self.turns[turn_id] = queue
+        worker.turn_ids.add(turn_id)
+        worker.in_flight += 1
+        worker.turns_total += 1
+        try:
+            await write_chunked(worker.in_ring, worker.conn, "chunk", turn_id, data)
+            worker.conn.send(("turn", turn_id, key, setup_msg))
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), TURN_EVENT_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.error(f"上游worker {worker.index} 超过 {TURN_EVENT_TIMEOUT}s 没有响应")
+                    raise
+                if event[0] == "audio":
+                    await on_audio(event[1])
+                elif event[0] == "text":
+                    if on_text is not None:
+                        await on_text(event[1])
+                elif event[0] == "transcript":
+                    if on_transcript is not None:
+                        await on_transcript(event[1], event[2])
+                elif event[0] == "done":
+                    return event[1]
+                elif event[0] == "timeout":
+                    raise asyncio.TimeoutError()
+                else:
+                    raise UpstreamWorkerError(event[1], rate_limited=event[2])
+        finally:
+            worker.in_flight -= 1
+            worker.turn_ids.discard(turn_id)
+            del self.turns[turn_id]
+
+    def metrics(self) -> list:
+        return [
+            {
+                "worker": worker.index,
+                "pid": worker.process.pid,
+                "alive": not worker.dead and worker.process.is_alive(),
+                "ready": worker.ready,
+                "in_flight": worker.in_flight,
+                "turns_total": worker.turns_total,
+                "in_ring_used": worker.in_ring.used(),
+                "out_ring_used": worker.out_ring.used(),
+            }
+            for worker in self.workers
+        ]
+
+
+_upstream_pool = None
+
+
+def get_upstream_pool():
+    """返回已启动的worker进程池，未启用时返回None"""
+    return _upstream_pool
+
+
+def start_upstream_pool():
+    """按配置启动worker进程池（需在事件循环中调用）"""
+    global _upstream_pool
+    if UPSTREAM_WORKERS > 0 and _upstream_pool is None:
+        _upstream_pool = UpstreamWorkerPool(UPSTREAM_WORKERS)
+        _upstream_pool.start()
+    return _upstream_pool
+
+
+async def stop_upstream_pool():
+    global _upstream_pool
+    if _upstream_pool is not None:
+        await _upstream_pool.stop()
+        _upstream_pool = None
@@ -0,0 +1,212 @@
+"""用量计量与每日配额
+
+上游按音频秒数计费。每轮对话在热路径上只累加内存中的计数（发给模型的音频秒数、模型
+回复的音频秒数、轮数），后台任务定期以 upsert 的方式合并进 user_usage 表，不靠统计
+user_logs 的行数。
+
+检查配额时用 user_usage 中已写入的用量（连接时读取一次，之后每隔 USAGE_REFRESH_INTERVAL
+秒刷新，以计入其他worker的用量）加上本worker还没写入的增量，不需要每次都查库。
+USAGE_DAILY_LIMIT_SECONDS 限制的是每个学生每天上行和下行音频的总秒数，为0时不限制。
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.dialects import sqlite, postgresql
+
+from models import UserUsage
+
+logger = logging.getLogger(__name__)
+
+USAGE_DAILY_LIMIT_SECONDS = float(os.getenv("USAGE_DAILY_LIMIT_SECONDS", "0"))  # 每天的音频秒数上限，0表示不限制
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))  # 增量写入用量表的间隔（秒）
+USAGE_REFRESH_INTERVAL = float(os.getenv("USAGE_REFRESH_INTERVAL", "60"))  # 从用量表重新读取已用量的间隔（秒）
+UPLINK_BYTES_PER_SECOND = 16000 * 2  # 16kHz、16位单声道
+DOWNLINK_BYTES_PER_SECOND = 24000 * 2  # 24kHz、16位单声道
+
+_COUNTERS = ("uplink_seconds", "downlink_seconds", "turns")
+
+
+def _today():
+    return datetime.utcnow().date()
+
+
+class UsageMeter:
+    """按 (user_id, day) 累加用量增量，定期合并进用量表，并据此检查每日配额"""
+
+    def __init__(self, limit: float = USAGE_DAILY_LIMIT_SECONDS):
+        self.limit = limit
+        self.pending = {}  # (user_id, day) -> 尚未写入的增量
+        self.stored = {}  # (user_id, day) -> 已写入用量表的用量
+        self.loaded_at = {}  # (user_id, day) -> 上次读取用量表的时间
+        self.rejected = 0
+        self.flushes = 0
+        self.flushing = False
+        self.flush_started = 0  # 开始过的写入次数，用来识别与写入重叠的读取
+        self._flush_task = None
+        self.session_factory = None
+
+    # ---- 热路径：只改内存 ----
+
+    def _delta(self, user_id):
+        return self.pending.setdefault((user_id, _today()), dict.fromkeys(_COUNTERS, 0))
+
+    def add_uplink(self, user_id, size: int):
+        """记录一句发给模型的音频（字节数）"""
+        if user_id is not None:
+            self._delta(user_id)["uplink_seconds"] += size / UPLINK_BYTES_PER_SECOND
+
+    def add_downlink(self, user_id, size: int):
+        """记录一段模型回复的音频（字节数）"""
+        if user_id is not None:
+            self._delta(user_id)["downlink_seconds"] += size / DOWNLINK_BYTES_PER_SECOND
+
+    def add_turn(self, user_id):
+        if user_id is not None:
+            self._delta(user_id)["turns"] += 1
+
+    def used(self, user_id) -> float:
+        """今天已用的音频秒数（已写入的加上本worker未写入的）"""
+        key = (user_id, _today())
+        total = 0.0
+        for counters in (self.stored.get(key), self.pending.get(key)):
+            if counters:
+                total += counters["uplink_seconds"] + counters["downlink_seconds"]
+        return total
+
+    def remaining(self, user_id):
+        """今天剩余的音频秒数，不限制时返回 None"""
+        if self.limit <= 0:
+            return None
+        return max(self.limit - self.used(user_id), 0.0)
+
+    def exceeded(self, user_id) -> bool:
+        return self.limit > 0 and self.used(user_id) >= self.limit
+
+    # ---- 配额检查 ----
+
+    async def refresh(self, user_id):
+        """已用量过期时从用量表重新读取；不限制时不查库"""
+        if self.limit <= 0:
+            return
+        key = (user_id, _today())
+        if time.monotonic() - self.loaded_at.get(key, float("-inf")) >= USAGE_REFRESH_INTERVAL:
+            await self._load(key)
+
+    async def check(self, user_id) -> bool:
+        """返回是否已超出配额（连接时和每句话交给模型之前调用）"""
+        await self.refresh(user_id)
+        if self.exceeded(user_id):
+            self.rejected += 1
+            return True
+        return False
+
+    async def _load(self, key):
+        if self.session_factory is None:
+            return
+        user_id, day = key
+        started = self.flush_started
+        try:
+            async with self.session_factory() as db:
+                row = (await db.execute(
+                    select(UserUsage).where(UserUsage.user_id == user_id, UserUsage.day == day)
+                )).scalar_one_or_none()
+        except Exception as e:
+            # 读不到时沿用缓存中的用量，不因为数据库抖动拒绝学生
+            logger.error(f"读取用量失败: {str(e)}")
+            return
+        if self.flushing or self.flush_started != started:
+            # 写入期间 stored 已经计入了正在写的增量，而读到的行可能还不含这部分，
+            # 直接覆盖会少算；丢弃这次结果，下次检查时再读
+            return
+        self.stored[key] = {name: getattr(row, name) for name in _COUNTERS} if row else dict.fromkeys(_COUNTERS, 0)
+        self.loaded_at[key] = time.monotonic()
+
+    # ---- 写入用量表 ----
+
+    def _upsert(self, dialect_name, rows):
+        insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+        statement = insert(UserUsage).values(rows)
+        table = UserUsage.__table__
+        return statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.day],
+            set_={
+                **{name: table.c[name] + statement.excluded[name] for name in _COUNTERS},
+                "updated_at": statement.excluded.updated_at,
+            },
+        )
+
+    def _merge(self, target, pending, sign=1):
+        for key, delta in pending.items():
+            current = target.setdefault(key, dict.fromkeys(_COUNTERS, 0))
+            for name in _COUNTERS:
+                current[name] += sign * delta[name]
+
+    async def flush(self):
+        """把累计的增量合并进用量表"""
+        if not self.pending or self.session_factory is None:
+            return
+        pending, self.pending = self.pending, {}
+        # 写入期间这部分用量记在已写入一侧，配额检查不会漏算
+        self._merge(self.stored, pending)
+        self.flushing = True
+        self.flush_started += 1
+        now = datetime.utcnow()
+        rows = [
+            {"user_id": user_id, "day": day, "updated_at": now, **delta}
+            for (user_id, day), delta in pending.items()
+        ]
+        try:
+            async with self.session_factory() as db:
+                await db.execute(self._upsert(db.bind.dialect.name, rows))
+                await db.commit()
+            self.flushes += 1
+        except Exception as e:
+            logger.error(f"写入用量失败: {str(e)}")
+            # 放回待写入的增量，下次重试
+            self._merge(self.stored, pending, sign=-1)
+            self._merge(self.pending, pending)
+        finally:
+            self.flushing = False
+        # 只保留今天的缓存
+        today = _today()
+        for key in [key for key in self.stored if key[1] != today]:
+            self.stored.pop(key, None)
+            self.loaded_at.pop(key, None)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+            await self.flush()
+
+    def start(self, session_factory):
+        self.session_factory = session_factory
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    def metrics(self) -> dict:
+        pending = list(self.pending.values())
+        return {
+            "daily_limit_seconds": self.limit or None,
+            "pending_users": len(pending),
+            "pending_seconds": round(sum(d["uplink_seconds"] + d["downlink_seconds"] for d in pending), 1),
+            "cached_users": len(self.stored),
+            "rejected": self.rejected,
+            "flushes": self.flushes,
+        }
+
+
+usage_meter = UsageMeter()